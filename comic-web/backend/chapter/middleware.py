@@ -0,0 +1,37 @@
+import uuid
+
+from django.urls import Resolver404, resolve
+
+from .views import getMangaChapter, getNovelChapter
+from .viewcounts import view_counter
+
+COUNTED_VIEWS = {
+    getMangaChapter: 'manga',
+    getNovelChapter: 'novel',
+}
+
+
+class ChapterViewCountMiddleware:
+    """Counts every successful chapter read, including the ones answered
+    from the page cache, which never reach the view. Must come before
+    ``FetchFromCacheMiddleware``."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method == 'GET' and response.status_code == 200:
+            try:
+                match = resolve(request.path_info)
+            except Resolver404:
+                return response
+            kind = COUNTED_VIEWS.get(match.func)
+            if kind is not None:
+                try:
+                    # Uppercase or unhyphenated IDs route too; the buffer is keyed by the canonical form
+                    chapter_id = uuid.UUID(match.kwargs['pk'])
+                except ValueError:
+                    return response
+                view_counter.record(kind, chapter_id)
+        return response
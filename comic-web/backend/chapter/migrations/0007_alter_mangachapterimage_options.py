@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:14
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chapter', '0006_alter_mangachapter_created_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='mangachapterimage',
+            options={'ordering': ['page']},
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import F
 from manga.models import Manga
 from novel.models import Novel
 import uuid
@@ -15,7 +16,7 @@ class MangaChapter(models.Model):
     manga = models.ForeignKey(Manga, related_name="chapters", on_delete=models.CASCADE)
     title = models.CharField(max_length=255,default="Chương mới")
     chapter_number = models.IntegerField(blank=True, null=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     def __str__(self):
         return f"{self.manga.title}-{self.title} - Chapter {self.chapter_number}"
 class MangaChapterImage(models.Model):
@@ -25,6 +26,8 @@ class MangaChapterImage(models.Model):
     image = models.ImageField(default='',upload_to=chapter_image_upload_path)
     page = models.IntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    class Meta:
+        ordering = ['page']
     def __str__(self):
         return f"Image for {self.chapter.title} - Page {self.page}"
 class NovelChapter(models.Model):
@@ -34,23 +37,24 @@ class NovelChapter(models.Model):
     title = models.CharField(max_length=255,default="Chương mới")
     chapter_number = models.IntegerField(blank=True, null=True)
     content = models.TextField() # nội dung chương
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     def __str__(self):
         return f"{self.novel.title}-{self.title} - Chapter {self.chapter_number}"
     def save(self, *args, **kwargs):
-        if not self.pk:  # Chỉ chạy khi tạo mới, không chạy khi update
+        if self._state.adding:  # Chỉ chạy khi tạo mới, không chạy khi update (pk UUID có sẵn từ default)
             last_chapter = NovelChapter.objects.filter(novel=self.novel).order_by('-chapter_number').first()
             self.chapter_number = (last_chapter.chapter_number + 1) if last_chapter else 1
-            self.novel.numChapters += 1
-            self.novel.save()
+            super().save(*args, **kwargs)
+            # Cộng trực tiếp trong DB, không ghi đè cả dòng Novel
+            Novel.objects.filter(pk=self.novel_id).update(numChapters=F('numChapters') + 1)
+            return
         super().save(*args, **kwargs)
     def delete(self, *args, **kwargs):
         # Lưu số chương hiện tại
         current_number = self.chapter_number
         
         # Giảm số chương của novel
-        self.novel.numChapters -= 1
-        self.novel.save()
+        Novel.objects.filter(pk=self.novel_id).update(numChapters=F('numChapters') - 1)
 
         # Xóa chapter hiện tại
         # Gọi delete gốc
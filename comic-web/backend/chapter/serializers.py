@@ -14,7 +14,8 @@ class MangaChapterDetailSerializer(serializers.ModelSerializer):
         model = MangaChapter
         fields = '__all__'
     def get_chapterImages(self, obj):
-        images = MangaChapterImage.objects.filter(chapter=obj)
+        # Dùng ảnh đã prefetch trong view, xếp theo trang (Meta.ordering)
+        images = obj.images.all()
         serializer = MangaChapterImageSerializer(images, many=True)
         return serializer.data
 class NovelChapterListSerializer(serializers.ModelSerializer):
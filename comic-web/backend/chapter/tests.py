@@ -1,3 +1,96 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from manga.models import Manga
+from novel.models import Novel
+from testutils.querybudget import no_page_cache
+from .models import MangaChapter, MangaChapterImage, NovelChapter
+from .viewcounts import ViewCounter
+
+
+@no_page_cache
+@mock.patch('chapter.middleware.view_counter')
+class ChapterQueryBudgetTests(TestCase):
+    """Số query khi đọc chương không được tăng theo số chương hay số ảnh."""
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create(id=1, username='uploader')
+        cls.manga = Manga.objects.create(title='Manga', author='Tác giả', description='...')
+        cls.novel = Novel.objects.create(title='Novel', author='Tác giả', description='...')
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_manga_chapter(self, view_counter):
+        for pages in (2, 30):
+            chapter = MangaChapter.objects.create(manga=self.manga, chapter_number=pages)
+            for page in reversed(range(1, pages + 1)):
+                MangaChapterImage.objects.create(chapter=chapter, page=page)
+            # chương + ảnh
+            with self.assertNumQueries(2):
+                response = self.client.get(f'/api/manga/chapter/{chapter.pk}/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([image['page'] for image in response.data['chapterImages']],
+                             list(range(1, pages + 1)))
+        view_counter.record.assert_called_with('manga', chapter.pk)
+
+    def test_chapter_lists(self, view_counter):
+        for count in (2, 30):
+            for _ in range(count):
+                MangaChapter.objects.create(manga=self.manga)
+                NovelChapter.objects.create(novel=self.novel, content='...')
+            with self.assertNumQueries(1):
+                self.assertEqual(self.client.get(f'/api/manga/{self.manga.pk}/chapters').status_code, 200)
+            with self.assertNumQueries(1):
+                self.assertEqual(self.client.get(f'/api/novel/{self.novel.pk}/chapters').status_code, 200)
+
+    def test_novel_chapter(self, view_counter):
+        chapter = NovelChapter.objects.create(novel=self.novel, content='...')
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/novel/chapter/{chapter.pk}/')
+        self.assertEqual(response.status_code, 200)
+
+
+@no_page_cache
+@mock.patch('chapter.viewcounts.atexit')
+@mock.patch('chapter.viewcounts.threading.Thread')
+class ChapterViewCountTests(TestCase):
+    """Lượt đọc được gom trong bộ đệm và ghi bằng một UPDATE cho mỗi truyện."""
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create(id=1, username='uploader')
+        cls.manga = Manga.objects.create(title='Manga', author='Tác giả', description='...', numViews=10)
+        cls.novel = Novel.objects.create(title='Novel', author='Tác giả', description='...', numViews=None)
+        cls.manga_chapters = [MangaChapter.objects.create(manga=cls.manga, chapter_number=i) for i in range(2)]
+        cls.novel_chapter = NovelChapter.objects.create(novel=cls.novel, content='...')
+
+    def test_flush(self, thread, atexit):
+        counter = ViewCounter(interval=60)
+        for chapter in self.manga_chapters:
+            counter.record('manga', chapter.pk)
+            counter.record('manga', str(chapter.pk))
+        counter.record('novel', self.novel_chapter.pk)
+        thread.return_value.start.assert_called_once_with()
+        counter.flush()
+        self.manga.refresh_from_db()
+        self.novel.refresh_from_db()
+        self.assertEqual((self.manga.numViews, self.novel.numViews), (14, 1))
+        with self.assertNumQueries(0):
+            counter.flush()
 
-# Create your tests here.
+    def test_middleware_counts_every_id_spelling(self, thread, atexit):
+        counter = ViewCounter(interval=60)
+        chapter = self.manga_chapters[0]
+        with mock.patch('chapter.middleware.view_counter', counter):
+            for pk in (str(chapter.pk), str(chapter.pk).upper(), chapter.pk.hex):
+                self.assertEqual(self.client.get(f'/api/manga/chapter/{pk}/').status_code, 200)
+            self.client.get('/api/manga/chapter/not-a-uuid/')
+            self.client.get(f'/api/manga/{self.manga.pk}/chapters')
+        counter.flush()
+        self.manga.refresh_from_db()
+        self.assertEqual(self.manga.numViews, 13)
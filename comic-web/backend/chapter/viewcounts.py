@@ -0,0 +1,89 @@
+import atexit
+import logging
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+
+from manga.models import Manga
+from novel.models import Novel
+from .models import MangaChapter, NovelChapter
+
+logger = logging.getLogger(__name__)
+
+# kind -> (chapter model, FK field of the title, title model)
+SOURCES = {
+    'manga': (MangaChapter, 'manga_id', Manga),
+    'novel': (NovelChapter, 'novel_id', Novel),
+}
+
+
+class ViewCounter:
+    """Write-behind buffer of chapter reads.
+
+    ``record`` only bumps an in-process counter per chapter, so reading a
+    chapter costs no database write. A background thread flushes the
+    buffer every ``interval`` seconds: the chapters are mapped to their
+    titles with one query per kind and each title gets
+    ``numViews = numViews + n`` as a single ``UPDATE``, one per distinct
+    ``n``. The increments are relative, so the backend replicas never
+    overwrite each other's counts.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval or getattr(settings, 'VIEW_COUNT_FLUSH_SECONDS', 5)
+        self._pending = defaultdict(Counter)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def record(self, kind, chapter_id):
+        with self._lock:
+            self._pending[kind][str(chapter_id)] += 1
+            if self._thread is None:
+                # Started on first use so management commands never spawn it
+                self._thread = threading.Thread(target=self._run, name='view-counter', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(Counter)
+        if not pending:
+            return
+        try:
+            with transaction.atomic():
+                for kind, chapters in pending.items():
+                    self._apply(kind, chapters)
+        except Exception as e:
+            logger.error(f"Failed to flush chapter views: {e}")
+            # Keep the counts for the next flush
+            with self._lock:
+                for kind, chapters in pending.items():
+                    self._pending[kind].update(chapters)
+
+    @staticmethod
+    def _apply(kind, chapters):
+        chapter_model, title_field, title_model = SOURCES[kind]
+        per_title = Counter()
+        for chapter_id, title_id in chapter_model.objects.filter(pk__in=list(chapters)).values_list('pk', title_field):
+            per_title[title_id] += chapters[str(chapter_id)]
+        by_increment = defaultdict(list)
+        for title_id, views in per_title.items():
+            by_increment[views].append(title_id)
+        for views, title_ids in by_increment.items():
+            title_model.objects.filter(pk__in=title_ids).update(numViews=Coalesce(F('numViews'), Value(0)) + views)
+
+
+view_counter = ViewCounter()
@@ -13,9 +13,8 @@ from django.views.decorators.cache import cache_page
 @permission_classes([AllowAny])
 def getMangaChapter(request, pk):
         try:
-            chapter = MangaChapter.objects.get(_id=pk)
-            chapter.manga.numViews += 1
-            chapter.save()
+            chapter = MangaChapter.objects.prefetch_related('images').get(_id=pk)
+            # numViews is counted by ChapterViewCountMiddleware
             serializer = MangaChapterDetailSerializer(chapter)
             return Response(serializer.data)
         except MangaChapter.DoesNotExist:
@@ -38,8 +37,7 @@ def getMangaChapterList(request, pk):
 def getNovelChapter(request, pk):
     try:
         chapter = NovelChapter.objects.get(_id=pk)
-        chapter.novel.numViews += 1
-        chapter.save()
+        # numViews is counted by ChapterViewCountMiddleware
         serializer = NovelChapterDetailSerializer(chapter)
         return Response(serializer.data)
     except Exception as e:
@@ -0,0 +1,194 @@
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from chapter.models import MangaChapter, NovelChapter
+from counters.models import CounterShard, ReconciliationMark
+from counters.sharded import COUNTER_NAMES, TITLE_MODELS
+from users.models import Comments, Favorite, Likes
+
+# title type -> (chapter model, its title FK)
+CHAPTERS = {
+    'novel': (NovelChapter, 'novel_id'),
+    'manga': (MangaChapter, 'manga_id'),
+}
+# counter -> (model, title ID field, created_at field)
+ENGAGEMENT = {
+    'numLikes': (Likes, 'story_id', 'created_at'),
+    'numFavorites': (Favorite, 'story_id', 'createdAt'),
+    'numComments': (Comments, 'post_id', 'created_at'),
+}
+FIELDS = ('numChapters',) + COUNTER_NAMES
+# Rows committed late with an older timestamp are still picked up by the next run
+OVERLAP = timedelta(minutes=5)
+# Every backend replica runs the command; the one holding the lease reconciles, the others skip.
+# The lease is renewed after each chunk, so it only lapses if its holder stops.
+LEASE_NAME = 'lease'
+LEASE = timedelta(minutes=10)
+
+
+def _title_ids(values):
+    ids = set()
+    for value in values:
+        try:
+            ids.add(uuid.UUID(str(value)))
+        except ValueError:
+            pass
+    return ids
+
+
+class Command(BaseCommand):
+    help = ("Recompute numChapters, numLikes, numFavorites and numComments of titles from the "
+            "chapter, like, favorite and comment tables. The first run only records where to start; "
+            "for a one-off backfill run it once with --full (and --exact once the tables hold "
+            "every historical like, favorite and comment)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='check every title, not only those changed since the last run (with --exact, catches deletions)')
+        parser.add_argument('--exact', action='store_true',
+                            help='also lower likes, favorites and comments to the row counts')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--every', type=int, default=0, metavar='SECONDS',
+                            help='keep running, once every SECONDS')
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                self.run_once(options)
+            except Exception as e:
+                if not options['every']:
+                    raise
+                # The high-water mark was not moved, the next run retries these titles
+                self.stderr.write(f"Reconciliation failed: {e}")
+            if not options['every']:
+                return
+            time.sleep(options['every'])
+
+    def run_once(self, options):
+        if not self._acquire_lease():
+            self.stdout.write("Another reconcile_counters run holds the lease, skipping")
+            return
+        try:
+            for title_type in TITLE_MODELS:
+                self.reconcile(title_type, options['full'], options['chunk_size'], options['exact'])
+        finally:
+            ReconciliationMark.objects.filter(name=LEASE_NAME).update(value=timezone.now())
+
+    @staticmethod
+    def _acquire_lease():
+        now = timezone.now()
+        ReconciliationMark.objects.get_or_create(name=LEASE_NAME, defaults={'value': now})
+        # Compare-and-set: only one run sees the expired lease and moves it
+        return bool(ReconciliationMark.objects.filter(name=LEASE_NAME, value__lte=now).update(value=now + LEASE))
+
+    @staticmethod
+    def _renew_lease():
+        ReconciliationMark.objects.filter(name=LEASE_NAME).update(value=timezone.now() + LEASE)
+
+    def reconcile(self, title_type, full, chunk_size, exact=False):
+        started = time.monotonic()
+        run_started_at = timezone.now()
+        mark = ReconciliationMark.objects.filter(name=title_type).first()
+        if full:
+            chunks = self._all_titles(title_type, chunk_size)
+        elif mark is None:
+            # First run: titles changed from now on are checked, the others only by --full
+            chunks = []
+        else:
+            changed = sorted(self._changed_titles(title_type, mark.value - OVERLAP))
+            chunks = (changed[i:i + chunk_size] for i in range(0, len(changed), chunk_size))
+        checked = corrected = 0
+        for title_ids in chunks:
+            checked += len(title_ids)
+            corrected += self._reconcile_chunk(title_type, title_ids, exact)
+            self._renew_lease()
+        ReconciliationMark.objects.update_or_create(name=title_type, defaults={'value': run_started_at})
+        self.stdout.write(f"{title_type}: checked {checked} titles, corrected {corrected} "
+                          f"in {time.monotonic() - started:.2f}s")
+
+    @staticmethod
+    def _all_titles(title_type, chunk_size):
+        model = TITLE_MODELS[title_type]
+        last = None
+        while True:
+            titles = model.objects.order_by('pk')
+            if last is not None:
+                titles = titles.filter(pk__gt=last)
+            title_ids = list(titles.values_list('pk', flat=True)[:chunk_size])
+            if not title_ids:
+                return
+            yield title_ids
+            last = title_ids[-1]
+
+    @staticmethod
+    def _changed_titles(title_type, since):
+        """Titles edited, or with a chapter, like, favorite or comment added, since ``since``."""
+        changed = set(TITLE_MODELS[title_type].objects.filter(updated_at__gte=since).values_list('pk', flat=True))
+        chapter_model, title_field = CHAPTERS[title_type]
+        changed.update(chapter_model.objects.filter(created_at__gte=since).values_list(title_field, flat=True))
+        for model, id_field, created_field in ENGAGEMENT.values():
+            changed |= _title_ids(model.objects.filter(type=title_type, **{f'{created_field}__gte': since})
+                                  .values_list(id_field, flat=True).distinct())
+        # Titles with unfolded shards, so their totals are recomputed too
+        changed.update(CounterShard.objects.filter(title_type=title_type).exclude(value=0)
+                       .values_list('title_id', flat=True).distinct())
+        return changed
+
+    @staticmethod
+    def _reconcile_chunk(title_type, title_ids, exact=False):
+        """Set the chunk's counters to what the source tables say, with one
+        grouped query per counter. Returns the number of titles corrected.
+        Unless ``exact``, likes, favorites and comments are only raised: those
+        from before the Likes, Favorite and Comments rows were kept are only in
+        the counters, so a counter (with its unfolded shards) above the row
+        count keeps its value.
+
+        The titles and their shards are locked before counting, so an
+        increment cannot land in a shard between the count and the shard
+        delete; it waits and goes to a fresh shard after the commit. Likes,
+        favorites and comments are created in the same transaction as their
+        increment, so a row is either counted here or in a shard, not both.
+        """
+        chapter_model, title_field = CHAPTERS[title_type]
+        with transaction.atomic():
+            titles = list(TITLE_MODELS[title_type].objects.select_for_update()
+                          .filter(pk__in=title_ids).only('pk', *FIELDS))
+            shards = list(CounterShard.objects.select_for_update()
+                          .filter(title_type=title_type, title_id__in=title_ids)
+                          .values_list('pk', 'title_id', 'name', 'value'))
+            pending = {}
+            for _, title_id, name, value in shards:
+                pending[title_id, name] = pending.get((title_id, name), 0) + value
+            actual = {field: {} for field in FIELDS}
+            actual['numChapters'] = dict(chapter_model.objects.filter(**{f'{title_field}__in': title_ids})
+                                         .values_list(title_field).annotate(n=Count('pk')).order_by())
+            keys = [str(title_id) for title_id in title_ids]
+            for field, (model, id_field, _) in ENGAGEMENT.items():
+                rows = (model.objects.filter(type=title_type, **{f'{id_field}__in': keys})
+                        .values_list(id_field).annotate(n=Count('pk')).order_by())
+                actual[field] = {uuid.UUID(key): n for key, n in rows}
+            # The counters become exact, so the increments waiting in the shards are dropped
+            CounterShard.objects.filter(pk__in=[pk for pk, _, _, _ in shards]).delete()
+            corrections, changed_fields = [], set()
+            for title in titles:
+                changed = False
+                for field in FIELDS:
+                    value = actual[field].get(title.pk, 0)
+                    if field in COUNTER_NAMES and not exact:
+                        value = max(value, (getattr(title, field) or 0) + pending.get((title.pk, field), 0))
+                    if getattr(title, field) != value:
+                        setattr(title, field, value)
+                        changed_fields.add(field)
+                        changed = True
+                if changed:
+                    corrections.append(title)
+            if corrections:
+                # Only the columns that drifted, the CASE expressions grow with each one
+                TITLE_MODELS[title_type].objects.bulk_update(corrections, sorted(changed_fields), batch_size=500)
+        return len(corrections)
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CounterShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title_type', models.CharField(choices=[('novel', 'Tiểu thuyết'), ('manga', 'Manga')], max_length=20)),
+                ('title_id', models.UUIDField()),
+                ('name', models.CharField(max_length=32)),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='countershard',
+            constraint=models.UniqueConstraint(fields=('title_type', 'title_id', 'name', 'shard'), name='unique_counter_shard'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import models
+
+
+class CounterShard(models.Model):
+    """One of the ``COUNTER_SHARDS`` rows a title's engagement counter is
+    spread over. Increments go to a random shard so concurrent likes on a
+    popular title do not queue on a single row; see counters/sharded.py."""
+    TITLE_TYPES = [
+        ('novel', 'Tiểu thuyết'),
+        ('manga', 'Manga'),
+    ]
+    title_type = models.CharField(max_length=20, choices=TITLE_TYPES)
+    title_id = models.UUIDField()
+    name = models.CharField(max_length=32)  # numLikes, numFavorites hoặc numComments
+    shard = models.PositiveSmallIntegerField()
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['title_type', 'title_id', 'name', 'shard'], name='unique_counter_shard'),
+        ]
+
+    def __str__(self):
+        return f"{self.title_type} {self.title_id} {self.name}[{self.shard}] = {self.value}"
+
+
+class ReconciliationMark(models.Model):
+    """High-water mark of ``manage.py reconcile_counters``: the start of
+    its last successful run, per title type. The ``lease`` row holds the
+    time until which a running reconciliation keeps the others out."""
+    name = models.CharField(max_length=32, unique=True)
+    value = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
@@ -0,0 +1,122 @@
+import atexit
+import logging
+import random
+import threading
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Coalesce
+
+from manga.models import Manga
+from novel.models import Novel
+from .models import CounterShard
+
+logger = logging.getLogger(__name__)
+
+TITLE_MODELS = {
+    'novel': Novel,
+    'manga': Manga,
+}
+COUNTER_NAMES = ('numLikes', 'numFavorites', 'numComments')
+
+
+def _cache_key(title_type, title_id, name):
+    return f'counter:{title_type}:{title_id}:{name}'
+
+
+def increment(title_type, title_id, name, delta=1):
+    """Atomically add ``delta`` to a title's counter.
+
+    Returns False for titles that have no counters (audio, forum posts or
+    a ``story_id`` that is not a title ID).
+    """
+    if title_type not in TITLE_MODELS or name not in COUNTER_NAMES:
+        return False
+    try:
+        title_id = uuid.UUID(str(title_id))
+    except ValueError:
+        return False
+    key = dict(title_type=title_type, title_id=title_id, name=name,
+               shard=random.randrange(settings.COUNTER_SHARDS))
+    if not CounterShard.objects.filter(**key).update(value=F('value') + delta):
+        try:
+            with transaction.atomic():
+                CounterShard.objects.create(value=delta, **key)
+        except IntegrityError:
+            # Another request created the shard first
+            CounterShard.objects.filter(**key).update(value=F('value') + delta)
+    cache.delete(_cache_key(title_type, title_id, name))
+    folder.ensure_started()
+    return True
+
+
+def total(title_type, title_id, name):
+    """The title's counter: its column plus the shards not folded into it yet, cached briefly."""
+    def compute():
+        model = TITLE_MODELS[title_type]
+        stored = model.objects.filter(pk=title_id).values_list(name, flat=True).first() or 0
+        pending = CounterShard.objects.filter(title_type=title_type, title_id=title_id, name=name) \
+            .aggregate(value=Sum('value'))['value'] or 0
+        return stored + pending
+    return cache.get_or_set(_cache_key(title_type, title_id, name), compute, settings.COUNTER_CACHE_SECONDS)
+
+
+def fold(batch_size=5000):
+    """Move the shard values into the title columns the serializers read.
+
+    Column and shards change in one transaction and the shards are
+    decremented by what was folded rather than reset, so increments made
+    meanwhile are kept. Returns the number of shards folded.
+    """
+    with transaction.atomic():
+        shards = list(CounterShard.objects.select_for_update().exclude(value=0)
+                      .values_list('pk', 'title_type', 'title_id', 'name', 'value')[:batch_size])
+        per_title = defaultdict(lambda: defaultdict(int))
+        by_value = defaultdict(list)
+        for pk, title_type, title_id, name, value in shards:
+            per_title[(title_type, name)][title_id] += value
+            by_value[value].append(pk)
+        for (title_type, name), sums in per_title.items():
+            by_delta = defaultdict(list)
+            for title_id, delta in sums.items():
+                by_delta[delta].append(title_id)
+            for delta, title_ids in by_delta.items():
+                TITLE_MODELS[title_type].objects.filter(pk__in=title_ids).update(
+                    **{name: Coalesce(F(name), Value(0)) + delta})
+        for value, pks in by_value.items():
+            CounterShard.objects.filter(pk__in=pks).update(value=F('value') - value)
+    return len(shards)
+
+
+class CounterFolder:
+    """Background thread folding the shards every ``COUNTER_FOLD_SECONDS``,
+    started by the first increment of the process."""
+
+    def __init__(self):
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='counter-folder', daemon=True)
+                self._thread.start()
+                atexit.register(self._stop.set)
+
+    def _run(self):
+        while not self._stop.wait(settings.COUNTER_FOLD_SECONDS):
+            try:
+                fold()
+            except Exception as e:
+                # Another replica is folding; the shards keep their values until the next run
+                logger.warning(f"Failed to fold counters: {e}")
+
+
+folder = CounterFolder()
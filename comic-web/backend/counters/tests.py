@@ -0,0 +1,180 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from chapter.models import NovelChapter
+from novel.models import Novel
+from users.models import Comments, Favorite, JWTKey, Likes
+from users.views import create_jwt
+from . import sharded
+from .models import CounterShard, ReconciliationMark
+
+
+# Không chạy luồng gộp counter trong test, fold() được gọi trực tiếp
+@mock.patch('counters.sharded.folder')
+class ShardedCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create(id=1, username='uploader')
+        cls.novel = Novel.objects.create(title='Novel', author='Tác giả', description='...', numFavorites=2)
+
+    def test_increment_fold_total(self, folder):
+        for _ in range(5):
+            self.assertTrue(sharded.increment('novel', self.novel.pk, 'numFavorites'))
+        sharded.increment('novel', self.novel.pk, 'numFavorites', -1)
+        self.assertEqual(sharded.total('novel', self.novel.pk, 'numFavorites'), 6)
+        self.assertTrue(folder.ensure_started.called)
+
+        self.assertGreater(sharded.fold(), 0)
+        self.novel.refresh_from_db()
+        self.assertEqual(self.novel.numFavorites, 6)
+        self.assertFalse(CounterShard.objects.exclude(value=0).exists())
+        self.assertEqual(sharded.total('novel', self.novel.pk, 'numFavorites'), 6)
+        self.assertEqual(sharded.fold(), 0)
+
+    def test_titles_without_counters(self, folder):
+        self.assertFalse(sharded.increment('forum', self.novel.pk, 'numLikes'))
+        self.assertFalse(sharded.increment('novel', 'not-a-uuid', 'numLikes'))
+        self.assertFalse(sharded.increment('novel', self.novel.pk, 'numViews'))
+        self.assertFalse(CounterShard.objects.exists())
+
+
+@mock.patch('counters.sharded.folder')
+class IdempotentEngagementTests(TestCase):
+    """Qua đúng các URL frontend gọi, đăng nhập bằng cookie access_token như trình duyệt."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(id=1, username='reader')
+        cls.jwt_key = JWTKey.objects.create(user=cls.user, key='user_1_key', secret='s' * 32)
+        cls.novel = Novel.objects.create(title='Novel', author='Tác giả', description='...')
+
+    def setUp(self):
+        # total() được cache, mà các test dùng lại cùng một truyện
+        cache.clear()
+        self.client = APIClient()
+        access_token, _ = create_jwt(self.user, self.jwt_key.key, self.jwt_key.secret)
+        self.client.cookies['access_token'] = access_token
+
+    def test_favorite_counts_once_per_user(self, folder):
+        for _ in range(3):
+            response = self.client.put(f'/api/novel/{self.novel.pk}/updateNumFavorite/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['numFavorites'], 1)
+        response = self.client.post('/api/user/favorite/', {'story_id': str(self.novel.pk), 'type': 'novel'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Favorite.objects.filter(story_id=str(self.novel.pk)).count(), 1)
+        self.assertEqual(sharded.total('novel', self.novel.pk, 'numFavorites'), 1)
+
+    def test_without_a_valid_cookie_favorite_is_refused(self, folder):
+        self.client.cookies['access_token'] = 'not-a-token'
+        response = self.client.put(f'/api/novel/{self.novel.pk}/updateNumFavorite/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(sharded.total('novel', self.novel.pk, 'numFavorites'), 0)
+
+    def test_comments_are_counted_once_when_created(self, folder):
+        response = self.client.post('/api/user/comment/', {'post_id': str(self.novel.pk), 'type': 'novel',
+                                                           'content': 'Hay'})
+        self.assertEqual(response.status_code, 201)
+        for _ in range(2):
+            response = self.client.put(f'/api/novel/{self.novel.pk}/updateNumComments/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['numComments'], 1)
+
+    def test_like_counts_once_and_unlike_once(self, folder):
+        for _ in range(2):
+            response = self.client.post('/api/user/like/', {'story_id': str(self.novel.pk), 'type': 'novel'})
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(Likes.objects.count(), 1)
+        self.assertEqual(sharded.total('novel', self.novel.pk, 'numLikes'), 1)
+
+        like = Likes.objects.get()
+        for status in (204, 404):
+            self.assertEqual(self.client.delete(f'/api/user/like/{like.pk}/').status_code, status)
+        self.assertEqual(sharded.total('novel', self.novel.pk, 'numLikes'), 0)
+
+
+class ReconcileCountersTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(id=1, username='reader')
+        cls.novel = Novel.objects.create(title='Novel', author='Tác giả', description='...')
+        cls.other = Novel.objects.create(title='Other', author='Tác giả', description='...')
+        for i in range(3):
+            NovelChapter.objects.create(novel=cls.novel, content='...')
+        story_id = str(cls.novel.pk)
+        Likes.objects.create(user=cls.user, story_id=story_id, type='novel')
+        Favorite.objects.create(user=cls.user, story_id=story_id, type='novel')
+        Comments.objects.bulk_create([Comments(user=cls.user, post_id=story_id, type='novel') for _ in range(2)])
+        Likes.objects.create(user=cls.user, story_id=story_id, type='manga')
+
+    def reconcile(self, *args):
+        out = StringIO()
+        call_command('reconcile_counters', *args, stdout=out)
+        return out.getvalue()
+
+    def counters(self, novel):
+        novel.refresh_from_db()
+        return novel.numChapters, novel.numLikes, novel.numFavorites, novel.numComments
+
+    def test_first_run_only_records_the_mark(self):
+        Novel.objects.filter(pk=self.novel.pk).update(numLikes=500)
+        self.assertIn('novel: checked 0 titles', self.reconcile())
+        self.assertEqual(self.counters(self.novel)[1], 500)
+        self.assertTrue(ReconciliationMark.objects.filter(name='novel').exists())
+
+    def test_full_run_only_raises_engagement_counters(self):
+        # Likes from before the Likes table are only in the counter
+        Novel.objects.filter(pk=self.novel.pk).update(numChapters=0, numLikes=7, numFavorites=None, numComments=1)
+        CounterShard.objects.create(title_type='novel', title_id=self.novel.pk, name='numLikes', shard=0, value=5)
+        self.reconcile('--full')
+        self.assertEqual(self.counters(self.novel), (3, 12, 1, 2))
+        self.assertFalse(CounterShard.objects.exists())
+
+    def test_exact_full_run_fixes_drift_and_drops_shards(self):
+        Novel.objects.filter(pk=self.novel.pk).update(numChapters=0, numLikes=7, numFavorites=None)
+        CounterShard.objects.create(title_type='novel', title_id=self.novel.pk, name='numLikes', shard=0, value=5)
+        self.reconcile('--full', '--exact')
+        self.assertEqual(self.counters(self.novel), (3, 1, 1, 2))
+        self.assertEqual(self.counters(self.other), (0, 0, 0, 0))
+        self.assertFalse(CounterShard.objects.exists())
+        self.assertIn('novel: checked 2 titles', self.reconcile('--full'))
+
+    def test_incremental_run_checks_changed_titles_only(self):
+        def move_mark_past_fixtures():
+            # Everything in the fixtures was created within OVERLAP of the last run
+            ReconciliationMark.objects.filter(name='novel').update(value=timezone.now() + timedelta(hours=1))
+
+        self.reconcile()
+        move_mark_past_fixtures()
+        Novel.objects.filter(pk=self.other.pk).update(numLikes=9)
+        self.assertIn('novel: checked 0 titles', self.reconcile())
+        self.assertEqual(self.counters(self.other)[1], 9)
+        # Unfolded shards mark a title as changed, and are folded in
+        move_mark_past_fixtures()
+        CounterShard.objects.create(title_type='novel', title_id=self.other.pk, name='numLikes', shard=0, value=1)
+        self.assertIn('novel: checked 1 titles, corrected 1', self.reconcile())
+        self.assertEqual(self.counters(self.other)[1], 10)
+        self.assertFalse(CounterShard.objects.exists())
+        move_mark_past_fixtures()
+        CounterShard.objects.create(title_type='novel', title_id=self.other.pk, name='numLikes', shard=0, value=1)
+        self.assertIn('novel: checked 1 titles, corrected 1', self.reconcile('--exact'))
+        self.assertEqual(self.counters(self.other)[1], 0)
+
+    def test_skips_while_another_run_holds_the_lease(self):
+        ReconciliationMark.objects.create(name='lease', value=timezone.now() + timedelta(minutes=5))
+        Novel.objects.filter(pk=self.novel.pk).update(numChapters=0)
+        self.assertIn('holds the lease', self.reconcile('--full'))
+        self.assertEqual(self.counters(self.novel)[0], 0)
+        ReconciliationMark.objects.filter(name='lease').update(value=timezone.now() - timedelta(seconds=1))
+        self.reconcile('--full')
+        self.assertEqual(self.counters(self.novel)[0], 3)
+        # Released at the end of the run
+        self.assertLessEqual(ReconciliationMark.objects.get(name='lease').value, timezone.now())
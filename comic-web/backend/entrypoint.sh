@@ -1,4 +1,9 @@
 #!/bin/sh
 python manage.py makemigrations
 python manage.py migrate
+python manage.py rebuild_search_index
+# Recompute the denormalized title counters every 5 minutes (counters/management/commands/reconcile_counters.py),
+# restarted if it ever exits. Replicas sharing a database take turns through the command's lease.
+# Its first run only records where to start; backfill by hand once with `reconcile_counters --full`.
+(while true; do python manage.py reconcile_counters --every 300; sleep 30; done) &
 python manage.py runserver 0.0.0.0:8080
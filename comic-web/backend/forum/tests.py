@@ -1,3 +1,36 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from testutils.querybudget import no_page_cache
+from .models import Comment, Post
+
+
+@no_page_cache
+class PostQueryBudgetTests(TestCase):
+    """Số query của diễn đàn không được tăng theo số bài viết hay bình luận."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='reader'))
+
+    def add_posts(self, count, comments):
+        for i in range(count):
+            post = Post.objects.create(title=f'Post {i}', content='...')
+            Comment.objects.bulk_create(Comment(post=post, content=f'{j}') for j in range(comments))
+        return post
+
+    def test_list(self):
+        # count + page + bình luận
+        for posts, comments, limit in ((2, 1, 5), (30, 5, 25)):
+            self.add_posts(posts, comments)
+            with self.assertNumQueries(3):
+                response = self.client.get('/api/posts/', {'limit': limit})
+            self.assertEqual(response.status_code, 200)
+
+    def test_detail(self):
+        post = self.add_posts(1, 20)
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/posts/{post.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['comments']), 20)
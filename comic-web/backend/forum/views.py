@@ -1,16 +1,20 @@
 from django.shortcuts import render
 
 # Create your views here.
+from django.db.models import Prefetch
 from rest_framework import generics
 from .models import Post, Comment
 from .serializers import PostSerializer, CommentSerializer
 
+# Bình luận của cả trang được lấy bằng một query, theo thứ tự thời gian
+COMMENTS_PREFETCH = Prefetch('comments', queryset=Comment.objects.order_by('created_at'))
+
 class PostListCreateView(generics.ListCreateAPIView):
-    queryset = Post.objects.all().order_by('-created_at')
+    queryset = Post.objects.prefetch_related(COMMENTS_PREFETCH).order_by('-created_at')
     serializer_class = PostSerializer
 
 class PostRetrieveView(generics.RetrieveAPIView):
-    queryset = Post.objects.all()
+    queryset = Post.objects.prefetch_related(COMMENTS_PREFETCH)
     serializer_class = PostSerializer
 
 class CommentCreateView(generics.CreateAPIView):
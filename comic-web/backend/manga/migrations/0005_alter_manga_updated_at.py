@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manga', '0004_manga_uploader'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='manga',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -22,7 +22,7 @@ class Manga(models.Model):
     description = models.TextField()
     cover_image = models.ImageField(upload_to='manga_covers/', default='manga_covers/default.jpg', blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     genres = models.ManyToManyField(
         Genre, related_name='manga_genres', blank=True)
     source = models.CharField(max_length=255,default='Không rõ')
@@ -1,3 +1,10 @@
 from django.test import TestCase
 
-# Create your tests here.
+from testutils.querybudget import TitleQueryBudgetMixin, no_page_cache
+from .models import Manga
+
+
+@no_page_cache
+class MangaQueryBudgetTests(TitleQueryBudgetMixin, TestCase):
+    model = Manga
+    url = '/api/manga/'
@@ -1,15 +1,19 @@
 from .models import Manga
+from genres.models import Genre
+from search.index import search
 from django.shortcuts import render
 from rest_framework import viewsets
 from django.http import HttpResponse
-from django.db.models import Value, IntegerField, Case, When, Q, Count
+from django.db.models import Q, Count, Prefetch
 from .serializers import MangaSerializer
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny,IsAuthenticated,IsAdminUser
+# Thể loại của cả trang được lấy bằng một query, thay vì một query mỗi truyện
+GENRES_PREFETCH = Prefetch('genres', queryset=Genre.objects.order_by('name'))
 # get,delete,post
 class MangaViewSet(viewsets.ModelViewSet):
-    queryset = Manga.objects.all()
+    queryset = Manga.objects.prefetch_related(GENRES_PREFETCH)
     serializer_class = MangaSerializer
     permission_classes = [AllowAny]
     def perform_create(self, serializer):
@@ -19,19 +23,10 @@ class MangaViewSet(viewsets.ModelViewSet):
         q = self.request.query_params.get('q')
         if not q:
             return queryset
-        keyword = q.strip().split()
-        query = Q()
-        relevance = Value(0, output_field=IntegerField())
-        for kw in keyword:
-            query |= Q(title__icontains=kw)
-            query |= Q(author__icontains=kw)
-            relevance = relevance + Case(
-                When(title__icontains=kw, then=Value(10)),       # ưu tiên title
-                When(author__icontains=kw, then=Value(5)),
-                default=Value(0),
-                output_field=IntegerField()
-            )
-        return queryset.filter(query).annotate(score=relevance).order_by('-score')
+        if self.action != 'list':
+            return queryset
+        # Chỉ mục từ khóa (search app): bỏ dấu tiếng Việt, xếp hạng BM25, chỉ tải truyện của trang hiện tại
+        return search(queryset, q)
     # def get_permissions(self):
     #     if self.action in ['list', 'retrieve']:  # GET requests
     #         return [AllowAny()]
@@ -46,7 +41,7 @@ def advanced_search(request):
     author = request.GET.get("author")
     status = request.GET.get("status")
 
-    Mangas = Manga.objects.all()
+    Mangas = Manga.objects.prefetch_related(GENRES_PREFETCH)
 
     if include_genres:
         # Lọc các truyện có đủ số lượng thể loại mong muốn
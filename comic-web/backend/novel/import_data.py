@@ -56,8 +56,6 @@ def import_novel(json_file_path):
     novel.genres.set(genre_instances)
     
     chapters = item.get('chapters', [])
-    novel.numChapters = len(chapters)
-    print(novel.numChapters)
     for idx, chapter in enumerate(chapters):
         created = NovelChapter.objects.get_or_create(
             novel=novel,
@@ -70,6 +68,9 @@ def import_novel(json_file_path):
             novel.description = item['description']
             novel.status = item['status']
             novel.save()
+    # NovelChapter.save đã cộng numChapters cho từng chương
+    novel.refresh_from_db(fields=['numChapters'])
+    print(novel.numChapters)
     novel.save()
     print("✅ Novel imported successfully!")
 
@@ -18,7 +18,7 @@ class Novel(models.Model):
     description = models.TextField()
     cover_image = models.ImageField(upload_to='novel_covers/', default='novel_covers/default.jpg', blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     genres = models.ManyToManyField(
         Genre, related_name='genres', blank=True)
     source = models.CharField(max_length=255,default='Không rõ')
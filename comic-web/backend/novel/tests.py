@@ -1,3 +1,10 @@
 from django.test import TestCase
 
-# Create your tests here.
+from testutils.querybudget import TitleQueryBudgetMixin, no_page_cache
+from .models import Novel
+
+
+@no_page_cache
+class NovelQueryBudgetTests(TitleQueryBudgetMixin, TestCase):
+    model = Novel
+    url = '/api/novel/'
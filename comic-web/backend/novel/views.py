@@ -5,11 +5,17 @@ from .serializers import NovelSerializer
 from .models import Novel
 from rest_framework.response import Response
 from rest_framework import status
-from django.db.models import Value, IntegerField, Case, When, Q, Count
+from django.db.models import Q, Count, Prefetch
 from .models import Novel
+from genres.models import Genre
+from search.index import search
 from rest_framework.decorators import api_view
+from counters import sharded
+from users.views import add_favorite
 
 
+# Thể loại của cả trang được lấy bằng một query, thay vì một query mỗi truyện
+GENRES_PREFETCH = Prefetch('genres', queryset=Genre.objects.order_by('name'))
 
 
 @api_view(['GET'])
@@ -22,7 +28,7 @@ def advanced_search(request):
     author = request.GET.get("author")
     status = request.GET.get("status")
 
-    novels = Novel.objects.all()
+    novels = Novel.objects.prefetch_related(GENRES_PREFETCH)
 
     if include_genres:
         # Lọc các truyện có đủ số lượng thể loại mong muốn
@@ -51,7 +57,7 @@ def advanced_search(request):
     return Response({"results": serializer.data})
 
 class NovelViewSet(viewsets.ModelViewSet):
-    queryset = Novel.objects.all()
+    queryset = Novel.objects.prefetch_related(GENRES_PREFETCH)
     serializer_class = NovelSerializer
     permission_classes = [AllowAny]
     def get_queryset(self):
@@ -59,29 +65,22 @@ class NovelViewSet(viewsets.ModelViewSet):
         q = self.request.query_params.get('q')
         if not q:
             return queryset
-        keyword = q.strip().split()
-        query = Q()
-        relevance = Value(0, output_field=IntegerField())
-        for kw in keyword:
-            query |= Q(title__icontains=kw)
-            query |= Q(author__icontains=kw)
-            relevance = relevance + Case(
-                When(title__icontains=kw, then=Value(10)),       # ưu tiên title
-                When(author__icontains=kw, then=Value(5)),
-                default=Value(0),
-                output_field=IntegerField()
-            )
-        return queryset.filter(query).annotate(score=relevance).order_by('-score')
+        if self.action != 'list':
+            return queryset
+        # Chỉ mục từ khóa (search app): bỏ dấu tiếng Việt, xếp hạng BM25, chỉ tải truyện của trang hiện tại
+        return search(queryset, q)
     
 @api_view(['PUT'])
-@permission_classes([AllowAny])
+@permission_classes([IsAuthenticated])
 def updateNumFavorite(request, pk):
     try:
         novel = Novel.objects.get(_id = pk)
-        novel.numFavorites = novel.numFavorites + 1
-        novel.save()
+        # Cùng đường đếm với /api/user/favorite/: mỗi người dùng chỉ được đếm một lần
+        add_favorite(request.user, str(novel.pk), 'novel')
         serialize = NovelSerializer(novel, many=False, context={'request': request})
-        return Response(serialize.data, status=status.HTTP_200_OK)
+        data = serialize.data
+        data['numFavorites'] = sharded.total('novel', novel.pk, 'numFavorites')
+        return Response(data, status=status.HTTP_200_OK)
         
     except Exception as e:
         print(f"[ERROR updateNumFavorite]: {e}")
@@ -95,13 +94,14 @@ def updateNumComments(request, pk):
         # Lấy truyện theo ID
         novel = Novel.objects.get(_id=pk)
         
-        # Tăng số lượng bình luận
-        novel.numComments = novel.numComments + 1
-        novel.save()
+        # Bình luận đã được đếm khi tạo (POST /api/user/comment/), ở đây chỉ trả về số hiện tại
+        # để retry hay gọi thêm không làm numComments đếm một bình luận hai lần
         
         # Serialize và trả về dữ liệu
         serialize = NovelSerializer(novel, many=False, context={'request': request})
-        return Response(serialize.data, status=status.HTTP_200_OK)
+        data = serialize.data
+        data['numComments'] = sharded.total('novel', novel.pk, 'numComments')
+        return Response(data, status=status.HTTP_200_OK)
         
     except Exception as e:
         print(f"[ERROR updateNumComments]: {e}")
@@ -0,0 +1,129 @@
+import math
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Case, Count, F, FloatField, Sum, Value, When
+from django.db.models.functions import Cast
+
+from manga.models import Manga
+from novel.models import Novel
+from .models import SearchDocument, SearchPosting
+from .text import tokenize
+
+TITLE_MODELS = {
+    'novel': Novel,
+    'manga': Manga,
+}
+# Field weights: a keyword in the title counts three times one in the description
+FIELD_WEIGHTS = {
+    'title': 3,
+    'author': 2,
+    'description': 1,
+}
+INDEXED_FIELDS = tuple(FIELD_WEIGHTS)
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# The last keyword also matches as a prefix ("dao" finds "daoist"), expanded to at most this many terms
+PREFIX_TERMS = 20
+MAX_RESULTS = 1000
+
+
+def title_type_of(model):
+    return next(title_type for title_type, title_model in TITLE_MODELS.items() if title_model is model)
+
+
+def index_title(title):
+    """(Re)index one manga or novel."""
+    frequencies = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        for term in tokenize(getattr(title, field)):
+            frequencies[term] += weight
+    with transaction.atomic():
+        title_type = title_type_of(type(title))
+        document, _ = SearchDocument.objects.update_or_create(
+            title_type=title_type, title_id=title.pk, defaults={'length': sum(frequencies.values())})
+        document.postings.all().delete()
+        SearchPosting.objects.bulk_create(
+            SearchPosting(document=document, title_type=title_type, term=term, tf=tf)
+            for term, tf in frequencies.items())
+
+
+def remove_title(title_type, title_id):
+    SearchDocument.objects.filter(title_type=title_type, title_id=title_id).delete()
+
+
+def _query_terms(title_type, q):
+    terms = tokenize(q)
+    if not terms:
+        return []
+    prefix = terms[-1]
+    # A range rather than LIKE so the term index is used on every backend
+    expanded = (SearchPosting.objects.filter(title_type=title_type, term__gt=prefix,
+                                             term__lt=prefix + '\uffff')
+                .values_list('term', flat=True).distinct()[:PREFIX_TERMS])
+    return list(dict.fromkeys(terms + list(expanded)))
+
+
+def _corpus_stats(title_type):
+    """Number of documents and their average length, cached: BM25 barely
+    moves when a few titles change, and counting them grows with the catalog."""
+    def compute():
+        return SearchDocument.objects.filter(title_type=title_type).aggregate(
+            total=Count('pk'), avg_length=Avg('length'))
+    return cache.get_or_set(f'search:stats:{title_type}', compute, settings.SEARCH_STATS_CACHE_SECONDS)
+
+
+def rank(title_type, q, limit=MAX_RESULTS):
+    """IDs of the titles matching ``q``, best BM25 score first."""
+    terms = _query_terms(title_type, q)
+    if not terms:
+        return []
+    stats = _corpus_stats(title_type)
+    postings = SearchPosting.objects.filter(title_type=title_type, term__in=terms)
+    document_frequencies = dict(postings.values_list('term').annotate(df=Count('pk')).order_by())
+    # The cached total can lag behind df right after titles are added
+    idf = {term: math.log((max(stats['total'] - df, 0) + 0.5) / (df + 0.5) + 1)
+           for term, df in document_frequencies.items()}
+    if not idf:
+        return []
+    tf = Cast(F('tf'), FloatField())
+    length_norm = K1 * (1 - B + B * Cast(F('document__length'), FloatField()) / (stats['avg_length'] or 1))
+    term_idf = Case(*[When(term=term, then=Value(weight)) for term, weight in idf.items()],
+                    default=Value(0.0), output_field=FloatField())
+    scored = (postings.values('document__title_id')
+              .annotate(score=Sum(term_idf * tf * (K1 + 1) / (tf + length_norm)))
+              .order_by('-score', 'document__title_id')[:limit])
+    return [row['document__title_id'] for row in scored]
+
+
+class RankedResults:
+    """Ranked search hits that only load the titles of the page being sliced,
+    in rank order, so DRF's paginator can page through them."""
+
+    def __init__(self, queryset, ids):
+        self.queryset = queryset
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _load(self, ids):
+        titles = self.queryset.in_bulk(ids)
+        return [titles[pk] for pk in ids if pk in titles]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._load(self.ids[index])
+        return self._load([self.ids[index]])[0]
+
+    def __iter__(self):
+        for start in range(0, len(self.ids), 100):
+            yield from self[start:start + 100]
+
+
+def search(queryset, q):
+    """``queryset`` (Manga or Novel) restricted to the titles matching ``q``, best match first."""
+    return RankedResults(queryset, rank(title_type_of(queryset.model), q))
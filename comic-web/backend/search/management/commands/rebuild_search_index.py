@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError
+
+from search.index import TITLE_MODELS, index_title
+from search.models import SearchDocument
+
+
+class Command(BaseCommand):
+    help = "Index the mangas and novels missing from the search index (all of them with --all)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='reindex titles that are already indexed too')
+
+    def handle(self, *args, **options):
+        for title_type, model in TITLE_MODELS.items():
+            started = time.monotonic()
+            titles = model.objects.only('pk', 'title', 'author', 'description')
+            if not options['all']:
+                indexed = SearchDocument.objects.filter(title_type=title_type).values('title_id')
+                titles = titles.exclude(pk__in=indexed)
+            count = 0
+            for title in titles.iterator(chunk_size=500):
+                try:
+                    index_title(title)
+                except IntegrityError:
+                    # Another replica starting at the same time indexed it first
+                    continue
+                count += 1
+            self.stdout.write(f"{title_type}: indexed {count} titles in {time.monotonic() - started:.2f}s")
@@ -0,0 +1,39 @@
+from django.db import models
+
+
+class SearchDocument(models.Model):
+    """A manga or novel in the search index; ``length`` is its weighted
+    token count, which BM25 normalizes term frequencies by."""
+    TITLE_TYPES = [
+        ('novel', 'Tiểu thuyết'),
+        ('manga', 'Manga'),
+    ]
+    title_type = models.CharField(max_length=20, choices=TITLE_TYPES)
+    title_id = models.UUIDField()
+    length = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['title_type', 'title_id'], name='unique_search_document'),
+        ]
+
+    def __str__(self):
+        return f"{self.title_type} {self.title_id}"
+
+
+class SearchPosting(models.Model):
+    """One accent-folded term of a document with its weighted frequency.
+    ``title_type`` is copied from the document so a keyword is looked up
+    in the (title_type, term) index without going through the documents."""
+    document = models.ForeignKey(SearchDocument, on_delete=models.CASCADE, related_name='postings')
+    title_type = models.CharField(max_length=20, choices=SearchDocument.TITLE_TYPES)
+    term = models.CharField(max_length=64)
+    tf = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['title_type', 'term', 'document'], name='unique_search_posting'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} ({self.tf})"
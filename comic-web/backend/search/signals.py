@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from manga.models import Manga
+from novel.models import Novel
+from .index import INDEXED_FIELDS, index_title, remove_title, title_type_of
+
+
+@receiver(post_save, sender=Manga)
+@receiver(post_save, sender=Novel)
+def reindex_title(sender, instance, update_fields=None, **kwargs):
+    # save(update_fields=[...]) of counters only does not change the text
+    if update_fields is not None and not set(update_fields) & set(INDEXED_FIELDS):
+        return
+    index_title(instance)
+
+
+@receiver(post_delete, sender=Manga)
+@receiver(post_delete, sender=Novel)
+def unindex_title(sender, instance, **kwargs):
+    remove_title(title_type_of(sender), instance.pk)
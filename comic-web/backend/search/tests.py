@@ -0,0 +1,54 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from manga.models import Manga
+from novel.models import Novel
+from .index import rank
+from .models import SearchDocument
+from .text import tokenize
+
+
+class TokenizeTests(TestCase):
+    def test_folds_vietnamese_diacritics(self):
+        self.assertEqual(tokenize('Đạo Mộ Bút Ký'), ['dao', 'mo', 'but', 'ky'])
+        self.assertEqual(tokenize(None), [])
+
+
+class RankTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create(id=1, username='uploader')
+        cls.description_hit = Novel.objects.create(title='Ma Thổi Đèn', author='Thiên Hạ Bá Xướng',
+                                                   description='Cùng tác giả với Đạo Mộ Bút Ký')
+        cls.title_hit = Novel.objects.create(title='Đạo Mộ Bút Ký', author='Nam Phái Tam Thúc', description='...')
+        cls.other = Novel.objects.create(title='Tru Tiên', author='Tiêu Đỉnh', description='...')
+
+    def test_matches_without_accents_title_first(self):
+        self.assertEqual(rank('novel', 'dao mo'), [self.title_hit.pk, self.description_hit.pk])
+
+    def test_last_keyword_matches_as_prefix(self):
+        self.assertEqual(rank('novel', 'tru ti'), [self.other.pk])
+        self.assertEqual(rank('novel', 'tien tru'), [self.other.pk])
+
+    def test_no_match(self):
+        self.assertEqual(rank('novel', 'kiếm lai'), [])
+        self.assertEqual(rank('novel', '  '), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.other.title = 'Kiếm Lai'
+        self.other.save()
+        self.assertEqual(rank('novel', 'kiem lai'), [self.other.pk])
+        self.assertEqual(rank('novel', 'tru tien'), [])
+        self.other.delete()
+        self.assertEqual(rank('novel', 'kiem lai'), [])
+        self.assertFalse(SearchDocument.objects.filter(title_id=self.other.pk).exists())
+
+    def test_counter_saves_do_not_reindex(self):
+        novel = Novel.objects.get(pk=self.other.pk)
+        with self.assertNumQueries(1):
+            novel.save(update_fields=['numViews'])
+
+    def test_types_are_separate(self):
+        Manga.objects.create(title='Đạo Mộ Bút Ký', author='Nam Phái Tam Thúc', description='...')
+        self.assertEqual(len(rank('manga', 'dao mo')), 1)
+        self.assertEqual(len(rank('novel', 'dao mo')), 2)
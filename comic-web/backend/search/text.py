@@ -0,0 +1,15 @@
+import re
+import unicodedata
+
+TOKEN = re.compile(r'\w+')
+MAX_TERM_LENGTH = 64
+
+
+def fold(text):
+    """Lowercase and strip Vietnamese diacritics: "Đạo Mộ Bút Ký" -> "dao mo but ky"."""
+    text = unicodedata.normalize('NFD', text.lower()).replace('đ', 'd')
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN.findall(fold(text or ''))]
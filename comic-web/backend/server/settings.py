@@ -30,7 +30,8 @@ ALLOWED_HOSTS = ["*"]
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework_simplejwt.authentication.JWTAuthentication",
-        
+        # Frontend gửi cookie access_token (withCredentials), không gửi header Authorization
+        "users.authentication.CookieJWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": [
         # 'rest_framework.permissions.AllowAny',
@@ -104,6 +105,8 @@ INSTALLED_APPS = [
     'genres',
     'users',
     'forum',
+    'counters',
+    'search',
 ]
 # AUTH_USER_MODEL = 'users.CustomUser'
 
@@ -111,6 +114,8 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Before the cache middleware so cached chapter reads are counted too
+    'chapter.middleware.ChapterViewCountMiddleware',
     'django.middleware.cache.UpdateCacheMiddleware',
     "debug_toolbar.middleware.DebugToolbarMiddleware",
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -122,6 +127,15 @@ MIDDLEWARE = [
     
 ]
 CACHE_MIDDLEWARE_SECONDS = 60
+# How often buffered chapter reads are written to numViews (chapter/viewcounts.py)
+VIEW_COUNT_FLUSH_SECONDS = 5
+# Sharded like/favorite/comment counters (counters/sharded.py): rows per
+# title counter, how often they are folded into the title columns and how
+# long a summed total is cached
+COUNTER_SHARDS = 8
+COUNTER_FOLD_SECONDS = 10
+COUNTER_CACHE_SECONDS = 5
+SEARCH_STATS_CACHE_SECONDS = 60
 INTERNAL_IPS = [
     # ...
     "127.0.0.1",
@@ -0,0 +1 @@
+# Helpers shared by the apps' tests; never imported by the server itself
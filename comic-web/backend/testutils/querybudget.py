@@ -0,0 +1,58 @@
+from django.contrib.auth.models import User
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from genres.models import Genre
+
+# Without the page cache every request reaches the database
+NO_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+no_page_cache = override_settings(CACHES=NO_CACHE)
+
+
+class TitleQueryBudgetMixin:
+    """Số query của mỗi endpoint không được tăng theo số truyện trên trang.
+
+    Dùng chung cho manga và novel: lớp con đặt ``model`` và ``url``, rồi kế
+    thừa cùng ``TestCase`` (và ``no_page_cache``).
+    """
+    model = None
+    url = None
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create(id=1, username='uploader')
+        cls.genres = [Genre.objects.create(name=f'Genre {i}') for i in range(3)]
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def add_titles(self, count):
+        name = self.model.__name__
+        for i in range(count):
+            title = self.model.objects.create(title=f'{name} {i}', author='Tác giả', description='...')
+            title.genres.set(self.genres)
+
+    def test_list(self):
+        # count + page + thể loại
+        for total, limit in ((3, 5), (40, 30)):
+            self.add_titles(total)
+            with self.assertNumQueries(3):
+                response = self.client.get(self.url, {'limit': limit})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results'][0]['genres']), 3)
+
+    def test_search(self):
+        self.add_titles(25)
+        # mở rộng tiền tố + thống kê + df + xếp hạng + page + thể loại, dù có bao nhiêu kết quả
+        with self.assertNumQueries(6):
+            response = self.client.get(self.url, {'q': f'{self.model.__name__} Tác'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual(len(response.data['results']), 20)
+
+    def test_advanced_search(self):
+        for total in (3, 30):
+            self.add_titles(total)
+            with self.assertNumQueries(2):
+                response = self.client.get(f'{self.url}advanced-search/', {'author': 'Tác'})
+            self.assertEqual(response.status_code, 200)
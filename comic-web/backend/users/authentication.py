@@ -0,0 +1,29 @@
+import jwt
+from rest_framework.authentication import BaseAuthentication
+
+from .models import JWTKey
+
+
+class CookieJWTAuthentication(BaseAuthentication):
+    """Người dùng từ cookie ``access_token`` mà LoginView/RegisterUserView đặt,
+    cùng token Kong kiểm tra. Chữ ký được xác minh bằng secret của chính người
+    dùng trong JWTKey, giống RefreshTokenView. Cookie thiếu hoặc hết hạn thì
+    request là ẩn danh, để các endpoint AllowAny vẫn dùng được."""
+
+    def authenticate(self, request):
+        token = request.COOKIES.get('access_token')
+        if not token:
+            return None
+        try:
+            unverified = jwt.decode(token, options={"verify_signature": False})
+            jwt_obj = JWTKey.objects.select_related('user').get(key=unverified.get('iss'))
+            decoded = jwt.decode(token, jwt_obj.secret, algorithms=["HS256"])
+        except (jwt.InvalidTokenError, JWTKey.DoesNotExist):
+            return None
+        if decoded.get('sub') != str(jwt_obj.user_id):
+            return None
+        return jwt_obj.user, decoded
+
+    def authenticate_header(self, request):
+        # 401 thay vì 403 khi chưa đăng nhập
+        return 'Bearer realm="api"'
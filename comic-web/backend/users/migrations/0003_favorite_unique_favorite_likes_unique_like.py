@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:10
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def delete_duplicates(apps, schema_editor):
+    # Keep the oldest like/favorite of each user and story so the constraints can be added
+    for model_name, created_field in (('Likes', 'created_at'), ('Favorite', 'createdAt')):
+        model = apps.get_model('users', model_name)
+        duplicates = (model.objects.values('user', 'story_id', 'type')
+                      .annotate(n=Count('pk')).filter(n__gt=1))
+        for group in duplicates:
+            rows = model.objects.filter(user=group['user'], story_id=group['story_id'], type=group['type'])
+            keep = rows.order_by(created_field, 'pk').values_list('pk', flat=True).first()
+            rows.exclude(pk=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_comments_user_alter_favorite_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='favorite',
+            constraint=models.UniqueConstraint(fields=('user', 'story_id', 'type'), name='unique_favorite'),
+        ),
+        migrations.AddConstraint(
+            model_name='likes',
+            constraint=models.UniqueConstraint(fields=('user', 'story_id', 'type'), name='unique_like'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_favorite_unique_favorite_likes_unique_like'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comments',
+            index=models.Index(fields=['type', 'post_id'], name='users_comme_type_fa19cc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comments',
+            index=models.Index(fields=['created_at'], name='users_comme_created_c9c2e5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['type', 'story_id'], name='users_favor_type_7c997b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['createdAt'], name='users_favor_created_99a116_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='likes',
+            index=models.Index(fields=['type', 'story_id'], name='users_likes_type_241633_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='likes',
+            index=models.Index(fields=['created_at'], name='users_likes_created_4ae7fa_idx'),
+        ),
+    ]
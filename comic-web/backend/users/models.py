@@ -29,6 +29,15 @@ class Favorite(models.Model):
         choices=FAVORITE_TYPE,
         default='novel'
     ) # tăng tốc độ truy xuất 
+    class Meta:
+        # Mỗi người chỉ yêu thích một truyện một lần
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'story_id', 'type'], name='unique_favorite'),
+        ]
+        indexes = [
+            models.Index(fields=['type', 'story_id']),
+            models.Index(fields=['createdAt']),
+        ]
     def __str__(self):
         return str(self.user)
 
@@ -55,6 +64,11 @@ class Comments(models.Model):
         choices=COMMENT_PLACES,
         default='novel'
     ) # tăng tốc độ truy xuất 
+    class Meta:
+        indexes = [
+            models.Index(fields=['type', 'post_id']),
+            models.Index(fields=['created_at']),
+        ]
     def __str__(self):
         return f"{self.user} - Content {self.content} - {self.user.username}"
     def get_replies(self):
@@ -78,5 +92,14 @@ class Likes(models.Model):
         choices=LIKE_PLACES,
         default='novel'
     ) # tăng tốc độ truy xuất 
+    class Meta:
+        # Mỗi người chỉ thích một truyện một lần
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'story_id', 'type'], name='unique_like'),
+        ]
+        indexes = [
+            models.Index(fields=['type', 'story_id']),
+            models.Index(fields=['created_at']),
+        ]
     def __str__(self):
         return f"{self.user} - {self.comment}"
\ No newline at end of file
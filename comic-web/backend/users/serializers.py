@@ -49,7 +49,7 @@ class CommentsSerializer(serializers.ModelSerializer):
     user = serializers.SerializerMethodField(read_only=True)
     class Meta:
         model = Comments
-        fields = ['post_id','content','type','parent']
+        fields = ['_id','post_id','content','type','parent','user']
         read_only_fields = ['createdAt', 'user']
     def get_user(self,obj):
         user = obj.user
@@ -18,6 +18,8 @@ from rest_framework.views import APIView
 from dotenv import load_dotenv
 import os
 from django.contrib.auth.models import Group
+from counters import sharded
+from django.db import transaction
 load_dotenv()
 KONG_ADMIN_URL = os.getenv("KONG_ADMIN_URL")
 def create_jwt(user, key, secret):
@@ -178,6 +180,17 @@ def logoutUser(request):
     return response
 
 
+def add_favorite(user, story_id, type):
+    """Yêu thích một truyện, mỗi người dùng một lần: bấm lại hay retry không đếm thêm
+    (unique_favorite chặn cả hai request đồng thời). Dòng và counter ghi cùng một
+    transaction để reconcile_counters không đếm hai lần. Trả về (favorite, created)."""
+    with transaction.atomic():
+        favorite, created = Favorite.objects.get_or_create(user=user, story_id=story_id, type=type)
+        if created:
+            sharded.increment(favorite.type, favorite.story_id, 'numFavorites')
+    return favorite, created
+
+
 class LikeViewSet(viewsets.ModelViewSet):
     queryset = Likes.objects.all()
     serializer_class = LikeSerializer
@@ -186,31 +199,21 @@ class LikeViewSet(viewsets.ModelViewSet):
         user = self.request.user
         return Likes.objects.filter(user=user)
     def perform_create(self, serializer):
-        # Lấy đối tượng Novel từ serializer
-        novel = serializer.validated_data['novel']
-        
-        # Kiểm tra xem người dùng đã thích truyện này chưa
-        if Likes.objects.filter(user=self.request.user, novel=novel).exists():
-            # Nếu đã có lượt thích rồi, trả về lỗi hoặc không làm gì
-            return None
-        # Nếu chưa có lượt thích, tiến hành lưu đối tượng Like và gắn người dùng hiện tại vào
-        if serializer.is_valid():
-            # Lưu đối tượng Like với người dùng hiện tại
-            serializer.save(user=self.request.user)
-            
-            # Cập nhật số lượt thích cho Novel
-            novel.numLikes += 1  # Tăng thêm 1 lượt thích
-            novel.save(update_fields=['numLikes'])
-            serializer.save(uploader=self.request.user)
+        # Thích lại một truyện đã thích trả về lượt thích cũ và không đếm thêm
+        # (unique_like chặn cả hai request đồng thời)
+        # Dòng và counter ghi cùng một transaction để reconcile_counters không đếm hai lần
+        data = serializer.validated_data
+        with transaction.atomic():
+            like, created = Likes.objects.get_or_create(
+                user=self.request.user, story_id=data.get('story_id', ''), type=data.get('type', 'novel'))
+            if created:
+                sharded.increment(like.type, like.story_id, 'numLikes')
+        serializer.instance = like
     def perform_destroy(self, instance):
-        # Truy cập đối tượng Novel liên quan đến Like
-        novel = instance.novel
-        
-        # Giảm số lượt thích cho Novel
-        novel.numLikes -= 1
-        novel.save(update_fields=['numLikes'])  # Lưu lại sự thay đổi
-        # Xóa đối tượng Like
-        instance.delete()
+        # Chỉ trừ khi request này thực sự xóa được lượt thích
+        with transaction.atomic():
+            if Likes.objects.filter(pk=instance.pk).delete()[0]:
+                sharded.increment(instance.type, instance.story_id, 'numLikes', -1)
 
 
 class CommentViewSet(viewsets.ModelViewSet):
@@ -223,25 +226,13 @@ class CommentViewSet(viewsets.ModelViewSet):
         return Comments.objects.filter(user=user)
     
     def perform_create(self, serializer):
-        if serializer.is_valid():
-            serializer.save(user=self.request.user)
-    
-            # Cập nhật số lượt thích cho Novel
-            novel = serializer.validated_data['novel'] # Lấy đối tượng Novel từ Comment
-            novel.numComments += 1  # Tăng thêm 1 lượt thích
-            novel.save(update_fields=['numComments'])
-            serializer.save(uploader=self.request.user)
-        else: 
-            print(serializer.errors)
+        with transaction.atomic():
+            comment = serializer.save(user=self.request.user)
+            sharded.increment(comment.type, comment.post_id, 'numComments')
     def perform_destroy(self, instance):
-        # Truy cập đối tượng Novel liên quan đến Comments
-        novel = instance.novel
-        # Giảm số lượt thích cho Novel
-        novel.numComments -= 1  # Giảm bớt 1 lượt thích
-        novel.save(update_fields=['numComments'])  # Lưu lại sự thay đổi
-        
-        # Xóa đối tượng Comment
-        instance.delete()
+        with transaction.atomic():
+            if Comments.objects.filter(pk=instance.pk).delete()[0]:
+                sharded.increment(instance.type, instance.post_id, 'numComments', -1)
     
 
 class FavoriteViewSet(viewsets.ModelViewSet):
@@ -252,22 +243,9 @@ class FavoriteViewSet(viewsets.ModelViewSet):
         user = self.request.user
         return Favorite.objects.filter(user=user)
     def perform_create(self, serializer):
-        if serializer.is_valid():
-            serializer.save(user=self.request.user) # 
-            # Cập nhật số lượt thích cho Novel
-            novel = serializer.validated_data['novel']
-            novel.numFavorites += 1
-            novel.save(update_fields=['numFavorites'])
-            serializer.save(uploader=self.request.user)
-        else: 
-            print(serializer.errors)
+        data = serializer.validated_data
+        serializer.instance, _ = add_favorite(self.request.user, data.get('story_id', ''), data.get('type', 'novel'))
     def perform_destroy(self, instance):
-        # Truy cập đối tượng Novel liên quan đến Like
-        novel = instance.novel
-        
-        # Giảm số lượt thích cho Novel
-        novel.numFavorites -= 1  # Giảm bớt 1 lượt thích
-        novel.save(update_fields=['numFavorites'])  # Lưu lại sự thay đổi
-        
-        # Xóa đối tượng Like
-        instance.delete()
+        with transaction.atomic():
+            if Favorite.objects.filter(pk=instance.pk).delete()[0]:
+                sharded.increment(instance.type, instance.story_id, 'numFavorites', -1)
@@ -49,7 +49,7 @@ export const fetchChapterDetail = async (chapterId: string) => {
 export const updateNumberFavorite  = async (novelid: string) => {
   try{
       //const response = await axios.post(`${baseURL}/api/novel/baa9a61e-35d5-4ac1-9d55-1fbfefbc21ef/updateNumFavorite/`);
-      const response = await axios.put(`${baseURL}/api/novel/${novelid}/updateNumFavorite/`,{withCredentials: true});
+      const response = await axios.put(`${baseURL}/api/novel/${novelid}/updateNumFavorite/`, null, {withCredentials: true});
       console.log(response.data);
       return response.data;
   }
@@ -62,7 +62,7 @@ export const updateNumberFavorite  = async (novelid: string) => {
 
 export const updateNumberComments = async (novelid: string) => {
   try {
-      const response = await axios.put(`${baseURL}/api/novel/${novelid}/updateNumComments/`,{withCredentials: true});
+      const response = await axios.put(`${baseURL}/api/novel/${novelid}/updateNumComments/`, null, {withCredentials: true});
       console.log(response.data);
       return response.data;
   } 
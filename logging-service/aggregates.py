@@ -0,0 +1,151 @@
+import logging
+import os
+import threading
+from collections import Counter as CollectionsCounter
+
+from metrics import error_counter, kong_latency_histogram
+from persistence import STATE_DIR, atomic_write_json, load_json
+from routes import normalize_uri
+from sketches import LatencySketch
+from topk import SpaceSaving
+
+logger = logging.getLogger(__name__)
+
+AGGREGATES_FILE = os.getenv('AGGREGATES_FILE', os.path.join(STATE_DIR, 'aggregates.json'))
+# Client IPs tracked for client_counts; the heaviest ones are kept
+CLIENT_CAPACITY = int(os.getenv('AGGREGATES_CLIENT_CAPACITY', '1000'))
+
+# Kong latency fields tracked per route with a quantile sketch
+LATENCY_KINDS = ('request', 'kong', 'proxy')
+
+
+class MetricsAggregator:
+    """Running totals behind the ``/metrics`` JSON endpoint.
+
+    Every ingested log updates the counters in O(1), so serving the endpoint
+    only copies the counters instead of re-reading the log files. Counters
+    are keyed by route template rather than raw URI to keep the number of
+    keys bounded, and client IPs are tracked with a bounded
+    :class:`topk.SpaceSaving` summary. The totals are snapshotted to ``path`` and reloaded on
+    start.
+
+    With ``path`` None the aggregator starts empty and is never saved, and
+    with ``export`` False it does not feed the Prometheus histograms; that
+    is how ``/metrics?from=&to=`` aggregates a time window on the side.
+    """
+
+    def __init__(self, path=AGGREGATES_FILE, export=True):
+        self.path = path
+        self.export = export
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.counts = CollectionsCounter()
+        self.latency_sums = CollectionsCounter()
+        self.errors = CollectionsCounter()
+        self.clients = SpaceSaving(CLIENT_CAPACITY)
+        # route name -> latency kind -> LatencySketch
+        self.latency_sketches = {}
+        snapshot = load_json(path) if path else None
+        self.loaded = snapshot is not None
+        if snapshot:
+            # Older snapshots were keyed by raw URI; fold them into templates
+            for counter, key in ((self.counts, 'request_counts'), (self.latency_sums, 'latency_sums'),
+                                 (self.errors, 'error_counts')):
+                for uri, value in snapshot[key].items():
+                    counter[normalize_uri(uri)] += value
+            if 'client_summary' in snapshot:
+                self.clients = SpaceSaving.from_dict(snapshot['client_summary'])
+            else:
+                # Older snapshots kept every client IP; keep the heaviest
+                for client, count in sorted(snapshot['client_counts'].items(), key=lambda item: -item[1]):
+                    self.clients.add(client, count)
+            for route, sketches in snapshot.get('latency_sketches', {}).items():
+                self.latency_sketches[route] = {kind: LatencySketch.from_dict(data) for kind, data in sketches.items()}
+            if export:
+                logger.info(f"Loaded aggregates for {len(self.counts)} routes from {path}")
+
+    def observe(self, log):
+        request = log.get('request', {})
+        uri = normalize_uri(request.get('uri'))
+        latencies = log.get('latencies', {})
+        latency = latencies.get('request', 0) or 0
+        route = (log.get('route') or {}).get('name') or 'unknown'
+        status = log.get('response', {}).get('status', 0) or 0
+        with self._lock:
+            self.counts[uri] += 1
+            self.latency_sums[uri] += latency
+            if status >= 400:
+                self.errors[uri] += 1
+            self.clients.add(log.get('client_ip', 'unknown'))
+            sketches = self.latency_sketches.setdefault(route, {})
+            for kind in LATENCY_KINDS:
+                value = latencies.get(kind)
+                # Kong reports -1 when a phase did not happen, e.g. no proxying
+                if value is None or value < 0:
+                    continue
+                sketches.setdefault(kind, LatencySketch()).add(value)
+                if self.export:
+                    kong_latency_histogram.labels(route=route, kind=kind).observe(value)
+            self._dirty = True
+
+    def merge(self, other):
+        """Add the totals of ``other``, e.g. another worker process's aggregator."""
+        with other._lock:
+            counts, latency_sums, errors = dict(other.counts), dict(other.latency_sums), dict(other.errors)
+            clients = SpaceSaving.from_dict(other.clients.to_dict())
+            latency_sketches = {
+                route: {kind: LatencySketch.from_dict(sketch.to_dict()) for kind, sketch in sketches.items()}
+                for route, sketches in other.latency_sketches.items()
+            }
+        with self._lock:
+            self.counts.update(counts)
+            self.latency_sums.update(latency_sums)
+            self.errors.update(errors)
+            self.clients.merge(clients)
+            for route, sketches in latency_sketches.items():
+                merged = self.latency_sketches.setdefault(route, {})
+                for kind, sketch in sketches.items():
+                    if kind in merged:
+                        merged[kind].merge(sketch)
+                    else:
+                        merged[kind] = sketch
+
+    def snapshot(self):
+        """The ``/metrics`` response body."""
+        with self._lock:
+            counts = dict(self.counts)
+            avg_latencies = {k: v / counts[k] for k, v in self.latency_sums.items() if counts.get(k)}
+            return {
+                "request_counts": counts,
+                "avg_latencies_ms": avg_latencies,
+                "error_counts": dict(self.errors),
+                "client_counts": {client: count for client, count, _ in self.clients.top(CLIENT_CAPACITY)},
+                "latency_percentiles_ms": {
+                    route: {kind: sketch.summary() for kind, sketch in sketches.items()}
+                    for route, sketches in self.latency_sketches.items()
+                }
+            }
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            state = {
+                'request_counts': dict(self.counts),
+                'latency_sums': dict(self.latency_sums),
+                'error_counts': dict(self.errors),
+                'client_summary': self.clients.to_dict(),
+                'latency_sketches': {
+                    route: {kind: sketch.to_dict() for kind, sketch in sketches.items()}
+                    for route, sketches in self.latency_sketches.items()
+                }
+            }
+            self._dirty = False
+        try:
+            atomic_write_json(self.path, state)
+            self.loaded = True
+        except OSError as e:
+            logger.error(f"Failed to save aggregates: {str(e)}")
+            error_counter.labels(type='aggregates').inc()
+            with self._lock:
+                self._dirty = True
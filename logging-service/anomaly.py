@@ -0,0 +1,217 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from prometheus_client import Gauge
+
+from metrics import error_counter
+from routes import normalize_uri
+from sketches import LatencySketch
+
+logger = logging.getLogger(__name__)
+
+# Length of the intervals a route's p99 and error ratio are measured over
+ANOMALY_TICK_SECONDS = float(os.getenv('ANOMALY_TICK_SECONDS', '10'))
+# Weight of the newest interval in the baselines; about 1/alpha intervals of memory
+ANOMALY_ALPHA = float(os.getenv('ANOMALY_ALPHA', '0.05'))
+# Standard deviations above the baseline that count as a regression
+ANOMALY_THRESHOLD = float(os.getenv('ANOMALY_THRESHOLD', '4'))
+# Intervals needed before a route's baseline is trusted, and requests needed for an interval to count
+ANOMALY_WARMUP_TICKS = int(os.getenv('ANOMALY_WARMUP_TICKS', '30'))
+ANOMALY_MIN_REQUESTS = int(os.getenv('ANOMALY_MIN_REQUESTS', '20'))
+ALERT_LOG = os.getenv('ALERT_LOG', '/app/service_logs/alerts.log')
+
+# Per signal: smallest standard deviation assumed, so a perfectly flat
+# baseline does not turn every blip into an alert, and the smallest
+# increase over the baseline that is reported at all
+LATENCY_MIN_STD_RATIO = 0.05
+LATENCY_MIN_INCREASE_RATIO = 1.5
+ERROR_RATIO_MIN_STD = 0.01
+ERROR_RATIO_MIN_INCREASE = 0.05
+SIGNALS = ('latency_p99', 'error_ratio')
+
+anomaly_score_gauge = Gauge('logging_service_anomaly_score',
+                            'Standard deviations of the last interval above the route baseline',
+                            ['route', 'signal'], multiprocess_mode='livemax')
+anomaly_active_gauge = Gauge('logging_service_anomaly_active', 'Whether the route is currently flagged as regressed',
+                             ['route', 'signal'], multiprocess_mode='livemax')
+anomaly_baseline_gauge = Gauge('logging_service_anomaly_baseline', 'EWMA baseline of the route signal',
+                               ['route', 'signal'], multiprocess_mode='livemax')
+
+
+class Baseline:
+    """Exponentially weighted moving mean and variance of one signal."""
+
+    __slots__ = ('mean', 'var', 'samples', 'active')
+
+    def __init__(self):
+        self.mean = 0.0
+        self.var = 0.0
+        self.samples = 0
+        self.active = False
+
+    def update(self, value, alpha):
+        if not self.samples:
+            self.mean = value
+        else:
+            diff = value - self.mean
+            increment = alpha * diff
+            self.mean += increment
+            self.var = (1 - alpha) * (self.var + diff * increment)
+        self.samples += 1
+
+
+class _Interval:
+    __slots__ = ('count', 'errors', 'sketch')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.sketch = LatencySketch()
+
+
+class AnomalyDetector:
+    """Per-route online baselines of p99 latency and 5xx ratio.
+
+    :meth:`observe` adds each log to the current interval of its route
+    template. Every ``tick`` seconds a background thread closes the
+    intervals and scores each route's p99 and error ratio against an
+    EWMA/EWMV baseline; a score above ``threshold`` standard deviations,
+    and enough above the baseline in absolute terms, flags the route.
+    While a route is flagged its baseline adapts ten times slower, so a
+    sustained regression keeps firing instead of becoming the new normal.
+    A route needs ``min_requests`` in an interval for it to count and
+    ``warmup`` intervals before it can be flagged; a flagged route whose
+    traffic falls below ``min_requests`` (often what an incident ends with)
+    is cleared rather than left firing. State per route is a
+    fixed-size sketch and two baselines, whatever the traffic.
+
+    Scores, flags and baselines are exported as Prometheus gauges, and
+    every flag raised or cleared is appended as a JSON line to
+    ``alert_log``.
+    """
+
+    def __init__(self, tick=ANOMALY_TICK_SECONDS, alpha=ANOMALY_ALPHA, threshold=ANOMALY_THRESHOLD,
+                 warmup=ANOMALY_WARMUP_TICKS, min_requests=ANOMALY_MIN_REQUESTS, alert_log=ALERT_LOG):
+        self.tick = tick
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        self.min_requests = min_requests
+        self.alert_log = alert_log
+        self._intervals = {}
+        self._baselines = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='anomaly-detector', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def observe(self, log):
+        route = normalize_uri(log.get('request', {}).get('uri'))
+        status = log.get('response', {}).get('status', 0) or 0
+        latency = log.get('latencies', {}).get('request')
+        with self._lock:
+            interval = self._intervals.get(route)
+            if interval is None:
+                interval = self._intervals[route] = _Interval()
+            interval.count += 1
+            if status >= 500:
+                interval.errors += 1
+            if latency is not None and latency >= 0:
+                interval.sketch.add(latency)
+
+    def _run(self):
+        while not self._stop.wait(self.tick):
+            try:
+                self.evaluate()
+            except Exception as e:
+                logger.error(f"Anomaly detection failed: {str(e)}")
+                error_counter.labels(type='anomaly').inc()
+
+    def evaluate(self, now=None):
+        """Close the current intervals and score them. Returns the alerts raised or cleared."""
+        with self._lock:
+            intervals, self._intervals = self._intervals, {}
+        now = now if now is not None else time.time()
+        events = []
+        scored = set()
+        for route, interval in intervals.items():
+            if interval.count < self.min_requests:
+                continue
+            values = {'error_ratio': interval.errors / interval.count}
+            if interval.sketch.count:
+                values['latency_p99'] = interval.sketch.quantile(0.99)
+            for signal, value in values.items():
+                scored.add((route, signal))
+                event = self._score(route, signal, value, now)
+                if event is not None:
+                    events.append(event)
+        for (route, signal), baseline in self._baselines.items():
+            if baseline.active and (route, signal) not in scored:
+                events.append(self._clear(route, signal, baseline, now))
+        if events:
+            self._append(events)
+        return events
+
+    def _score(self, route, signal, value, now):
+        baseline = self._baselines.get((route, signal))
+        if baseline is None:
+            baseline = self._baselines[(route, signal)] = Baseline()
+        score = 0.0
+        if baseline.samples >= self.warmup:
+            if signal == 'latency_p99':
+                std = max(math.sqrt(baseline.var), baseline.mean * LATENCY_MIN_STD_RATIO, 1.0)
+                significant = value >= baseline.mean * LATENCY_MIN_INCREASE_RATIO
+            else:
+                std = max(math.sqrt(baseline.var), ERROR_RATIO_MIN_STD)
+                significant = value >= baseline.mean + ERROR_RATIO_MIN_INCREASE
+            score = (value - baseline.mean) / std
+            active = significant and score >= self.threshold
+        else:
+            active = False
+        event = None
+        if active != baseline.active:
+            event = {'ts': int(now * 1000), 'route': route, 'signal': signal,
+                     'state': 'firing' if active else 'resolved', 'value': round(value, 4),
+                     'baseline': round(baseline.mean, 4), 'score': round(score, 2)}
+            baseline.active = active
+        anomaly_score_gauge.labels(route=route, signal=signal).set(score)
+        anomaly_active_gauge.labels(route=route, signal=signal).set(int(active))
+        baseline.update(value, self.alpha / 10 if active else self.alpha)
+        anomaly_baseline_gauge.labels(route=route, signal=signal).set(baseline.mean)
+        return event
+
+    @staticmethod
+    def _clear(route, signal, baseline, now):
+        """Resolve a flag without a measurement: too little traffic to tell either way."""
+        baseline.active = False
+        anomaly_score_gauge.labels(route=route, signal=signal).set(0)
+        anomaly_active_gauge.labels(route=route, signal=signal).set(0)
+        return {'ts': int(now * 1000), 'route': route, 'signal': signal, 'state': 'resolved',
+                'value': None, 'baseline': round(baseline.mean, 4), 'score': 0.0, 'reason': 'low_traffic'}
+
+    def _append(self, events):
+        for event in events:
+            log = logger.warning if event['state'] == 'firing' else logger.info
+            log(f"Anomaly {event['state']} on {event['route']} {event['signal']}: {event['value']} "
+                f"(baseline {event['baseline']}, score {event['score']})")
+        if not self.alert_log:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.alert_log) or '.', exist_ok=True)
+            with open(self.alert_log, 'a') as f:
+                f.write(''.join(json.dumps(event) + '\n' for event in events))
+        except IOError as e:
+            logger.error(f"Failed to write alerts to {self.alert_log}: {str(e)}")
+            error_counter.labels(type='alert_log').inc()
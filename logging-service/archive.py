@@ -0,0 +1,176 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+from prometheus_client import Counter, Histogram
+
+from metrics import error_counter
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FILE = os.getenv('ARCHIVE_FILE', '/app/logs/logs.json')
+# Group commit: fsync after this many seconds or bytes, whichever comes first
+ARCHIVE_FSYNC_INTERVAL = float(os.getenv('ARCHIVE_FSYNC_INTERVAL', '1.0'))
+ARCHIVE_FSYNC_BYTES = int(os.getenv('ARCHIVE_FSYNC_BYTES', str(4 * 1024 * 1024)))
+ARCHIVE_QUEUE_SIZE = int(os.getenv('ARCHIVE_QUEUE_SIZE', '50000'))
+
+write_latency_histogram = Histogram('logging_service_archive_write_seconds', 'Time to write one batch to logs.json')
+fsync_latency_histogram = Histogram('logging_service_archive_fsync_seconds', 'Time to fsync logs.json')
+bytes_counter = Counter('logging_service_archive_bytes_total', 'Bytes appended to logs.json')
+lines_counter = Counter('logging_service_archive_lines_total', 'Lines appended to logs.json')
+dropped_counter = Counter('logging_service_archive_dropped_lines_total', 'Lines that never made it to logs.json',
+                          ['reason'])
+
+
+class ArchiveWriter:
+    """Single writer for the ``logs.json`` archive.
+
+    Any thread may call :meth:`append`; one background thread owns the open
+    file, writes everything queued since its last pass in one ``write`` and
+    fsyncs once per ``fsync_interval`` seconds or ``fsync_bytes`` bytes.
+    :meth:`reopen` (wired to SIGHUP) and a changed inode both make it close
+    and reopen the path, so logrotate can move the file away.
+
+    With a :class:`timeindex.TimeIndexStore` as ``index``, the offset and
+    ``started_at`` of the written lines are recorded in it.
+
+    :meth:`append` never blocks: when the queue is full (the disk has
+    stalled) the line is dropped and counted. Lines drained for a write
+    that failed are written again on the next pass; only those still
+    pending when the writer stops are counted as dropped.
+    """
+
+    def __init__(self, path=ARCHIVE_FILE, fsync_interval=ARCHIVE_FSYNC_INTERVAL,
+                 fsync_bytes=ARCHIVE_FSYNC_BYTES, queue_size=ARCHIVE_QUEUE_SIZE, index=None):
+        self.path = path
+        self.index = index
+        self.fsync_interval = fsync_interval
+        self.fsync_bytes = fsync_bytes
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._reopen = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._file = None
+        self._stat = None
+        self._unsynced_bytes = 0
+        self._last_sync = time.monotonic()
+        self._retry = []
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='archive-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def reopen(self):
+        """Ask the writer to reopen the file, e.g. after logrotate."""
+        self._reopen.set()
+
+    def append(self, line, started_at=None):
+        """Queue one newline-terminated line (str or bytes) for the archive.
+        Returns False if it had to be dropped."""
+        if isinstance(line, str):
+            line = line.encode('utf-8')
+        try:
+            self._queue.put_nowait((line, started_at))
+            return True
+        except queue.Full:
+            dropped_counter.labels(reason='queue_full').inc()
+            return False
+
+    def _open(self):
+        self._file = open(self.path, 'ab', buffering=1024 * 1024)
+        self._stat = os.fstat(self._file.fileno())
+
+    def _close(self):
+        if self._file:
+            self._sync()
+            self._file.close()
+            self._file = None
+
+    def _discard(self):
+        """Drop a file handle that failed; the next pass opens a fresh one."""
+        try:
+            if self._file:
+                self._file.close()
+        except IOError:
+            pass
+        self._file = None
+        self._unsynced_bytes = 0
+
+    def _rotated(self):
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _sync(self):
+        start_time = time.time()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        fsync_latency_histogram.observe(time.time() - start_time)
+        self._unsynced_bytes = 0
+        self._last_sync = time.monotonic()
+
+    def _drain(self, first):
+        chunks = self._retry + [first]
+        self._retry = []
+        while len(chunks) < 10000:
+            try:
+                chunks.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return chunks
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty() and not self._retry):
+            chunks = []
+            try:
+                try:
+                    chunks = self._drain(self._queue.get(timeout=self.fsync_interval))
+                except queue.Empty:
+                    chunks, self._retry = self._retry, []
+                if self._file is None or self._reopen.is_set() or self._rotated():
+                    self._reopen.clear()
+                    self._close()
+                    self._open()
+                    logger.info(f"Opened archive {self.path}")
+                if chunks:
+                    offset = self._file.tell()
+                    data = b''.join(line for line, _ in chunks)
+                    start_time = time.time()
+                    self._file.write(data)
+                    write_latency_histogram.observe(time.time() - start_time)
+                    written, chunks = chunks, []
+                    if self.index is not None:
+                        for line, started_at in written:
+                            self.index.record(self._stat, offset, started_at)
+                            offset += len(line)
+                    bytes_counter.inc(len(data))
+                    lines_counter.inc(len(written))
+                    self._unsynced_bytes += len(data)
+                if self._unsynced_bytes and (self._unsynced_bytes >= self.fsync_bytes or
+                                             time.monotonic() - self._last_sync >= self.fsync_interval):
+                    self._sync()
+            except IOError as e:
+                logger.error(f"Failed to write to {self.path}: {str(e)}")
+                error_counter.labels(type='file_write').inc()
+                self._discard()
+                # Not written yet: keep them for the next pass
+                self._retry = chunks
+                if self._stop.is_set():
+                    break
+                time.sleep(1)
+        unwritten = len(self._retry) + self._queue.qsize()
+        if unwritten:
+            dropped_counter.labels(reason='write_failed').inc(unwritten)
+            logger.error(f"Dropped {unwritten} lines that could not be written to {self.path}")
+        try:
+            self._close()
+        except IOError as e:
+            logger.error(f"Failed to close {self.path}: {str(e)}")
@@ -0,0 +1,228 @@
+import argparse
+import gzip
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from glob import glob
+
+from dedup import request_id
+from filters import IngestFilter
+from logfiles import JSON_LOG_FILES, LOG_DIR
+from persistence import atomic_write_json, load_json
+import fastjson
+from shipper import BULK_MAX_DOCS, ES_BULK_URL, BulkShipper, bulk_action
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_CHECKPOINT_FILE = '/app/state/backfill.json'
+CHUNK_BYTES = 32 * 1024 * 1024
+REPORT_INTERVAL = 5
+
+# Backfill runs next to the live server (make backfill), so it must not import
+# pipeline: that would open a second spool, rollup store, usage meter and time
+# index on the server's state files. It only needs the ingest filter's projection,
+# and its own shipper.
+ingest_filter = IngestFilter.from_file()
+
+
+def discover_files(log_dir=LOG_DIR):
+    """Kong logs in ``log_dir``, including logrotate's ``.N`` and ``.N.gz`` files."""
+    paths = set()
+    for name in JSON_LOG_FILES + ['logs.json', 'logs-*.json']:
+        base = os.path.join(log_dir, name)
+        paths.update(p for p in glob(base) + glob(base + '.*') if os.path.isfile(p))
+    return sorted(paths)
+
+
+def plan_chunks(paths, chunk_bytes=CHUNK_BYTES):
+    """Split files into (path, start, end) byte ranges. Gzipped files cannot be
+    split and become one chunk with ``end`` None."""
+    chunks = []
+    for path in paths:
+        if path.endswith('.gz'):
+            chunks.append((path, 0, None))
+            continue
+        size = os.path.getsize(path)
+        for start in range(0, size, chunk_bytes):
+            chunks.append((path, start, min(start + chunk_bytes, size)))
+    return chunks
+
+
+def chunk_id(chunk):
+    path, start, _ = chunk
+    return f'{path}:{start}'
+
+
+def read_chunk(path, start, end):
+    """Yield the lines that start inside [start, end).
+
+    A line straddling ``start`` belongs to the previous chunk, so neighbouring
+    chunks together see every line exactly once.
+    """
+    if end is None:
+        with gzip.open(path, 'rb') as f:
+            yield from f
+        return
+    with open(path, 'rb') as f:
+        pos = start
+        if start:
+            f.seek(start - 1)
+            if f.read(1) != b'\n':
+                pos += len(f.readline())
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            yield line
+
+
+def filter_log(log, sample=False):
+    """The document to ship for ``log``: projected like live logs, but only
+    sampled with ``sample``, as history is usually backfilled to be complete."""
+    if sample:
+        return ingest_filter.apply(log)
+    return ingest_filter.project(log) if ingest_filter.projects else log
+
+
+def parse_chunk(chunk, sample=False):
+    """Process pool worker: validate the chunk's lines, apply the ingest filter
+    and return them ready for _bulk."""
+    docs, invalid = [], 0
+    for line in read_chunk(*chunk):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            log = fastjson.loads(line)
+        except ValueError:
+            invalid += 1
+            continue
+        doc = filter_log(log, sample)
+        if doc is log:
+            docs.append((bulk_action(request_id(log)), line))
+        elif doc is not None:
+            docs.append((bulk_action(request_id(log)), fastjson.dumps(doc)))
+    return chunk, docs, invalid
+
+
+class Progress:
+    def __init__(self, total_chunks):
+        self.total_chunks = total_chunks
+        self.done_chunks = 0
+        self.docs = 0
+        self.bytes = 0
+        self.invalid = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self._last_report = self.started
+
+    def add(self, docs, nbytes, invalid):
+        with self._lock:
+            self.done_chunks += 1
+            self.docs += docs
+            self.bytes += nbytes
+            self.invalid += invalid
+            now = time.monotonic()
+            if now - self._last_report >= REPORT_INTERVAL:
+                self._last_report = now
+                self.report()
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        logger.info(f"Backfill: {self.done_chunks}/{self.total_chunks} chunks, {self.docs} docs "
+                    f"({self.docs / elapsed:.0f} docs/s, {self.bytes / elapsed / 1024 / 1024:.1f} MB/s), "
+                    f"{self.invalid} invalid lines")
+
+
+def run_backfill(paths, url=ES_BULK_URL, workers=None, parallel=4, chunk_bytes=CHUNK_BYTES,
+                 batch_docs=BULK_MAX_DOCS, checkpoint_file=BACKFILL_CHECKPOINT_FILE, sample=False):
+    """Reprocess ``paths`` into Elasticsearch. Returns True if every chunk was shipped.
+
+    Chunks are parsed in a process pool and shipped by ``parallel`` threads.
+    Completed chunks are recorded in ``checkpoint_file`` together with each
+    file's size and mtime, so an interrupted run resumes where it stopped
+    and a file that changed since is processed again.
+    """
+    files = {p: [os.path.getsize(p), os.stat(p).st_mtime] for p in paths}
+    state = load_json(checkpoint_file, default={'files': {}, 'done': []})
+    # Chunks of files that changed since the checkpoint are done again
+    unchanged = {p for p, identity in state['files'].items() if files.get(p) == identity}
+    done = {c for c in state['done'] if c.rsplit(':', 1)[0] in unchanged}
+    chunks = [c for c in plan_chunks(paths, chunk_bytes) if chunk_id(c) not in done]
+    logger.info(f"Backfilling {len(paths)} files: {len(chunks)} chunks to do, {len(done)} already done")
+
+    shipper = BulkShipper(url=url, max_docs=batch_docs, pool_size=parallel)
+    progress = Progress(len(chunks))
+    state_lock = threading.Lock()
+    failed = threading.Event()
+
+    def ship_chunk(chunk, docs, invalid):
+        for i in range(0, len(docs), batch_docs):
+            if failed.is_set() or not shipper.ship(docs[i:i + batch_docs]):
+                failed.set()
+                return
+        with state_lock:
+            done.add(chunk_id(chunk))
+            atomic_write_json(checkpoint_file, {'files': files, 'done': sorted(done)})
+        progress.add(len(docs), sum(len(doc) for _, doc in docs), invalid)
+
+    with ProcessPoolExecutor(max_workers=workers) as parsers, ThreadPoolExecutor(max_workers=parallel) as senders:
+        # Keep a bounded number of parsed chunks in memory
+        window = (workers or os.cpu_count() or 1) + parallel
+        pending_chunks = iter(chunks)
+        parsing, shipping = set(), set()
+        while True:
+            while len(parsing) + len(shipping) < window and not failed.is_set():
+                chunk = next(pending_chunks, None)
+                if chunk is None:
+                    break
+                parsing.add(parsers.submit(parse_chunk, chunk, sample))
+            if not parsing and not shipping:
+                break
+            finished, _ = wait(parsing | shipping, return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future in parsing:
+                    parsing.discard(future)
+                    shipping.add(senders.submit(ship_chunk, *future.result()))
+                else:
+                    shipping.discard(future)
+                    future.result()
+    progress.report()
+    if failed.is_set():
+        logger.error("Backfill stopped because Elasticsearch refused documents; run it again to resume")
+        return False
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='backfill.py',
+                                     description='Reprocess historical Kong logs into Elasticsearch.')
+    parser.add_argument('paths', nargs='*', help='log files (default: every Kong log in /app/logs)')
+    parser.add_argument('--url', default=ES_BULK_URL, help='Elasticsearch _bulk URL')
+    parser.add_argument('--workers', type=int, default=None, help='parser processes (default: CPU count)')
+    parser.add_argument('--parallel', type=int, default=4, help='concurrent bulk requests')
+    parser.add_argument('--chunk-mb', type=int, default=CHUNK_BYTES // 1024 // 1024, help='chunk size in MiB')
+    parser.add_argument('--batch-docs', type=int, default=BULK_MAX_DOCS, help='documents per bulk request')
+    parser.add_argument('--checkpoint', default=BACKFILL_CHECKPOINT_FILE, help='resume checkpoint file')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and start over')
+    parser.add_argument('--sample', action='store_true',
+                        help='apply the ingest filter sampling rules too (default: keep every log)')
+    args = parser.parse_args(argv)
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.unlink(args.checkpoint)
+    paths = args.paths or discover_files()
+    ok = run_backfill(paths, url=args.url, workers=args.workers, parallel=args.parallel,
+                      chunk_bytes=args.chunk_mb * 1024 * 1024, batch_docs=args.batch_docs,
+                      checkpoint_file=args.checkpoint, sample=args.sample)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'),
+                        format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,64 @@
+import logging
+import os
+import threading
+import zlib
+
+from metrics import error_counter
+from persistence import STATE_DIR, atomic_write_json, load_json
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = os.getenv('TAIL_CHECKPOINT_FILE', os.path.join(STATE_DIR, 'tail_checkpoints.json'))
+# Bytes just before the offset that are hashed to detect a truncated-and-refilled file
+FINGERPRINT_BYTES = 64
+
+
+def fingerprint(f, offset):
+    """CRC32 of the bytes of ``f`` that end at ``offset``."""
+    start = max(0, offset - FINGERPRINT_BYTES)
+    return zlib.crc32(os.pread(f.fileno(), offset - start, start))
+
+
+class CheckpointStore:
+    """Byte offsets of tailed log files, persisted across restarts.
+
+    An offset is only valid for the exact file it was taken from, so every
+    entry remembers the (device, inode) pair alongside the path. When the
+    path now points at a different inode the file was rotated, and when the
+    file is shorter than the offset, or the bytes before the offset no longer
+    match the stored fingerprint, it was truncated in place.
+    """
+
+    def __init__(self, path=CHECKPOINT_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._dirty = False
+        for entry in load_json(path, default=[]):
+            self._entries[entry['path']] = entry
+        if self._entries:
+            logger.info(f"Loaded {len(self._entries)} tail checkpoints from {path}")
+
+    def get(self, path):
+        with self._lock:
+            entry = self._entries.get(path)
+            return dict(entry) if entry else None
+
+    def set(self, path, dev, ino, offset, crc=None):
+        with self._lock:
+            self._entries[path] = {'path': path, 'dev': dev, 'ino': ino, 'offset': offset, 'crc': crc}
+            self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = list(self._entries.values())
+            self._dirty = False
+        try:
+            atomic_write_json(self.path, entries)
+        except OSError as e:
+            logger.error(f"Failed to save tail checkpoints: {str(e)}")
+            error_counter.labels(type='checkpoint').inc()
+            with self._lock:
+                self._dirty = True
@@ -0,0 +1,113 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from prometheus_client import Counter
+
+from metrics import error_counter
+
+logger = logging.getLogger(__name__)
+
+# How long, and for how many request IDs at most, a request is remembered
+DEDUP_WINDOW_SECONDS = float(os.getenv('DEDUP_WINDOW_SECONDS', '300'))
+DEDUP_CAPACITY = int(os.getenv('DEDUP_CAPACITY', '200000'))
+# Request IDs seen by any worker process, when the supervisor runs several
+DEDUP_DB = os.getenv('DEDUP_DB', '/app/state/dedup.db')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS seen (
+    id TEXT PRIMARY KEY,
+    seen_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS seen_by_time ON seen (seen_at);
+'''
+
+duplicate_counter = Counter('logging_service_duplicate_logs_total',
+                            'Logs dropped because their Kong request ID was already ingested')
+
+
+def request_id(log):
+    """Kong's ID of the request a log describes, or None."""
+    return (log.get('request') or {}).get('id') or None
+
+
+class RecentRequests:
+    """Time-bounded set of the Kong request IDs ingested lately.
+
+    Routes with both the http-log and the file-log plugin deliver each
+    request twice, usually seconds apart. :meth:`first` remembers an ID for
+    ``window`` seconds and at most ``capacity`` IDs, evicting the oldest
+    first, so memory stays fixed however busy Kong is. Logs without a
+    request ID are never considered duplicates.
+
+    With several worker processes the two copies usually reach different
+    workers: the kernel picks which one gets an http-log delivery and each
+    tails only its share of the File Log files. Given a ``path``, an ID not
+    in this process's set is also claimed in the ``seen`` table of that
+    SQLite database, shared by the workers, and only the worker whose
+    insert wins ingests the request. The table is pruned to the window.
+    If the database fails the log is ingested rather than lost.
+    """
+
+    def __init__(self, window=DEDUP_WINDOW_SECONDS, capacity=DEDUP_CAPACITY, path=None, clock=time.time):
+        self.window = window
+        self.capacity = capacity
+        self.path = path
+        # Wall clock: the workers compare their timestamps in the shared table
+        self.clock = clock
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pruned_at = 0
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute('PRAGMA busy_timeout=10000')
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            # Losing the last few IDs in a crash only lets a duplicate through
+            self._conn.execute('PRAGMA synchronous=OFF')
+            self._conn.executescript(SCHEMA)
+
+    def __len__(self):
+        return len(self._seen)
+
+    def first(self, log):
+        """True unless a log of the same request was seen within the window."""
+        key = request_id(log)
+        if key is None or self.capacity <= 0:
+            return True
+        now = self.clock()
+        with self._lock:
+            seen = self._seen
+            while seen:
+                oldest, seen_at = next(iter(seen.items()))
+                if now - seen_at < self.window:
+                    break
+                del seen[oldest]
+            if key in seen or not self._claim(key, now):
+                duplicate_counter.inc()
+                return False
+            seen[key] = now
+            if len(seen) > self.capacity:
+                seen.popitem(last=False)
+            return True
+
+    def _claim(self, key, now):
+        """Record ``key`` in the shared table; False if another worker saw it within the window."""
+        if self._conn is None:
+            return True
+        try:
+            if now - self._pruned_at >= self.window / 10:
+                self._conn.execute('DELETE FROM seen WHERE seen_at < ?', (now - self.window,))
+                self._pruned_at = now
+            cursor = self._conn.execute(
+                'INSERT INTO seen VALUES (?, ?) ON CONFLICT (id) DO UPDATE SET seen_at = excluded.seen_at '
+                'WHERE seen_at < ?', (key, now, now - self.window))
+            return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            logger.error(f"Failed to check request {key} in {self.path}: {str(e)}")
+            error_counter.labels(type='dedup').inc()
+            return True
@@ -1,5 +1,6 @@
 #!/bin/sh
 # Start cron as root
 cron
-# Switch to nobody and run the Python app
-exec gosu nobody:nogroup python http_log_server.py
\ No newline at end of file
+# Switch to nobody and run the Python app; the supervisor starts
+# LOGGING_SERVICE_WORKERS worker processes, or just the server when it is 1
+exec gosu nobody:nogroup python supervisor.py
\ No newline at end of file
@@ -0,0 +1,78 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # the stdlib decoder is several times slower but equivalent
+    orjson = None
+
+# Bytes read from a log file per read() call
+READ_CHUNK_BYTES = 1024 * 1024
+
+
+def loads(data):
+    """Decode JSON from bytes, a memoryview or str, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def dumps(obj):
+    """Encode ``obj`` as compact JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def iter_lines(f, offset, chunk_bytes=READ_CHUNK_BYTES):
+    """Yield ``(offset, line)`` for every complete line of binary file ``f`` after ``offset``.
+
+    The file is read in large chunks and each line is a memoryview into the
+    chunk, without its newline, so no per-line copy is made. A trailing
+    line without a newline is not yielded; the writer has not finished it.
+    """
+    f.seek(offset)
+    pending = b''
+    while True:
+        chunk = f.read(chunk_bytes)
+        if not chunk:
+            return
+        data = pending + chunk if pending else chunk
+        view = memoryview(data)
+        pos = 0
+        while True:
+            newline = data.find(b'\n', pos)
+            if newline == -1:
+                break
+            yield offset + pos, view[pos:newline]
+            pos = newline + 1
+        pending = data[pos:]
+        offset += pos
+
+
+def peek_int(buffer, key, start, end):
+    """The integer value of field ``key`` in the JSON line ``buffer[start:end]``, without decoding it.
+
+    Only top-level fields are read, such as ``started_at``: returns None
+    when the key is missing, appears more than once, is nested in another
+    object or its value is not a plain integer, in which case the caller
+    should decode the line.
+    """
+    needle = b'"' + key + b'":'
+    pos = buffer.find(needle, start, end)
+    if pos == -1 or buffer.find(needle, pos + len(needle), end) != -1:
+        return None
+    # Braces inside strings can only make this look nested, which falls back to decoding
+    before = buffer[start:pos]
+    if before.count(b'{') - before.count(b'}') != 1:
+        return None
+    pos += len(needle)
+    while pos < end and buffer[pos:pos + 1] == b' ':
+        pos += 1
+    digits = pos
+    while pos < end and buffer[pos:pos + 1].isdigit():
+        pos += 1
+    if pos == digits or buffer[pos:pos + 1] not in (b',', b'}', b' '):
+        return None
+    return int(buffer[digits:pos])
@@ -0,0 +1,189 @@
+import logging
+import os
+import random
+import zlib
+
+from prometheus_client import Counter
+
+from persistence import load_json
+from routes import normalize_uri
+
+logger = logging.getLogger(__name__)
+
+INGEST_FILTER_CONFIG = os.getenv('INGEST_FILTER_CONFIG', '/app/ingest_filter.json')
+
+# Fields a projection never removes: the time index and dedup rely on them
+REQUIRED_FIELDS = ('started_at', 'request.id')
+
+filtered_counter = Counter('logging_service_filtered_docs_total',
+                           'Logs by outcome of the ingest filter', ['outcome'])
+
+
+def _status_matches(pattern, status):
+    pattern = str(pattern)
+    if pattern.endswith('xx'):
+        return str(status).startswith(pattern[0]) and len(str(status)) == 3
+    return pattern == str(status)
+
+
+class Rule:
+    """One sampling rule: ``match`` conditions and the ``sample`` rate kept.
+
+    ``match`` may hold ``route`` (a route template as in ``/metrics``),
+    ``route_name`` and ``service`` (Kong names), ``method`` and ``status``
+    (``404`` or a class like ``5xx``); each may be a single value or a
+    list of alternatives. An empty ``match`` matches everything.
+    """
+
+    def __init__(self, match, sample):
+        self.match = {key: value if isinstance(value, list) else [value] for key, value in match.items()}
+        self.sample = float(sample)
+
+    def matches(self, fields):
+        for key, alternatives in self.match.items():
+            if key == 'status':
+                if not any(_status_matches(p, fields['status']) for p in alternatives):
+                    return False
+            elif fields.get(key) not in alternatives:
+                return False
+        return True
+
+
+class IngestFilter:
+    """Drops, samples and trims logs between parsing and shipping.
+
+    The first rule that matches a log decides the fraction of such logs
+    kept (``default_sample`` if none does). The decision is derived from
+    ``request.id`` when there is one, so the same request is kept or
+    dropped consistently whichever plugin delivered it. Kept logs are
+    projected: ``keep_fields`` (dotted paths) whitelists fields,
+    ``drop_fields`` removes them and strings longer than
+    ``max_string_length`` are truncated. The filter only decides what is
+    shipped and archived; aggregates, rollups and metering count every log.
+
+    The ``ingest_filter.json`` shipped with the service keeps every log
+    unchanged. ``ingest_filter.example.json`` holds this example
+    configuration, to copy over it and adapt::
+
+        {
+            "rules": [
+                {"match": {"status": "5xx"}, "sample": 1.0},
+                {"match": {"route": "/health"}, "sample": 0},
+                {"match": {"method": "GET", "route": "/api/manga/", "status": "2xx"}, "sample": 0.01}
+            ],
+            "default_sample": 1.0,
+            "drop_fields": ["request.headers", "response.headers"],
+            "max_string_length": 2048
+        }
+    """
+
+    def __init__(self, config=None):
+        config = config or {}
+        self.rules = [Rule(rule.get('match', {}), rule.get('sample', 1.0)) for rule in config.get('rules', [])]
+        self.default_sample = float(config.get('default_sample', 1.0))
+        self.keep_fields = [f.split('.') for f in config.get('keep_fields') or []]
+        if self.keep_fields:
+            self.keep_fields += [f.split('.') for f in REQUIRED_FIELDS]
+        self.drop_fields = [f.split('.') for f in config.get('drop_fields') or [] if f not in REQUIRED_FIELDS]
+        self.max_string_length = config.get('max_string_length')
+
+    @classmethod
+    def from_file(cls, path=INGEST_FILTER_CONFIG):
+        config = load_json(path)
+        if config is None:
+            logger.info(f"No ingest filter configuration at {path}, shipping every log unchanged")
+        else:
+            logger.info(f"Loaded {len(config.get('rules', []))} ingest filter rules from {path}")
+        return cls(config)
+
+    @property
+    def projects(self):
+        """Whether kept logs are changed at all."""
+        return bool(self.keep_fields or self.drop_fields or self.max_string_length)
+
+    def sample_rate(self, log):
+        request = log.get('request', {})
+        fields = {
+            'route': normalize_uri(request.get('uri')),
+            'route_name': (log.get('route') or {}).get('name'),
+            'service': (log.get('service') or {}).get('name'),
+            'method': request.get('method'),
+            'status': log.get('response', {}).get('status', 0),
+        }
+        for rule in self.rules:
+            if rule.matches(fields):
+                return rule.sample
+        return self.default_sample
+
+    def keep(self, log):
+        rate = self.sample_rate(log)
+        if rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+        request_id = log.get('request', {}).get('id')
+        if request_id:
+            return zlib.crc32(str(request_id).encode('utf-8')) / 0xFFFFFFFF < rate
+        return random.random() < rate
+
+    def apply(self, log):
+        """The document to ship for ``log``, or None if it is filtered out."""
+        if not self.keep(log):
+            filtered_counter.labels(outcome='dropped').inc()
+            return None
+        filtered_counter.labels(outcome='kept').inc()
+        if not self.projects:
+            return log
+        return self.project(log)
+
+    def project(self, log):
+        if self.keep_fields:
+            doc = {}
+            for path in self.keep_fields:
+                _copy_path(log, doc, path)
+        else:
+            doc = log
+        for path in self.drop_fields:
+            doc = _without_path(doc, path)
+        if self.max_string_length:
+            doc = _truncate(doc, self.max_string_length)
+        return doc
+
+
+def _copy_path(source, target, path):
+    for key in path[:-1]:
+        source = source.get(key)
+        if not isinstance(source, dict):
+            return
+        target = target.setdefault(key, {})
+    if path[-1] in source:
+        target[path[-1]] = source[path[-1]]
+
+
+def _without_path(doc, path):
+    """``doc`` without the field at ``path``; only the dicts along the path are copied."""
+    if len(path) == 1:
+        if path[0] not in doc:
+            return doc
+        doc = dict(doc)
+        del doc[path[0]]
+        return doc
+    child = doc.get(path[0])
+    if not isinstance(child, dict):
+        return doc
+    trimmed = _without_path(child, path[1:])
+    if trimmed is child:
+        return doc
+    doc = dict(doc)
+    doc[path[0]] = trimmed
+    return doc
+
+
+def _truncate(value, limit):
+    if isinstance(value, str):
+        return value[:limit]
+    if isinstance(value, dict):
+        return {key: _truncate(item, limit) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_truncate(item, limit) for item in value]
+    return value
@@ -1,29 +1,35 @@
-from flask import Flask, request
+from aiohttp import web
+import asyncio
 import json
 import os
-from glob import glob
 import time
 import threading
 import logging
+import signal
+import sqlite3
 import requests
-from prometheus_client import Counter as PrometheusCounter, Histogram, start_http_server
-from collections import Counter as CollectionsCounter
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-
-app = Flask(__name__)
-
-# Prometheus metrics
-request_counter = PrometheusCounter('logging_service_requests_total', 'Total requests received', ['endpoint'])
-error_counter = PrometheusCounter('logging_service_errors_total', 'Total errors', ['type'])
-latency_histogram = Histogram('logging_service_request_latency', 'Request latency', ['endpoint'])
+from datetime import datetime
+from glob import glob
+from prometheus_client import start_http_server
+from metrics import error_counter, latency_histogram
+from tailer import JSON_LOG_FILES, LOG_DIR, process_file_logs
+from aggregates import MetricsAggregator
+from ingest_buffer import IngestBuffer
+from archive import ArchiveWriter
+from dedup import request_id
+import fastjson
+import pipeline
+import rollups
+import search
+import topk
+import workers
 
 # Create service logs directory
 os.makedirs('/app/service_logs', exist_ok=True)
 
 # Configure logging to write only to /app/service_logs/service.log
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.getenv('LOG_LEVEL', 'INFO'),
     format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
     handlers=[
         logging.FileHandler('/app/service_logs/service.log'),
@@ -32,132 +38,271 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Elasticsearch endpoint
-ES_URL = 'http://elasticsearch:9200/kong-logs/_doc'
+# Seconds Kong is asked to wait before retrying a refused batch
+RETRY_AFTER = '1'
 
-# JSON log files from File Log plugin
-JSON_LOG_FILES = [
-    'auth-login.log', 'auth-logout.log', 'auth-refresh.log', 'auth-register.log',
-    'manga.log', 'media.log', 'novel.log'
-]
+# Group-commit writer for /app/logs/logs.json
+archive = ArchiveWriter(index=pipeline.time_index)
 
-def send_to_elasticsearch(log):
-    try:
-        session = requests.Session()
-        retries = Retry(total=5, backoff_factor=1, status_forcelist=[502, 503, 504])
-        session.mount('http://', HTTPAdapter(max_retries=retries))
-        
-        response = session.post(ES_URL, json=log, timeout=5)
-        response.raise_for_status()
-        logger.info(f"Sent log to Elasticsearch: {log['request']['uri']}")
-    except requests.RequestException as e:
-        logger.error(f"Failed to send log to Elasticsearch: {str(e)}")
-        error_counter.labels(type='elasticsearch').inc()
-
-def process_file_logs():
-    """Process JSON File Log plugin logs from /app/logs"""
-    processed_files = {}
-    while True:
-        try:
-            for log_file in glob('/app/logs/*.log'):
-                file_name = os.path.basename(log_file)
-                if file_name not in JSON_LOG_FILES:
-                    logger.debug(f"Skipping non-JSON log file: {file_name}")
-                    continue
-                logger.debug(f"Processing log file: {file_name}")
-                file_pos = processed_files.get(log_file, 0)
-                try:
-                    with open(log_file, 'r') as f:
-                        f.seek(file_pos)
-                        for line in f:
-                            try:
-                                log = json.loads(line.strip())
-                                send_to_elasticsearch(log)
-                                request_counter.labels(endpoint=log['request']['uri']).inc()
-                            except json.JSONDecodeError as e:
-                                logger.warning(f"Invalid JSON in {file_name}: {str(e)}")
-                                error_counter.labels(type='json_parse').inc()
-                            except KeyError as e:
-                                logger.warning(f"Missing key in log {file_name}: {str(e)}")
-                                error_counter.labels(type='key_error').inc()
-                        processed_files[log_file] = f.tell()
-                except IOError as e:
-                    logger.error(f"Error reading {file_name}: {str(e)}")
-                    error_counter.labels(type='file_read').inc()
-        except Exception as e:
-            logger.error(f"Error processing file logs: {str(e)}")
-            error_counter.labels(type='file_processing').inc()
-        time.sleep(60)
-
-@app.route('/logs', methods=['POST'])
-def receive_logs():
+# Lines returned by one /logs/range request at most
+RANGE_LIMIT = 1000
+
+def process_http_log(log_data):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Received HTTP log: {json.dumps(log_data, indent=2)}")
+    doc = pipeline.ingest(log_data, source='http-log')
+    if doc is not None:
+        archive.append(fastjson.dumps(doc) + b'\n', started_at=doc.get('started_at'))
+
+# Entries are acknowledged once buffered; workers archive and ingest them
+ingest_buffer = IngestBuffer(process_http_log)
+
+async def receive_logs(request):
+    """Accept one Kong http-log entry, or a JSON array of them when Kong batches."""
     start_time = time.time()
     try:
-        log_data = request.get_json()
-        if not log_data:
-            error_counter.labels(type='invalid_request').inc()
-            return {"status": "error", "message": "Invalid JSON"}, 400
-        logger.info(f"Received HTTP log: {json.dumps(log_data, indent=2)}")
-        try:
-            with open('/app/logs/logs.json', 'a') as f:
-                f.write(json.dumps(log_data) + '\n')
-        except IOError as e:
-            logger.error(f"Failed to write to logs.json: {str(e)}")
-            error_counter.labels(type='file_write').inc()
-        send_to_elasticsearch(log_data)
-        request_counter.labels(endpoint=log_data.get('request', {}).get('uri', 'unknown')).inc()
-        latency_histogram.labels(endpoint=log_data.get('request', {}).get('uri', 'unknown')).observe(time.time() - start_time)
-        return {"status": "success"}, 200
-    except Exception as e:
-        logger.error(f"Error processing HTTP log: {str(e)}")
-        error_counter.labels(type='http_processing').inc()
-        return {"status": "error", "message": str(e)}, 500
-
-@app.route('/metrics', methods=['GET'])
-def get_metrics():
-    counts = CollectionsCounter()
-    latencies = CollectionsCounter()
-    errors = CollectionsCounter()
-    clients = CollectionsCounter()
-    try:
-        for log_file in glob('/app/logs/*.log'):
-            if os.path.basename(log_file) not in JSON_LOG_FILES:
-                continue
-            try:
-                with open(log_file, 'r') as f:
-                    for line in f:
-                        try:
-                            log = json.loads(line.strip())
-                            uri = log['request']['uri']
-                            counts[uri] += 1
-                            latencies[uri] += log['latencies']['request']
-                            if log['response']['status'] >= 400:
-                                errors[uri] += 1
-                            clients[log.get('client_ip', 'unknown')] += 1
-                        except json.JSONDecodeError:
-                            continue
-            except IOError:
+        log_data = fastjson.loads(await request.read())
+    except ValueError:
+        log_data = None
+    entries = log_data if isinstance(log_data, list) else [log_data]
+    if not log_data or not all(isinstance(entry, dict) and entry for entry in entries):
+        error_counter.labels(type='invalid_request').inc()
+        return web.json_response({"status": "error", "message": "Invalid JSON"}, status=400)
+    refused = ingest_buffer.offer(entries)
+    if refused:
+        message = "Ingest buffer full" if refused == 429 else "Not accepting logs"
+        return web.json_response({"status": "error", "message": message}, status=refused,
+                                 headers={'Retry-After': RETRY_AFTER})
+    latency_histogram.labels(endpoint='/logs').observe(time.time() - start_time)
+    return web.json_response({"status": "success", "accepted": len(entries)})
+
+def parse_time_range(query):
+    """``from``/``to`` query parameters as epoch milliseconds, like Kong's started_at."""
+    bounds = []
+    for name in ('from', 'to'):
+        value = query.get(name)
+        if value is None:
+            bounds.append(None)
+        elif value.isdigit():
+            bounds.append(int(value))
+        else:
+            # ISO 8601, e.g. 2024-05-01T14:00:00+07:00
+            bounds.append(int(datetime.fromisoformat(value).timestamp() * 1000))
+    return bounds
+
+def range_files(include_archive=True):
+    """Every log file that can be range-queried: the live files and logrotate's uncompressed .1.
+    The archive only holds what the ingest filter kept, so metric windows leave it out."""
+    paths = []
+    names = list(JSON_LOG_FILES)
+    if include_archive:
+        names += ['logs.json'] + [os.path.basename(p) for p in glob(os.path.join(LOG_DIR, 'logs-*.json'))]
+    for name in names:
+        path = os.path.join(LOG_DIR, name)
+        paths += [path + '.1', path]
+    return paths
+
+def scan_range(from_ms, to_ms, include_archive=True):
+    """``(line, log)`` of every request in the range, once: a request found in
+    several files (both Kong plugins, a rotation) is yielded the first time only."""
+    pipeline.time_index.prune(LOG_DIR)
+    seen = set()
+    for line, log in pipeline.time_index.scan(range_files(include_archive), from_ms, to_ms):
+        key = request_id(log)
+        if key is not None:
+            if key in seen:
                 continue
-        avg_latencies = {k: v / counts[k] for k, v in latencies.items() if counts[k]}
-        return {
-            "request_counts": dict(counts),
-            "avg_latencies_ms": dict(avg_latencies),
-            "error_counts": dict(errors),
-            "client_counts": dict(clients)
-        }, 200
+            seen.add(key)
+        yield line, log
+
+def window_metrics(from_ms, to_ms):
+    """Metrics over a time range from the unsampled Kong File Log files. Requests only
+    delivered by the HTTP Log plugin are not in them; the unwindowed /metrics counts those."""
+    window = MetricsAggregator(path=None, export=False)
+    for _, log in scan_range(from_ms, to_ms, include_archive=False):
+        window.observe(log)
+    return window.snapshot()
+
+def range_lines(from_ms, to_ms, limit):
+    lines = []
+    for line, _ in scan_range(from_ms, to_ms):
+        if len(lines) >= limit:
+            return lines, True
+        lines.append(line)
+    return lines, False
+
+async def get_metrics(request):
+    try:
+        from_ms, to_ms = parse_time_range(request.query)
+    except ValueError:
+        return web.json_response({"status": "error", "message": "Invalid from/to"}, status=400)
+    try:
+        if from_ms is None and to_ms is None:
+            return web.json_response(pipeline.metrics_snapshot())
+        snapshot = await asyncio.get_running_loop().run_in_executor(None, window_metrics, from_ms, to_ms)
+        return web.json_response(snapshot)
     except Exception as e:
         logger.error(f"Error computing metrics: {str(e)}")
-        return {"status": "error", "message": str(e)}, 500
+        return web.json_response({"status": "error", "message": str(e)}, status=500)
 
-@app.route('/disk', methods=['GET'])
-def disk_space():
+async def get_rollups(request):
+    """Rollup buckets for dashboards: ?from=&to=[&resolution=1m|1h|1d][&group_by=route,status_class,consumer]
+    [&route=][&consumer=]. The range defaults to the last hour."""
+    try:
+        from_ms, to_ms = parse_time_range(request.query)
+        resolution = request.query.get('resolution')
+        if resolution is not None:
+            resolution = rollups.RESOLUTIONS[resolution]
+        group_by = tuple(request.query.get('group_by', ','.join(rollups.DIMENSIONS)).split(','))
+        if not set(group_by) <= set(rollups.DIMENSIONS):
+            raise ValueError(group_by)
+    except (ValueError, KeyError):
+        return web.json_response({"status": "error", "message": "Invalid query"}, status=400)
+    to_ms = to_ms if to_ms is not None else int(time.time() * 1000)
+    from_ms = from_ms if from_ms is not None else to_ms - rollups.HOUR
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: pipeline.rollups.query(from_ms, to_ms, resolution=resolution, group_by=group_by,
+                                                 route=request.query.get('route'),
+                                                 consumer=request.query.get('consumer')))
+        return web.json_response(result)
+    except Exception as e:
+        logger.error(f"Error querying rollups: {str(e)}")
+        return web.json_response({"status": "error", "message": str(e)}, status=500)
+
+def usage_range(query):
+    """from/to for the usage endpoints; defaults to the last 24 hours."""
+    from_ms, to_ms = parse_time_range(query)
+    to_ms = to_ms if to_ms is not None else int(time.time() * 1000)
+    from_ms = from_ms if from_ms is not None else to_ms - 24 * 3600 * 1000
+    return from_ms, to_ms
+
+async def get_usage(request):
+    """Hourly calls and bytes: ?from=&to=[&consumer=][&route=] (route is Kong's route.name)"""
+    try:
+        from_ms, to_ms = usage_range(request.query)
+    except ValueError:
+        return web.json_response({"status": "error", "message": "Invalid from/to"}, status=400)
+    try:
+        rows = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: pipeline.meter.usage(from_ms, to_ms, consumer=request.query.get('consumer'),
+                                               route=request.query.get('route')))
+        return web.json_response({"from": from_ms, "to": to_ms, "usage": rows})
+    except Exception as e:
+        logger.error(f"Error querying usage: {str(e)}")
+        return web.json_response({"status": "error", "message": str(e)}, status=500)
+
+async def get_top_consumers(request):
+    """Top consumers: ?from=&to=[&n=10][&by=calls|bytes][&route=]"""
+    try:
+        from_ms, to_ms = usage_range(request.query)
+        n = int(request.query.get('n', 10))
+        by = request.query.get('by', 'calls')
+        if by not in ('calls', 'bytes'):
+            raise ValueError(by)
+    except ValueError:
+        return web.json_response({"status": "error", "message": "Invalid query"}, status=400)
+    try:
+        rows = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: pipeline.meter.top_consumers(from_ms, to_ms, n=n, by=by, route=request.query.get('route')))
+        return web.json_response({"from": from_ms, "to": to_ms, "consumers": rows})
+    except Exception as e:
+        logger.error(f"Error querying top consumers: {str(e)}")
+        return web.json_response({"status": "error", "message": str(e)}, status=500)
+
+async def get_heavy_hitters(request):
+    """Top keys per dimension over the sliding window: [?dimension=client_ip|consumer|uri][&k=10],
+    or the estimated requests of one key with ?dimension=&key="""
+    dimensions = request.query.getall('dimension', list(topk.DIMENSIONS))
+    try:
+        k = int(request.query.get('k', 10))
+        if not set(dimensions) <= set(topk.DIMENSIONS):
+            raise ValueError(dimensions)
+    except ValueError:
+        return web.json_response({"status": "error", "message": "Invalid query"}, status=400)
+    heavy_hitters = pipeline.heavy_hitters
+    if 'key' in request.query:
+        if len(dimensions) != 1:
+            return web.json_response({"status": "error", "message": "key needs one dimension"}, status=400)
+        key = request.query['key']
+        return web.json_response({"window_seconds": heavy_hitters.window_seconds, "dimension": dimensions[0],
+                                  "key": key, "estimate": pipeline.heavy_hitter_estimate(dimensions[0], key)})
+    return web.json_response({"window_seconds": heavy_hitters.window_seconds,
+                              "top": {d: pipeline.heavy_hitter_top(d, k) for d in dimensions}})
+
+async def search_logs(request):
+    """Local search: ?q=&status=&route=&consumer=&from=&to=&limit=&cursor=, newest first.
+    Pass the returned next_cursor as cursor to get the following page."""
+    if pipeline.search_index is None:
+        return web.json_response({"status": "error", "message": "Local search is disabled (LOCAL_SEARCH_ENABLED)"},
+                                 status=404)
+    query = request.query
+    try:
+        from_ms, to_ms = parse_time_range(query)
+        limit = min(int(query.get('limit', search.SEARCH_PAGE_SIZE)), search.SEARCH_PAGE_SIZE)
+        status = query.get('status')
+        if status is not None and not (status.isdigit() or (len(status) == 3 and status.endswith('xx'))):
+            raise ValueError(status)
+    except ValueError:
+        return web.json_response({"status": "error", "message": "Invalid query"}, status=400)
+    try:
+        logs, next_cursor = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: pipeline.search_index.search(
+                q=query.get('q'), status=status, route=query.get('route'), consumer=query.get('consumer'),
+                from_ms=from_ms, to_ms=to_ms, limit=limit, cursor=query.get('cursor')))
+    except (sqlite3.OperationalError, ValueError) as e:
+        return web.json_response({"status": "error", "message": f"Invalid query: {str(e)}"}, status=400)
+    except Exception as e:
+        logger.error(f"Error searching logs: {str(e)}")
+        return web.json_response({"status": "error", "message": str(e)}, status=500)
+    return web.json_response({"logs": logs, "next_cursor": next_cursor})
+
+async def logs_range(request):
+    """Raw log entries with from <= started_at < to, as newline-delimited JSON."""
+    try:
+        from_ms, to_ms = parse_time_range(request.query)
+        limit = min(int(request.query.get('limit', RANGE_LIMIT)), RANGE_LIMIT)
+    except ValueError:
+        return web.json_response({"status": "error", "message": "Invalid from/to/limit"}, status=400)
+    if from_ms is None or to_ms is None:
+        return web.json_response({"status": "error", "message": "from and to are required"}, status=400)
+    try:
+        lines, truncated = await asyncio.get_running_loop().run_in_executor(None, range_lines, from_ms, to_ms, limit)
+    except Exception as e:
+        logger.error(f"Error reading log range: {str(e)}")
+        return web.json_response({"status": "error", "message": str(e)}, status=500)
+    body = b''.join(line + b'\n' for line in lines)
+    return web.Response(body=body, content_type='application/x-ndjson',
+                        headers={'X-Truncated': str(truncated).lower()})
+
+async def disk_space(request):
     try:
         stat = os.statvfs('/app/logs')
         free_mb = stat.f_bavail * stat.f_frsize / 1024 / 1024
-        return {"free_space_mb": free_mb}, 200
+        return web.json_response({"free_space_mb": free_mb})
     except Exception as e:
         logger.error(f"Error checking disk space: {str(e)}")
-        return {"status": "error", "message": str(e)}, 500
+        return web.json_response({"status": "error", "message": str(e)}, status=500)
+
+async def stop_ingest(app):
+    ingest_buffer.stop()
+    archive.stop()
+
+def create_app():
+    app = web.Application(client_max_size=32 * 1024 * 1024)
+    app.add_routes([
+        web.post('/logs', receive_logs),
+        web.get('/metrics', get_metrics),
+        web.get('/logs/range', logs_range),
+        web.get('/logs/search', search_logs),
+        web.get('/rollups', get_rollups),
+        web.get('/usage', get_usage),
+        web.get('/usage/top', get_top_consumers),
+        web.get('/heavy-hitters', get_heavy_hitters),
+        web.get('/disk', disk_space),
+    ])
+    app.on_shutdown.append(stop_ingest)
+    return app
 
 if __name__ == "__main__":
     logger.info("Waiting for Elasticsearch to be ready...")
@@ -173,8 +318,18 @@ if __name__ == "__main__":
     else:
         logger.error("Elasticsearch not available after retries")
     
-    start_http_server(8001)
-    logger.info("Started Prometheus metrics server on port 8001")
+    pipeline.start()
+    archive.start()
+    signal.signal(signal.SIGHUP, lambda signum, frame: archive.reopen())
+    ingest_buffer.start()
+    logger.info("Started HTTP log ingestion workers")
+    if workers.multiprocess():
+        # The supervisor exports the metrics of every worker
+        logger.info(f"Running as worker {workers.WORKER_ID} of {workers.WORKER_COUNT}")
+    else:
+        start_http_server(8001)
+        logger.info("Started Prometheus metrics server on port 8001")
     threading.Thread(target=process_file_logs, daemon=True).start()
     logger.info("Started file log processing thread")
-    app.run(host='0.0.0.0', port=8080, debug=False)
\ No newline at end of file
+    # With several workers each one binds the port and the kernel spreads connections
+    web.run_app(create_app(), host='0.0.0.0', port=8080, access_log=None, reuse_port=workers.multiprocess())
\ No newline at end of file
@@ -0,0 +1,79 @@
+import logging
+import os
+import threading
+from collections import deque
+
+from prometheus_client import Counter, Gauge
+
+from metrics import error_counter, track
+
+logger = logging.getLogger(__name__)
+
+INGEST_BUFFER_SIZE = int(os.getenv('INGEST_BUFFER_SIZE', '50000'))
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '2'))
+
+buffer_depth_gauge = Gauge('logging_service_ingest_buffer_depth', 'HTTP log entries waiting to be processed',
+                           multiprocess_mode='livesum')
+rejected_counter = Counter('logging_service_ingest_rejected_total', 'HTTP log batches refused with backpressure', ['status'])
+
+
+class IngestBuffer:
+    """Bounded hand-off between the HTTP server and the ingestion workers.
+
+    :meth:`offer` never blocks: a batch is accepted whole or refused whole,
+    so the event loop can answer Kong right away and Kong retries a refused
+    batch as a unit. Worker threads take entries one at a time and pass them
+    to ``handler``.
+    """
+
+    def __init__(self, handler, capacity=INGEST_BUFFER_SIZE, workers=INGEST_WORKERS):
+        self.handler = handler
+        self.capacity = capacity
+        self.workers = workers
+        self.accepting = False
+        self._entries = deque()
+        self._cond = threading.Condition()
+        self._threads = []
+        track(buffer_depth_gauge, lambda: len(self._entries))
+
+    def start(self):
+        self.accepting = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'ingest-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=10):
+        """Refuse new batches and let the workers drain what is buffered."""
+        with self._cond:
+            self.accepting = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def offer(self, entries):
+        """Buffer a batch. Returns None on success, else the HTTP status to reply with."""
+        with self._cond:
+            if not self.accepting:
+                rejected_counter.labels(status='503').inc()
+                return 503
+            if len(self._entries) + len(entries) > self.capacity:
+                rejected_counter.labels(status='429').inc()
+                return 429
+            self._entries.extend(entries)
+            self._cond.notify(len(entries))
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._entries and self.accepting:
+                    self._cond.wait()
+                if not self._entries:
+                    return
+                entry = self._entries.popleft()
+            try:
+                self.handler(entry)
+            except Exception as e:
+                logger.error(f"Error processing HTTP log: {str(e)}")
+                error_counter.labels(type='http_processing').inc()
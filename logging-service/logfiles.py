@@ -0,0 +1,8 @@
+# Kept apart from tailer so backfill can find the logs without starting the live pipeline
+LOG_DIR = '/app/logs'
+
+# JSON log files from File Log plugin
+JSON_LOG_FILES = [
+    'auth-login.log', 'auth-logout.log', 'auth-refresh.log', 'auth-register.log',
+    'manga.log', 'media.log', 'novel.log'
+]
@@ -0,0 +1,122 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from metrics import error_counter
+
+logger = logging.getLogger(__name__)
+
+USAGE_DB = os.getenv('USAGE_DB', '/app/state/usage.db')
+
+HOUR = 60 * 60 * 1000
+ANONYMOUS = 'anonymous'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS usage (
+    hour INTEGER NOT NULL,
+    consumer TEXT NOT NULL,
+    route TEXT NOT NULL,
+    calls INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    PRIMARY KEY (hour, consumer, route)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS usage_by_consumer ON usage (consumer, hour);
+'''
+
+
+class UsageMeter:
+    """Calls and response bytes per Kong consumer, route and hour.
+
+    Kong's rate-limiting plugins keep their counters per node and forget
+    them, so this is the history quotas and billing are computed from.
+    :meth:`observe` only adds to in-memory counters; :meth:`save` adds
+    them to the ``usage`` table with upserts, fully synced because the
+    tailer saves its checkpoints right after. Requests without an
+    authenticated consumer are metered as ``anonymous``.
+    """
+
+    def __init__(self, path=USAGE_DB):
+        self.path = path
+        self._pending = defaultdict(lambda: [0, 0])
+        self._pending_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # Worker processes share the database
+        self._conn.execute('PRAGMA busy_timeout=10000')
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.executescript(SCHEMA)
+
+    def observe(self, log):
+        started_at = log.get('started_at')
+        if not isinstance(started_at, int):
+            started_at = int(time.time() * 1000)
+        key = (started_at // HOUR * HOUR, (log.get('consumer') or {}).get('username') or ANONYMOUS,
+               (log.get('route') or {}).get('name') or 'unknown')
+        size = log.get('response', {}).get('size', 0) or 0
+        with self._pending_lock:
+            counters = self._pending[key]
+            counters[0] += 1
+            counters[1] += size
+
+    def save(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, defaultdict(lambda: [0, 0])
+        if not pending:
+            return
+        try:
+            with self._db_lock:
+                self._conn.execute('BEGIN IMMEDIATE')
+                try:
+                    self._conn.executemany(
+                        'INSERT INTO usage VALUES (?, ?, ?, ?, ?) ON CONFLICT (hour, consumer, route) '
+                        'DO UPDATE SET calls = calls + excluded.calls, bytes = bytes + excluded.bytes',
+                        [key + tuple(counters) for key, counters in pending.items()])
+                    self._conn.execute('COMMIT')
+                except BaseException:
+                    self._conn.execute('ROLLBACK')
+                    raise
+        except sqlite3.Error as e:
+            logger.error(f"Failed to save usage: {str(e)}")
+            error_counter.labels(type='metering').inc()
+            with self._pending_lock:
+                for key, (calls, nbytes) in pending.items():
+                    self._pending[key][0] += calls
+                    self._pending[key][1] += nbytes
+
+    def usage(self, from_ms, to_ms, consumer=None, route=None):
+        """Hourly rows with from_ms <= hour < to_ms, optionally for one consumer and/or route."""
+        self.save()
+        sql = 'SELECT hour, consumer, route, calls, bytes FROM usage WHERE hour >= ? AND hour < ?'
+        params = [from_ms // HOUR * HOUR, to_ms]
+        if consumer is not None:
+            sql += ' AND consumer = ?'
+            params.append(consumer)
+        if route is not None:
+            sql += ' AND route = ?'
+            params.append(route)
+        with self._db_lock:
+            rows = self._conn.execute(sql + ' ORDER BY hour, consumer, route', params).fetchall()
+        return [{'hour': hour, 'consumer': c, 'route': r, 'calls': calls, 'bytes': nbytes}
+                for hour, c, r, calls, nbytes in rows]
+
+    def top_consumers(self, from_ms, to_ms, n=10, by='calls', route=None):
+        """The ``n`` consumers with the most calls (or bytes) in the range."""
+        if by not in ('calls', 'bytes'):
+            raise ValueError(by)
+        self.save()
+        sql = ('SELECT consumer, SUM(calls) AS calls, SUM(bytes) AS bytes FROM usage '
+               'WHERE hour >= ? AND hour < ?')
+        params = [from_ms // HOUR * HOUR, to_ms]
+        if route is not None:
+            sql += ' AND route = ?'
+            params.append(route)
+        sql += f' GROUP BY consumer ORDER BY {by} DESC LIMIT ?'
+        params.append(n)
+        with self._db_lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [{'consumer': c, 'calls': calls, 'bytes': nbytes} for c, calls, nbytes in rows]
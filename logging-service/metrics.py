@@ -0,0 +1,46 @@
+import os
+import threading
+import time
+
+from prometheus_client import Counter, Histogram
+
+# Prometheus metrics shared by the logging service modules
+request_counter = Counter('logging_service_requests_total', 'Total requests received', ['endpoint'])
+error_counter = Counter('logging_service_errors_total', 'Total errors', ['type'])
+latency_histogram = Histogram('logging_service_request_latency', 'Request latency', ['endpoint'])
+
+# Latencies reported by Kong in the ingested logs (not this service's own handler time)
+KONG_LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+kong_latency_histogram = Histogram('logging_service_kong_latency_ms', 'Kong latencies from ingested logs in milliseconds',
+                                   ['route', 'kind'], buckets=KONG_LATENCY_BUCKETS_MS)
+
+# Set by supervisor.py when the service runs as several worker processes; the
+# supervisor then exports the metrics of all workers from their shared files
+MULTIPROCESS = 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+_tracked = []
+_tracked_lock = threading.Lock()
+
+
+def track(gauge, fn):
+    """Make ``gauge`` report ``fn()``.
+
+    ``set_function`` is evaluated at scrape time by the scraped process,
+    which in multiprocess mode is the supervisor, so there the value is
+    copied into the gauge every second instead.
+    """
+    if not MULTIPROCESS:
+        gauge.set_function(fn)
+        return
+    with _tracked_lock:
+        _tracked.append((gauge, fn))
+        if len(_tracked) == 1:
+            threading.Thread(target=_refresh_tracked, name='gauge-refresh', daemon=True).start()
+
+
+def _refresh_tracked():
+    while True:
+        with _tracked_lock:
+            tracked = list(_tracked)
+        for gauge, fn in tracked:
+            gauge.set(fn())
+        time.sleep(1)
@@ -0,0 +1,44 @@
+import json
+import os
+import tempfile
+
+# Where derived state lives; each worker process gets its own (see supervisor.py)
+STATE_DIR = os.getenv('STATE_DIR', '/app/state')
+
+
+def atomic_write_json(path, data):
+    """Write ``data`` as JSON so that readers see either the old or the new file.
+
+    The content goes to a temporary file in the same directory, is fsync'd and
+    then renamed over ``path``; the directory is fsync'd too so the rename
+    itself survives a crash.
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def load_json(path, default=None):
+    """Read a JSON file written by :func:`atomic_write_json`, or return ``default``."""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
@@ -0,0 +1,138 @@
+import atexit
+import logging
+import os
+
+from prometheus_client import REGISTRY
+
+from aggregates import AGGREGATES_FILE, MetricsAggregator
+from anomaly import AnomalyDetector
+from dedup import DEDUP_DB, RecentRequests
+from filters import IngestFilter
+from metering import UsageMeter
+from metrics import error_counter, request_counter
+from persistence import STATE_DIR, atomic_write_json, load_json
+from rollups import RollupStore
+from routes import normalize_uri
+from search import LOCAL_SEARCH_ENABLED, SearchIndex
+from shipper import BulkShipper
+from spool import Spool
+from timeindex import TimeIndexStore
+from topk import HeavyHitters, merge_top
+import workers
+
+logger = logging.getLogger(__name__)
+
+# Kong request IDs ingested lately, so a request logged by both plugins counts once;
+# shared by the workers, which usually receive the two copies separately
+recent_requests = RecentRequests(path=DEDUP_DB if workers.multiprocess() else None)
+# Sampling and projection rules deciding what is shipped and archived
+ingest_filter = IngestFilter.from_file()
+# Batches documents into Elasticsearch _bulk requests, spooling to disk when it is down
+shipper = BulkShipper(spool=Spool())
+# Running totals served by GET /metrics
+aggregates = MetricsAggregator()
+# Per-minute route/status/consumer rollups behind GET /rollups
+rollups = RollupStore()
+# Calls and bytes per consumer, route and hour for quotas and billing
+meter = UsageMeter()
+# Top client IPs, consumers and URIs over a sliding window, also exported to Prometheus
+heavy_hitters = HeavyHitters()
+if not workers.multiprocess():
+    REGISTRY.register(heavy_hitters)
+# Per-route latency and error ratio baselines flagging regressions within seconds
+anomalies = AnomalyDetector()
+# started_at -> byte offset indexes of the log files, for time range queries
+time_index = TimeIndexStore()
+# Optional SQLite search over recent logs for deployments without Elasticsearch
+search_index = SearchIndex() if LOCAL_SEARCH_ENABLED else None
+
+# Where each worker process saves its heavy hitters for the others and the supervisor
+HEAVY_HITTERS_FILE = 'heavy_hitters.json'
+
+
+def ingest(log, source, raw=None):
+    """Single entry point for a parsed Kong log, whichever plugin delivered it.
+
+    ``source`` is ``'http-log'`` for entries POSTed to /logs and the file
+    name for entries read by the File Log tailer, which also passes the
+    ``raw`` line. Every log is counted, but only what passes the ingest
+    filter is shipped; that document, or None, is returned for the caller
+    to archive. A request that was already ingested through the other
+    plugin is skipped altogether.
+    """
+    if not recent_requests.first(log):
+        return None
+    doc = ingest_filter.apply(log)
+    if doc is not None:
+        # An unchanged log is shipped from its raw bytes without serializing it again
+        shipper.submit(doc, raw=raw if doc is log else None)
+        if search_index is not None:
+            search_index.submit(doc)
+    aggregates.observe(log)
+    rollups.observe(log)
+    meter.observe(log)
+    heavy_hitters.observe(log)
+    anomalies.observe(log)
+    request_counter.labels(endpoint=normalize_uri(log.get('request', {}).get('uri'))).inc()
+    return doc
+
+
+def save_state():
+    """Snapshot the derived state. The tailer calls this before saving its
+    checkpoints, so a snapshot never lags behind the offsets it resumes from."""
+    aggregates.save()
+    rollups.save()
+    meter.save()
+    if workers.multiprocess():
+        try:
+            atomic_write_json(os.path.join(STATE_DIR, HEAVY_HITTERS_FILE), heavy_hitters.to_dict())
+        except OSError as e:
+            logger.error(f"Failed to save heavy hitters: {str(e)}")
+            error_counter.labels(type='heavy_hitters').inc()
+
+
+def metrics_snapshot():
+    """The ``/metrics`` body: this process's aggregates, merged with the
+    latest snapshots of the other workers when there are several."""
+    if not workers.multiprocess():
+        return aggregates.snapshot()
+    merged = MetricsAggregator(path=None, export=False)
+    merged.merge(aggregates)
+    for directory in workers.peer_state_dirs():
+        merged.merge(MetricsAggregator(os.path.join(directory, os.path.basename(AGGREGATES_FILE)), export=False))
+    return merged.snapshot()
+
+
+def _peer_heavy_hitters():
+    states = (load_json(os.path.join(directory, HEAVY_HITTERS_FILE)) for directory in workers.peer_state_dirs())
+    return [state for state in states if state]
+
+
+def heavy_hitter_top(dimension, k):
+    if not workers.multiprocess():
+        return heavy_hitters.top(dimension, k)
+    return merge_top([heavy_hitters.to_dict()] + _peer_heavy_hitters(), dimension, k)
+
+
+def heavy_hitter_estimate(dimension, key):
+    """Requests of ``key`` in the window. Other workers only contribute
+    the counts of the keys their summaries track."""
+    estimate = heavy_hitters.estimate(dimension, key)
+    for state in _peer_heavy_hitters():
+        estimate += state['summaries'][dimension]['counts'].get(key, [0])[0]
+    return estimate
+
+
+def start():
+    shipper.start()
+    rollups.start()
+    anomalies.start()
+    atexit.register(shipper.stop)
+    atexit.register(rollups.stop)
+    atexit.register(anomalies.stop)
+    if search_index is not None:
+        search_index.start()
+        atexit.register(search_index.stop)
+        logger.info("Started local search indexer")
+    atexit.register(save_state)
+    logger.info("Started Elasticsearch bulk shipper")
@@ -0,0 +1,248 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import error_counter
+from routes import normalize_uri
+from sketches import LatencySketch
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_DB = os.getenv('ROLLUP_DB', '/app/state/rollups.db')
+COMPACT_INTERVAL = float(os.getenv('ROLLUP_COMPACT_INTERVAL', '300'))
+
+MINUTE = 60 * 1000
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+RESOLUTIONS = {'1m': MINUTE, '1h': HOUR, '1d': DAY}
+
+# (bucket width, how long buckets of that width are kept) from finest to
+# coarsest; older buckets are folded into the next tier, the last tier's
+# are deleted
+TIERS = [
+    (MINUTE, int(os.getenv('ROLLUP_MINUTE_RETENTION_HOURS', '48')) * HOUR),
+    (HOUR, int(os.getenv('ROLLUP_HOUR_RETENTION_DAYS', '31')) * DAY),
+    (DAY, int(os.getenv('ROLLUP_DAY_RETENTION_DAYS', '730')) * DAY),
+]
+
+DIMENSIONS = ('route', 'status_class', 'consumer')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS rollups (
+    resolution INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    route TEXT NOT NULL,
+    status_class TEXT NOT NULL,
+    consumer TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    sketch TEXT NOT NULL,
+    PRIMARY KEY (resolution, ts, route, status_class, consumer)
+) WITHOUT ROWID
+'''
+
+
+class _Bucket:
+    __slots__ = ('count', 'errors', 'bytes', 'sketch')
+
+    def __init__(self, count=0, errors=0, nbytes=0, sketch=None):
+        self.count = count
+        self.errors = errors
+        self.bytes = nbytes
+        self.sketch = sketch or LatencySketch()
+
+    def merge(self, other):
+        self.count += other.count
+        self.errors += other.errors
+        self.bytes += other.bytes
+        self.sketch.merge(other.sketch)
+
+    def row(self):
+        return self.count, self.errors, self.bytes, json.dumps(self.sketch.to_dict(), separators=(',', ':'))
+
+    @classmethod
+    def from_row(cls, count, errors, nbytes, sketch):
+        return cls(count, errors, nbytes, LatencySketch.from_dict(json.loads(sketch)))
+
+
+def status_class(status):
+    return f'{status // 100}xx' if status else 'unknown'
+
+
+class RollupStore:
+    """Per-minute rollups of the ingested logs in an SQLite database.
+
+    Each bucket is keyed by minute, route template, status class and Kong
+    consumer and holds the request count, error count, response bytes and
+    a :class:`sketches.LatencySketch` of the request latency. Buckets are
+    accumulated in memory by :meth:`observe` and merged into the database
+    by :meth:`save`. A background thread folds minute buckets older than
+    their retention into hour buckets and those into day buckets, so
+    dashboards over long ranges read a few rows per hour or day instead
+    of raw log lines.
+    """
+
+    def __init__(self, path=ROLLUP_DB, compact_interval=COMPACT_INTERVAL):
+        self.path = path
+        self.compact_interval = compact_interval
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # Worker processes share the database
+        self._conn.execute('PRAGMA busy_timeout=10000')
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(SCHEMA)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='rollup-compactor', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.save()
+
+    def observe(self, log):
+        started_at = log.get('started_at')
+        if not isinstance(started_at, int):
+            started_at = int(time.time() * 1000)
+        status = log.get('response', {}).get('status', 0) or 0
+        key = (started_at // MINUTE * MINUTE, normalize_uri(log.get('request', {}).get('uri')),
+               status_class(status), (log.get('consumer') or {}).get('username') or 'anonymous')
+        latency = log.get('latencies', {}).get('request')
+        with self._pending_lock:
+            bucket = self._pending.get(key)
+            if bucket is None:
+                bucket = self._pending[key] = _Bucket()
+            bucket.count += 1
+            if status >= 400:
+                bucket.errors += 1
+            bucket.bytes += log.get('response', {}).get('size', 0) or 0
+            if latency is not None and latency >= 0:
+                bucket.sketch.add(latency)
+
+    def save(self):
+        """Merge the buckets accumulated since the last call into the database."""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            with self._db_lock:
+                self._conn.execute('BEGIN IMMEDIATE')
+                try:
+                    self._merge(MINUTE, pending)
+                    self._conn.execute('COMMIT')
+                except BaseException:
+                    self._conn.execute('ROLLBACK')
+                    raise
+        except sqlite3.Error as e:
+            logger.error(f"Failed to save rollups: {str(e)}")
+            error_counter.labels(type='rollups').inc()
+            # Keep the buckets for the next attempt
+            with self._pending_lock:
+                for key, bucket in pending.items():
+                    current = self._pending.setdefault(key, _Bucket())
+                    current.merge(bucket)
+
+    def _merge(self, resolution, buckets):
+        """Add ``buckets`` ((ts, route, status_class, consumer) -> _Bucket) to the rows of a tier."""
+        rows = []
+        for key, bucket in buckets.items():
+            existing = self._conn.execute(
+                'SELECT count, errors, bytes, sketch FROM rollups WHERE resolution = ? AND ts = ? '
+                'AND route = ? AND status_class = ? AND consumer = ?', (resolution,) + key).fetchone()
+            if existing:
+                bucket = _Bucket.from_row(*existing)
+                bucket.merge(buckets[key])
+            rows.append((resolution,) + key + bucket.row())
+        self._conn.executemany('INSERT OR REPLACE INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def compact(self, now_ms=None):
+        """Fold buckets that outlived their tier's retention into the next tier."""
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        with self._db_lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                for (resolution, retention), coarser in zip(TIERS, TIERS[1:] + [None]):
+                    cutoff = now_ms - retention
+                    if coarser is not None:
+                        folded = {}
+                        for ts, route, status, consumer, *values in self._conn.execute(
+                                'SELECT ts, route, status_class, consumer, count, errors, bytes, sketch '
+                                'FROM rollups WHERE resolution = ? AND ts < ?', (resolution, cutoff)):
+                            key = (ts // coarser[0] * coarser[0], route, status, consumer)
+                            bucket = _Bucket.from_row(*values)
+                            if key in folded:
+                                folded[key].merge(bucket)
+                            else:
+                                folded[key] = bucket
+                        if folded:
+                            self._merge(coarser[0], folded)
+                            logger.info(f"Compacted rollups older than {cutoff} into {len(folded)} "
+                                        f"buckets of {coarser[0] // MINUTE} minutes")
+                    self._conn.execute('DELETE FROM rollups WHERE resolution = ? AND ts < ?', (resolution, cutoff))
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def _run(self):
+        while not self._stop.wait(self.compact_interval):
+            try:
+                self.compact()
+            except sqlite3.Error as e:
+                logger.error(f"Failed to compact rollups: {str(e)}")
+                error_counter.labels(type='rollups').inc()
+
+    def query(self, from_ms, to_ms, resolution=None, group_by=DIMENSIONS, route=None, consumer=None):
+        """Buckets with from_ms <= ts < to_ms at ``resolution`` milliseconds.
+
+        Without a resolution, the finest tier that still covers ``from_ms``
+        is used. Rows of finer tiers that have not been compacted yet are
+        re-bucketed, so the answer is complete whatever the tier. Dimensions
+        not in ``group_by`` are summed over.
+        """
+        if resolution is None:
+            now_ms = int(time.time() * 1000)
+            resolution = next((width for width, retention in TIERS if from_ms >= now_ms - retention), DAY)
+        self.save()
+        sql = ('SELECT ts, route, status_class, consumer, count, errors, bytes, sketch FROM rollups '
+               'WHERE resolution <= ? AND ts >= ? AND ts < ?')
+        params = [resolution, from_ms // resolution * resolution, to_ms]
+        if route is not None:
+            sql += ' AND route = ?'
+            params.append(route)
+        if consumer is not None:
+            sql += ' AND consumer = ?'
+            params.append(consumer)
+        buckets = {}
+        with self._db_lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        for ts, *dims_and_values in rows:
+            dims = dict(zip(DIMENSIONS, dims_and_values[:3]))
+            key = (ts // resolution * resolution,) + tuple(dims[d] for d in group_by)
+            bucket = _Bucket.from_row(*dims_and_values[3:])
+            if key in buckets:
+                buckets[key].merge(bucket)
+            else:
+                buckets[key] = bucket
+        series = []
+        for key in sorted(buckets):
+            bucket = buckets[key]
+            entry = {'ts': key[0]}
+            entry.update(zip(group_by, key[1:]))
+            entry.update({'count': bucket.count, 'errors': bucket.errors, 'bytes': bucket.bytes,
+                          'latency_ms': bucket.sketch.summary()})
+            series.append(entry)
+        return {'resolution': resolution, 'series': series}
@@ -0,0 +1,97 @@
+import os
+import re
+import threading
+
+# Route templates of the comic-web Django URLconf (server/urls.py and the app
+# urls.py files), most specific first. ``{name}`` matches one path segment and
+# a trailing ``*`` matches the rest of the path.
+ROUTE_TEMPLATES = [
+    '/api/manga/advanced-search/',
+    '/api/manga/chapter/{pk}/',
+    '/api/manga/{pk}/chapters',
+    '/api/manga/{pk}/',
+    '/api/manga/',
+    '/api/novel/advanced-search/',
+    '/api/novel/chapter/{pk}/',
+    '/api/novel/{pk}/chapters',
+    '/api/novel/{pk}/updateNumFavorite/',
+    '/api/novel/{pk}/updateNumComments/',
+    '/api/novel/{pk}/',
+    '/api/novel/',
+    '/api/genres/{pk}/',
+    '/api/genres/',
+    '/api/audio/tts/{filename}/',
+    '/api/posts/{pk}/',
+    '/api/posts/',
+    '/api/comments/',
+    '/api/login/',
+    '/api/logout/',
+    '/api/refresh/',
+    '/api/register/',
+    '/user/comment/*',
+    '/user/favorite/*',
+    '/user/like/*',
+    '/profile/update*',
+    '/profile/*',
+    '/admin/*',
+    '/media/*',
+    '/static/*',
+    '/health',
+    '/',
+]
+
+# Distinct fallback templates allowed before new ones are folded into OTHER
+MAX_ROUTE_SERIES = int(os.getenv('MAX_ROUTE_SERIES', '200'))
+OTHER = 'other'
+
+# Path segments that look like identifiers: UUIDs, hex digests and numbers
+ID_SEGMENT = re.compile(r'^(?:[0-9a-fA-F-]{32,36}|[0-9a-fA-F]{16,}|\d+)$')
+
+
+def _compile(template):
+    pattern = re.escape(template.rstrip('*').rstrip('/'))
+    pattern = re.sub(r'\\\{\w+\\\}', '[^/]+', pattern)
+    if template.endswith('*'):
+        return re.compile('^' + pattern + '(?:/.*)?$')
+    return re.compile('^' + pattern + '/?$')
+
+
+class RouteNormalizer:
+    """Maps raw request URIs to a bounded set of route templates.
+
+    The query string is dropped and the path is matched against
+    ``templates``. Paths that match none of them get their identifier-like
+    segments replaced by ``{id}``; at most ``max_series`` such fallback
+    templates are handed out and everything after that becomes ``other``,
+    so label cardinality stays constant whatever the traffic looks like.
+    """
+
+    def __init__(self, templates=ROUTE_TEMPLATES, max_series=MAX_ROUTE_SERIES):
+        self._patterns = [(_compile(t), t) for t in templates]
+        self.max_series = max_series
+        self._fallbacks = set()
+        self._lock = threading.Lock()
+
+    def normalize(self, uri):
+        if not uri or uri == OTHER:
+            return OTHER
+        path = uri.split('?', 1)[0]
+        for pattern, template in self._patterns:
+            if pattern.match(path):
+                return template
+        segments = ['{id}' if ID_SEGMENT.match(s) else s for s in path.split('/')]
+        template = '/'.join(segments)
+        with self._lock:
+            if template in self._fallbacks:
+                return template
+            if len(self._fallbacks) >= self.max_series:
+                return OTHER
+            self._fallbacks.add(template)
+            return template
+
+
+normalizer = RouteNormalizer()
+
+
+def normalize_uri(uri):
+    return normalizer.normalize(uri)
@@ -0,0 +1,197 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from prometheus_client import Counter
+
+from metrics import error_counter
+from routes import normalize_uri
+import fastjson
+
+logger = logging.getLogger(__name__)
+
+# Off by default; meant for deployments without Elasticsearch
+LOCAL_SEARCH_ENABLED = os.getenv('LOCAL_SEARCH_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+SEARCH_DB = os.getenv('SEARCH_DB', '/app/state/search.db')
+SEARCH_BATCH_DOCS = int(os.getenv('SEARCH_BATCH_DOCS', '1000'))
+SEARCH_BATCH_AGE = float(os.getenv('SEARCH_BATCH_AGE', '1.0'))
+SEARCH_QUEUE_SIZE = int(os.getenv('SEARCH_QUEUE_SIZE', '20000'))
+SEARCH_RETENTION_DAYS = int(os.getenv('SEARCH_RETENTION_DAYS', '7'))
+SEARCH_PAGE_SIZE = 100
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY,
+    started_at INTEGER NOT NULL,
+    route TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    consumer TEXT,
+    method TEXT,
+    uri TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS logs_started_at ON logs (started_at);
+CREATE INDEX IF NOT EXISTS logs_route ON logs (route, started_at);
+CREATE INDEX IF NOT EXISTS logs_status ON logs (status, started_at);
+CREATE INDEX IF NOT EXISTS logs_consumer ON logs (consumer, started_at);
+CREATE VIRTUAL TABLE IF NOT EXISTS logs_fts USING fts5(uri, doc, content='logs', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS logs_fts_insert AFTER INSERT ON logs BEGIN
+    INSERT INTO logs_fts (rowid, uri, doc) VALUES (new.id, new.uri, new.doc);
+END;
+CREATE TRIGGER IF NOT EXISTS logs_fts_delete AFTER DELETE ON logs BEGIN
+    INSERT INTO logs_fts (logs_fts, rowid, uri, doc) VALUES ('delete', old.id, old.uri, old.doc);
+END;
+'''
+
+indexed_counter = Counter('logging_service_search_indexed_docs_total', 'Logs written to the local search index')
+search_dropped_counter = Counter('logging_service_search_dropped_docs_total',
+                                 'Logs not indexed because the search index queue was full')
+
+
+class SearchIndex:
+    """Local, SQLite-backed search over recent logs for when there is no
+    Elasticsearch.
+
+    Each log becomes a row with indexed ``started_at``, route template,
+    status and consumer columns, and its URI and JSON text go into an FTS5
+    table. :meth:`submit` only queues the document; a background thread
+    inserts up to ``batch_docs`` of them per transaction and deletes rows
+    older than ``retention_days``. :meth:`search` pages through results
+    newest first with a keyset cursor, so deep pages stay cheap.
+    """
+
+    def __init__(self, path=SEARCH_DB, batch_docs=SEARCH_BATCH_DOCS, batch_age=SEARCH_BATCH_AGE,
+                 queue_size=SEARCH_QUEUE_SIZE, retention_days=SEARCH_RETENTION_DAYS):
+        self.path = path
+        self.batch_docs = batch_docs
+        self.batch_age = batch_age
+        self.retention_ms = retention_days * 24 * 3600 * 1000
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # Worker processes share the database
+        self._conn.execute('PRAGMA busy_timeout=10000')
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='search-indexer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def submit(self, log):
+        try:
+            self._queue.put_nowait(log)
+        except queue.Full:
+            search_dropped_counter.inc()
+
+    @staticmethod
+    def _row(log):
+        request = log.get('request', {})
+        started_at = log.get('started_at')
+        if not isinstance(started_at, int):
+            started_at = int(time.time() * 1000)
+        return (started_at, normalize_uri(request.get('uri')), log.get('response', {}).get('status', 0) or 0,
+                (log.get('consumer') or {}).get('username'), request.get('method'), request.get('uri'),
+                fastjson.dumps(log).decode('utf-8'))
+
+    def _run(self):
+        last_cleanup = 0
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                batch = [self._queue.get(timeout=self.batch_age)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.batch_age
+            while len(batch) < self.batch_docs:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self._insert(batch)
+                if time.monotonic() - last_cleanup >= 3600:
+                    self._delete_expired()
+                    last_cleanup = time.monotonic()
+            except sqlite3.Error as e:
+                logger.error(f"Failed to index {len(batch)} logs for search: {str(e)}")
+                error_counter.labels(type='search_index').inc()
+
+    def _insert(self, batch):
+        rows = [self._row(log) for log in batch]
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.executemany('INSERT INTO logs (started_at, route, status, consumer, method, uri, doc) '
+                                       'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        indexed_counter.inc(len(rows))
+
+    def _delete_expired(self):
+        cutoff = int(time.time() * 1000) - self.retention_ms
+        with self._lock:
+            deleted = self._conn.execute('DELETE FROM logs WHERE started_at < ?', (cutoff,)).rowcount
+        if deleted:
+            logger.info(f"Deleted {deleted} logs older than {self.retention_ms // 86400000} days from the search index")
+
+    def search(self, q=None, status=None, route=None, consumer=None, from_ms=None, to_ms=None,
+               limit=SEARCH_PAGE_SIZE, cursor=None):
+        """Matching logs, newest first, and the cursor of the next page (None on the last one).
+
+        ``q`` is an FTS5 query over the URI and the log text, ``status`` an
+        exact status or a class like ``5xx`` and ``route`` a route template.
+        Raises ``sqlite3.OperationalError`` for an invalid ``q``.
+        """
+        if q:
+            sql = 'SELECT logs.id, logs.started_at, logs.doc FROM logs_fts JOIN logs ON logs.id = logs_fts.rowid ' \
+                  'WHERE logs_fts MATCH ?'
+            params = [q]
+        else:
+            sql = 'SELECT logs.id, logs.started_at, logs.doc FROM logs WHERE 1'
+            params = []
+        if status is not None:
+            status = str(status)
+            if status.endswith('xx'):
+                low = int(status[0]) * 100
+                sql += ' AND logs.status >= ? AND logs.status < ?'
+                params += [low, low + 100]
+            else:
+                sql += ' AND logs.status = ?'
+                params.append(int(status))
+        for column, value in (('route', route), ('consumer', consumer)):
+            if value is not None:
+                sql += f' AND logs.{column} = ?'
+                params.append(value)
+        if from_ms is not None:
+            sql += ' AND logs.started_at >= ?'
+            params.append(from_ms)
+        if to_ms is not None:
+            sql += ' AND logs.started_at < ?'
+            params.append(to_ms)
+        if cursor:
+            cursor_started_at, cursor_id = (int(part) for part in cursor.split(':'))
+            sql += ' AND (logs.started_at < ? OR (logs.started_at = ? AND logs.id < ?))'
+            params += [cursor_started_at, cursor_started_at, cursor_id]
+        sql += ' ORDER BY logs.started_at DESC, logs.id DESC LIMIT ?'
+        params.append(limit + 1)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = f'{rows[-1][1]}:{rows[-1][0]}'
+        return [fastjson.loads(doc) for _, _, doc in rows], next_cursor
@@ -0,0 +1,331 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+import requests
+from prometheus_client import Counter, Gauge, Histogram
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from dedup import request_id
+from metrics import error_counter, track
+import fastjson
+
+logger = logging.getLogger(__name__)
+
+# Elasticsearch bulk endpoint and batching limits
+ES_BULK_URL = os.getenv('ES_BULK_URL', 'http://elasticsearch:9200/kong-logs/_bulk')
+ES_HEALTH_URL = os.getenv('ES_HEALTH_URL', 'http://elasticsearch:9200/_cluster/health')
+BULK_MAX_DOCS = int(os.getenv('ES_BULK_MAX_DOCS', '500'))
+BULK_MAX_BYTES = int(os.getenv('ES_BULK_MAX_BYTES', str(5 * 1024 * 1024)))
+BULK_MAX_AGE = float(os.getenv('ES_BULK_MAX_AGE', '1.0'))
+SHIPPER_QUEUE_SIZE = int(os.getenv('ES_SHIPPER_QUEUE_SIZE', '20000'))
+SUBMIT_TIMEOUT = float(os.getenv('ES_SHIPPER_SUBMIT_TIMEOUT', '1'))
+# Spool replay pacing once Elasticsearch is back, and how often to probe it while it is down
+SPOOL_REPLAY_RATE = float(os.getenv('SPOOL_REPLAY_RATE', '2000'))
+HEALTH_CHECK_INTERVAL = float(os.getenv('ES_HEALTH_CHECK_INTERVAL', '5'))
+# Longest wait between replay attempts while bulk requests keep failing
+MAX_REPLAY_BACKOFF = float(os.getenv('SPOOL_MAX_REPLAY_BACKOFF', '300'))
+
+# Per-item statuses worth sending again; anything else is a permanent rejection
+RETRYABLE_STATUSES = {429, 502, 503, 504}
+MAX_ITEM_RETRIES = 3
+# Whole-request statuses that are about the request, not the cluster: the
+# batch is split until the offending documents are isolated
+REJECTED_REQUEST_STATUSES = {400, 413}
+# Whole-request pushback: every item is retried later
+THROTTLED_STATUS = 429
+
+# Documents are created with the Kong request ID as _id, so a request that is
+# shipped twice (both log plugins, retries, spool replays, backfills) is indexed
+# once; Elasticsearch answers the second create with 409
+CREATE_ACTION = b'{"create":{}}\n'
+DUPLICATE_STATUS = 409
+
+queue_depth_gauge = Gauge('logging_service_shipper_queue_depth', 'Documents waiting in the Elasticsearch shipper queue',
+                          multiprocess_mode='livesum')
+batch_docs_histogram = Histogram('logging_service_shipper_batch_docs', 'Documents per Elasticsearch bulk request',
+                                 buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000))
+batch_bytes_histogram = Histogram('logging_service_shipper_batch_bytes', 'Bytes per Elasticsearch bulk request',
+                                  buckets=(1024, 16384, 65536, 262144, 1048576, 4194304, 16777216))
+bulk_latency_histogram = Histogram('logging_service_shipper_bulk_seconds', 'Elasticsearch bulk request duration')
+shipped_counter = Counter('logging_service_shipper_docs_total', 'Documents acknowledged by Elasticsearch')
+dropped_counter = Counter('logging_service_shipper_dropped_docs_total', 'Documents the shipper gave up on', ['reason'])
+duplicate_docs_counter = Counter('logging_service_shipper_duplicate_docs_total',
+                                 'Documents Elasticsearch already had under the same _id')
+replayed_counter = Counter('logging_service_spool_replayed_docs_total', 'Spooled documents shipped to Elasticsearch')
+healthy_gauge = Gauge('logging_service_elasticsearch_up', 'Whether the shipper currently considers Elasticsearch reachable',
+                      multiprocess_mode='livemin')
+
+
+class BulkRequestRejected(Exception):
+    """Elasticsearch refused a bulk request because of its content or size."""
+
+
+def bulk_action(doc_id):
+    """The ``_bulk`` action line creating a document with ``doc_id`` (auto ID if None)."""
+    if doc_id is None:
+        return CREATE_ACTION
+    return b'{"create":{"_id":' + fastjson.dumps(doc_id) + b'}}\n'
+
+
+def spooled_item(doc):
+    """The (action, document) item of a serialized document read back from disk."""
+    try:
+        return bulk_action(request_id(fastjson.loads(doc))), doc
+    except ValueError:
+        return CREATE_ACTION, doc
+
+
+class BulkShipper:
+    """Coalesces log documents into Elasticsearch ``_bulk`` requests.
+
+    Producers call :meth:`submit`, which only serializes the document and
+    its action line and puts them on a bounded queue. A single background thread drains the queue
+    and flushes a batch when it reaches ``max_docs`` documents, ``max_bytes``
+    bytes or ``max_age`` seconds, whichever comes first, over one pooled
+    session.
+
+    With a :class:`spool.Spool` attached, nothing is dropped for
+    availability reasons: documents that do not fit in the queue, batches
+    Elasticsearch cannot take and everything flushed while it is marked
+    down go to the spool, and a replay thread ships the spool back at
+    ``replay_rate`` documents per second. The health probe only decides
+    when to try again; Elasticsearch counts as up once a replayed batch is
+    accepted, and failed replays back off exponentially.
+
+    A bulk request refused as a whole (400, 413) does not mean the cluster
+    is down: the batch is halved until the documents it cannot take are
+    isolated, and those are dropped.
+    """
+
+    def __init__(self, url=ES_BULK_URL, max_docs=BULK_MAX_DOCS, max_bytes=BULK_MAX_BYTES,
+                 max_age=BULK_MAX_AGE, queue_size=SHIPPER_QUEUE_SIZE, spool=None,
+                 replay_rate=SPOOL_REPLAY_RATE, pool_size=2):
+        self.url = url
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.spool = spool
+        self.replay_rate = replay_rate
+        self.healthy = True
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._session = self._build_session(pool_size)
+        self._stop = threading.Event()
+        self._threads = []
+        track(queue_depth_gauge, self._queue.qsize)
+        track(healthy_gauge, lambda: int(self.healthy))
+
+    @staticmethod
+    def _build_session(pool_size):
+        session = requests.Session()
+        retries = Retry(total=5, backoff_factor=1, status_forcelist=[502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def start(self):
+        targets = [(self._run, 'es-shipper')]
+        if self.spool is not None:
+            targets.append((self._replay, 'es-spool-replay'))
+        for target, name in targets:
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=10):
+        """Flush whatever is queued and stop the workers."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def submit(self, log, timeout=SUBMIT_TIMEOUT, raw=None):
+        """Queue one document for shipping. Returns False if it had to be dropped.
+
+        ``raw`` is the document's JSON exactly as it was read, if there is
+        one; it is shipped as is instead of serializing ``log`` again.
+        """
+        doc = bytes(raw) if raw is not None else fastjson.dumps(log)
+        item = (bulk_action(request_id(log)), doc)
+        try:
+            self._queue.put(item, timeout=timeout)
+            return True
+        except queue.Full:
+            if self.spool is None:
+                logger.error("Elasticsearch shipper queue is full, dropping log")
+                error_counter.labels(type='shipper_queue_full').inc()
+            return self._spill([item], reason='queue_full')
+
+    def _spill(self, items, reason):
+        """Hand documents the shipper cannot send now to the spool."""
+        if self.spool is not None and self.spool.append([doc for _, doc in items]):
+            return True
+        dropped_counter.labels(reason=reason).inc(len(items))
+        return False
+
+    def _mark_unhealthy(self, e):
+        if self.healthy:
+            logger.error(f"Elasticsearch unavailable, spooling logs until it recovers: {str(e)}")
+        error_counter.labels(type='elasticsearch').inc()
+        self.healthy = False
+
+    def _probe(self):
+        try:
+            response = requests.get(ES_HEALTH_URL, timeout=5)
+            return response.status_code == 200 and response.json().get('status') != 'red'
+        except (requests.RequestException, ValueError):
+            return False
+
+    def _run(self):
+        batch, batch_bytes, batch_started = [], 0, None
+        while not (self._stop.is_set() and self._queue.empty()):
+            if batch_started is None:
+                wait = self.max_age
+            else:
+                wait = max(0.0, batch_started + self.max_age - time.monotonic())
+            try:
+                item = self._queue.get(timeout=wait)
+                if not batch:
+                    batch_started = time.monotonic()
+                batch.append(item)
+                batch_bytes += len(item[1])
+            except queue.Empty:
+                pass
+            if batch and (len(batch) >= self.max_docs or batch_bytes >= self.max_bytes
+                          or time.monotonic() - batch_started >= self.max_age):
+                self._flush(batch)
+                batch, batch_bytes, batch_started = [], 0, None
+        if batch:
+            self._flush(batch)
+
+    def ship(self, items):
+        """Ship (action, document) items from the calling thread; see :func:`bulk_action`.
+
+        Returns False if any of them had to be dropped, i.e. Elasticsearch
+        could not take them and there is no spool to fall back on.
+        """
+        return self._flush(items)
+
+    def _flush(self, batch):
+        if not self.healthy:
+            return self._spill(batch, reason='request_failed')
+        pending = batch
+        for attempt in range(MAX_ITEM_RETRIES + 1):
+            if attempt:
+                time.sleep(min(0.5 * 2 ** attempt, 10))
+            try:
+                pending = self._send_splitting(pending)
+            except (requests.RequestException, ValueError) as e:
+                self._mark_unhealthy(e)
+                return self._spill(pending, reason='request_failed')
+            if not pending:
+                return True
+        logger.error(f"Elasticsearch still refused {len(pending)} logs after {MAX_ITEM_RETRIES} bulk retries")
+        error_counter.labels(type='elasticsearch').inc()
+        return self._spill(pending, reason='retries_exhausted')
+
+    def _replay(self):
+        """Ship spooled documents back, oldest first, while Elasticsearch is up."""
+        failures = 0
+        while not self._stop.is_set():
+            if not self.healthy and not self._probe():
+                self._stop.wait(HEALTH_CHECK_INTERVAL)
+                continue
+            try:
+                docs, position = self.spool.read(self.max_docs)
+            except IOError as e:
+                logger.error(f"Failed to read the spool: {str(e)}")
+                error_counter.labels(type='spool_read').inc()
+                self._stop.wait(HEALTH_CHECK_INTERVAL)
+                continue
+            if not docs:
+                # Nothing to prove the cluster with; the probe passing has to do
+                self._set_healthy()
+                self._stop.wait(1)
+                continue
+            started = time.monotonic()
+            try:
+                retry = self._send_splitting([spooled_item(doc) for doc in docs])
+            except (requests.RequestException, ValueError) as e:
+                # A green health check does not help if _bulk itself fails: wait longer each time
+                self._mark_unhealthy(e)
+                self._stop.wait(min(HEALTH_CHECK_INTERVAL * 2 ** failures, MAX_REPLAY_BACKOFF))
+                failures += 1
+                continue
+            failures = 0
+            self._set_healthy()
+            if retry:
+                # Elasticsearch is pushing back; keep the batch and try again later
+                self._stop.wait(HEALTH_CHECK_INTERVAL)
+                continue
+            self.spool.commit(position)
+            replayed_counter.inc(len(docs))
+            self._stop.wait(max(0.0, len(docs) / self.replay_rate - (time.monotonic() - started)))
+
+    def _set_healthy(self):
+        if not self.healthy:
+            logger.info("Elasticsearch is accepting logs again, replaying the spool")
+            self.healthy = True
+
+    def _send_splitting(self, items):
+        """:meth:`_send_bulk`, halving the batch while Elasticsearch refuses
+        the request as a whole; a single document refused that way is dropped."""
+        try:
+            return self._send_bulk(items)
+        except BulkRequestRejected as e:
+            if len(items) == 1:
+                logger.warning(f"Elasticsearch rejected log: {str(e)}")
+                error_counter.labels(type='elasticsearch_rejected').inc()
+                dropped_counter.labels(reason='rejected').inc()
+                return []
+            middle = len(items) // 2
+            return self._send_splitting(items[:middle]) + self._send_splitting(items[middle:])
+
+    def _send_bulk(self, items):
+        """Send one bulk request and return the items that should be retried.
+
+        Raises :class:`BulkRequestRejected` when Elasticsearch refused the
+        request because of what it contains, ``requests.RequestException``
+        (or ``ValueError`` for an unreadable response) when it failed.
+        """
+        body = b''.join(action + doc + b'\n' for action, doc in items)
+        batch_docs_histogram.observe(len(items))
+        batch_bytes_histogram.observe(len(body))
+        start_time = time.time()
+        try:
+            response = self._session.post(self.url, data=body, timeout=30,
+                                          headers={'Content-Type': 'application/x-ndjson'})
+            if response.status_code in REJECTED_REQUEST_STATUSES:
+                raise BulkRequestRejected(f"{response.status_code} for {len(items)} logs: {response.text[:200]}")
+            if response.status_code == THROTTLED_STATUS:
+                return list(items)
+            response.raise_for_status()
+            result = fastjson.loads(response.content)
+        finally:
+            bulk_latency_histogram.observe(time.time() - start_time)
+
+        if not result.get('errors'):
+            shipped_counter.inc(len(items))
+            logger.info(f"Sent {len(items)} logs to Elasticsearch")
+            return []
+
+        retry = []
+        for item, response_item in zip(items, result.get('items', [])):
+            outcome = next(iter(response_item.values()), {})
+            status = outcome.get('status', 500)
+            if status < 300:
+                shipped_counter.inc()
+            elif status == DUPLICATE_STATUS:
+                # Already indexed by an earlier attempt or the other log plugin
+                duplicate_docs_counter.inc()
+            elif status in RETRYABLE_STATUSES:
+                retry.append(item)
+            else:
+                reason = outcome.get('error', {}).get('type', 'unknown')
+                logger.warning(f"Elasticsearch rejected log ({status}): {reason}")
+                error_counter.labels(type='elasticsearch_rejected').inc()
+                dropped_counter.labels(reason='rejected').inc()
+        return retry
@@ -0,0 +1,96 @@
+import math
+
+# Quantiles reported for every sketch
+QUANTILES = {'p50': 0.5, 'p90': 0.9, 'p99': 0.99, 'p999': 0.999}
+
+
+class LatencySketch:
+    """Streaming quantile sketch over log-spaced buckets.
+
+    A value ``v`` lands in bucket ``ceil(log(v) / log(gamma))``, so any
+    quantile is answered within ``relative_accuracy`` of the true value.
+    Memory is bounded by ``max_buckets``: once exceeded the lowest buckets
+    are collapsed, which only costs accuracy at the fast end. Two sketches
+    with the same accuracy merge by adding bucket counts, which is what
+    lets files, worker processes and time windows be combined.
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value, count=1):
+        if value < 0:
+            return
+        self.count += count
+        self.sum += value * count
+        if value == 0:
+            self.zero_count += count
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def _collapse(self):
+        indexes = sorted(self.buckets)
+        excess = len(indexes) - self.max_buckets
+        folded = sum(self.buckets.pop(i) for i in indexes[:excess])
+        target = indexes[excess]
+        self.buckets[target] += folded
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+        return self
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # Midpoint of the bucket (gamma^(i-1), gamma^i] in relative terms
+                return 2 * self._gamma ** index / (self._gamma + 1)
+        return 2 * self._gamma ** max(self.buckets) / (self._gamma + 1)
+
+    def summary(self):
+        summary = {name: self.quantile(q) for name, q in QUANTILES.items()}
+        summary['count'] = self.count
+        summary['avg'] = self.sum / self.count if self.count else None
+        return summary
+
+    def to_dict(self):
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'buckets': {str(i): c for i, c in self.buckets.items()},
+            'zero_count': self.zero_count,
+            'count': self.count,
+            'sum': self.sum
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(relative_accuracy=data['relative_accuracy'])
+        sketch.buckets = {int(i): c for i, c in data['buckets'].items()}
+        sketch.zero_count = data['zero_count']
+        sketch.count = data['count']
+        sketch.sum = data['sum']
+        return sketch
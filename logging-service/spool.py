@@ -0,0 +1,144 @@
+import logging
+import os
+import threading
+
+from prometheus_client import Counter, Gauge
+
+from metrics import error_counter, track
+from persistence import STATE_DIR, atomic_write_json, load_json
+
+logger = logging.getLogger(__name__)
+
+SPOOL_DIR = os.getenv('SPOOL_DIR', os.path.join(STATE_DIR, 'spool'))
+SPOOL_SEGMENT_BYTES = int(os.getenv('SPOOL_SEGMENT_BYTES', str(64 * 1024 * 1024)))
+SPOOL_MAX_BYTES = int(os.getenv('SPOOL_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.ndjson'
+
+spool_bytes_gauge = Gauge('logging_service_spool_bytes', 'Bytes of documents waiting in the disk spool',
+                          multiprocess_mode='livesum')
+spooled_counter = Counter('logging_service_spooled_docs_total', 'Documents written to the disk spool')
+spool_full_counter = Counter('logging_service_spool_full_docs_total', 'Documents dropped because the spool was full')
+
+
+class Spool:
+    """Append-only, segmented write-ahead spool for documents Elasticsearch
+    could not take.
+
+    Documents are appended as NDJSON lines to ``segment-<seq>.ndjson`` files
+    of at most ``segment_bytes`` and fsync'd before :meth:`append` returns.
+    A reader works through the segments oldest first with :meth:`read` and
+    acknowledges progress with :meth:`commit`, which persists a cursor;
+    fully read segments are deleted. Total size is capped at ``max_bytes``.
+    """
+
+    def __init__(self, directory=SPOOL_DIR, segment_bytes=SPOOL_SEGMENT_BYTES, max_bytes=SPOOL_MAX_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self._cursor_path = os.path.join(directory, 'cursor.json')
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        segments = self._segments()
+        self._size = sum(os.path.getsize(self._segment_path(seq)) for seq in segments)
+        cursor = load_json(self._cursor_path, default={'segment': 0, 'offset': 0})
+        self._cursor = (cursor['segment'], cursor['offset'])
+        self._write_seq = segments[-1] if segments else 0
+        self._writer = None
+        self._writer_size = 0
+        track(spool_bytes_gauge, lambda: self._size)
+        if self._size:
+            logger.info(f"Found {self._size} bytes in the spool from a previous run")
+
+    def _segment_path(self, seq):
+        return os.path.join(self.directory, f'{SEGMENT_PREFIX}{seq:012d}{SEGMENT_SUFFIX}')
+
+    def _segments(self):
+        return sorted(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                      if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+
+    def __len__(self):
+        return self._size
+
+    def append(self, docs):
+        """Durably spool serialized documents. Returns False if the spool is full."""
+        data = b''.join(doc + b'\n' for doc in docs)
+        with self._lock:
+            if self._size + len(data) > self.max_bytes:
+                logger.error(f"Spool is full, dropping {len(docs)} logs")
+                error_counter.labels(type='spool_full').inc()
+                spool_full_counter.inc(len(docs))
+                return False
+            try:
+                if self._writer is None or self._writer_size + len(data) > self.segment_bytes:
+                    self._roll()
+                self._writer.write(data)
+                self._writer.flush()
+                os.fsync(self._writer.fileno())
+            except IOError as e:
+                logger.error(f"Failed to write to the spool: {str(e)}")
+                error_counter.labels(type='spool_write').inc()
+                self._close_writer()
+                return False
+            self._writer_size += len(data)
+            self._size += len(data)
+        spooled_counter.inc(len(docs))
+        return True
+
+    def _roll(self):
+        self._close_writer()
+        self._write_seq += 1
+        self._writer = open(self._segment_path(self._write_seq), 'ab')
+        self._writer_size = 0
+
+    def _close_writer(self):
+        if self._writer:
+            try:
+                self._writer.close()
+            except IOError:
+                pass
+            self._writer = None
+
+    def read(self, max_docs):
+        """Return up to ``max_docs`` documents after the cursor and the position
+        to :meth:`commit` once they are safely shipped."""
+        with self._lock:
+            while True:
+                segments = self._segments()
+                if not segments:
+                    return [], None
+                seq, offset = self._cursor
+                if seq not in segments:
+                    seq, offset = segments[0], 0
+                path = self._segment_path(seq)
+                docs = []
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    for line in f:
+                        if not line.endswith(b'\n'):
+                            break
+                        docs.append(line[:-1])
+                        offset += len(line)
+                        if len(docs) >= max_docs:
+                            break
+                if docs:
+                    return docs, (seq, offset)
+                # Segment fully shipped; stop appending to it if it is the active one
+                if seq == self._write_seq:
+                    self._close_writer()
+                self._size -= os.path.getsize(path)
+                os.unlink(path)
+                self._cursor = (seq + 1, 0)
+                self._save_cursor()
+
+    def commit(self, position):
+        with self._lock:
+            self._cursor = position
+            self._save_cursor()
+
+    def _save_cursor(self):
+        try:
+            atomic_write_json(self._cursor_path, {'segment': self._cursor[0], 'offset': self._cursor[1]})
+        except OSError as e:
+            logger.error(f"Failed to save spool cursor: {str(e)}")
+            error_counter.labels(type='spool_cursor').inc()
@@ -0,0 +1,117 @@
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+
+from prometheus_client import CollectorRegistry, multiprocess, start_http_server
+
+from topk import HeavyHitterFiles
+import workers
+
+logger = logging.getLogger(__name__)
+
+# Worker processes; 1 runs http_log_server.py directly, as before
+LOGGING_SERVICE_WORKERS = int(os.getenv('LOGGING_SERVICE_WORKERS', '1'))
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR', os.path.join(workers.STATE_ROOT, 'prometheus'))
+RESTART_DELAY = 1
+SERVER = 'http_log_server.py'
+
+
+class Supervisor:
+    """Runs ``count`` copies of the logging service and keeps them running.
+
+    Every worker binds the ingest port with ``SO_REUSEPORT``, so the kernel
+    spreads Kong's connections over them, tails its own share of the File
+    Log files and keeps its own state directory, spool and archive file
+    (``logs-<id>.json``). The rollup and usage databases and the time
+    index are shared. Workers write their Prometheus samples to
+    ``PROMETHEUS_MULTIPROC_DIR``; the supervisor serves the merged view on
+    port 8001, together with the heavy hitters the workers save. SIGHUP is
+    forwarded so logrotate can have every archive reopened.
+    """
+
+    def __init__(self, count=LOGGING_SERVICE_WORKERS, multiproc_dir=PROMETHEUS_MULTIPROC_DIR):
+        self.count = count
+        self.multiproc_dir = multiproc_dir
+        self.processes = {}
+        self.stopping = False
+
+    def _environment(self, worker_id):
+        env = dict(os.environ)
+        env.update({
+            'LOGGING_SERVICE_WORKER_ID': str(worker_id),
+            'LOGGING_SERVICE_WORKER_COUNT': str(self.count),
+            'STATE_DIR': workers.worker_state_dir(worker_id),
+            'ARCHIVE_FILE': f'/app/logs/logs-{worker_id}.json',
+            'PROMETHEUS_MULTIPROC_DIR': self.multiproc_dir,
+        })
+        return env
+
+    def _spawn(self, worker_id):
+        os.makedirs(workers.worker_state_dir(worker_id), exist_ok=True)
+        process = subprocess.Popen([sys.executable, SERVER], env=self._environment(worker_id))
+        self.processes[worker_id] = process
+        logger.info(f"Started worker {worker_id} (pid {process.pid})")
+
+    def _signal_workers(self, signum):
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.send_signal(signum)
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+        self._signal_workers(signal.SIGTERM)
+
+    def _start_exporter(self):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=self.multiproc_dir)
+        registry.register(HeavyHitterFiles([
+            os.path.join(workers.worker_state_dir(i), 'heavy_hitters.json') for i in range(self.count)
+        ]))
+        start_http_server(8001, registry=registry)
+        logger.info("Started Prometheus metrics server on port 8001")
+
+    def run(self):
+        # Samples of a previous run's processes would be merged in otherwise
+        shutil.rmtree(self.multiproc_dir, ignore_errors=True)
+        os.makedirs(self.multiproc_dir)
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGHUP, lambda signum, frame: self._signal_workers(signal.SIGHUP))
+        self._start_exporter()
+        for worker_id in range(self.count):
+            self._spawn(worker_id)
+        while not self.stopping:
+            time.sleep(RESTART_DELAY)
+            for worker_id, process in list(self.processes.items()):
+                if process.poll() is None or self.stopping:
+                    continue
+                logger.error(f"Worker {worker_id} exited with status {process.returncode}, restarting it")
+                multiprocess.mark_process_dead(process.pid, self.multiproc_dir)
+                self._spawn(worker_id)
+        for process in self.processes.values():
+            process.wait()
+        return 0
+
+
+def main():
+    if LOGGING_SERVICE_WORKERS <= 1:
+        os.execv(sys.executable, [sys.executable, SERVER] + sys.argv[1:])
+    os.makedirs('/app/service_logs', exist_ok=True)
+    logging.basicConfig(
+        level=os.getenv('LOG_LEVEL', 'INFO'),
+        format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
+        handlers=[
+            logging.FileHandler('/app/service_logs/service.log'),
+            logging.StreamHandler()
+        ]
+    )
+    logger.info(f"Supervising {LOGGING_SERVICE_WORKERS} logging service workers")
+    return Supervisor().run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import struct
+import time
+
+from checkpoints import CheckpointStore, fingerprint
+from logfiles import JSON_LOG_FILES, LOG_DIR
+from metrics import error_counter
+import fastjson
+import pipeline
+import workers
+
+logger = logging.getLogger(__name__)
+
+# Persisted read offsets of the File Log plugin files
+checkpoints = CheckpointStore()
+# Save checkpoints while working through a large backlog, not only at the end
+CHECKPOINT_EVERY_LINES = 10000
+# Upper bound on how often checkpoints are fsync'd while lines keep arriving
+CHECKPOINT_INTERVAL = float(os.getenv('TAIL_CHECKPOINT_INTERVAL', '1.0'))
+# Full pass over every file even without events, in case one was missed
+RESCAN_INTERVAL = float(os.getenv('TAIL_RESCAN_INTERVAL', '30'))
+# Stat interval when inotify is not available (e.g. some bind mounts)
+POLL_INTERVAL = float(os.getenv('TAIL_POLL_INTERVAL', '1.0'))
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class LogWatcher:
+    """Reports which of ``names`` in ``directory`` changed.
+
+    Uses an inotify watch on the directory when the kernel supports it, so
+    the tailer sleeps until Kong actually writes, and falls back to
+    comparing ``stat`` results every ``poll_interval`` seconds otherwise.
+    """
+
+    def __init__(self, directory, names, poll_interval=POLL_INTERVAL):
+        self.directory = directory
+        self.names = set(names)
+        self.poll_interval = poll_interval
+        self._fd = self._init_inotify()
+        self._stats = {}
+        if self._fd is None:
+            logger.warning(f"inotify unavailable, polling {directory} every {poll_interval}s")
+            self._stats = self._stat_all()
+
+    def _init_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+            mask = IN_MODIFY | IN_CREATE | IN_MOVED_FROM | IN_MOVED_TO
+            if libc.inotify_add_watch(fd, os.fsencode(self.directory), mask) < 0:
+                errno = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(errno, f'inotify_add_watch failed for {self.directory}')
+            return fd
+        except (OSError, AttributeError) as e:
+            logger.debug(f"Cannot use inotify: {str(e)}")
+            return None
+
+    def wait(self, timeout):
+        """Block up to ``timeout`` seconds and return the set of changed names."""
+        if self._fd is None:
+            return self._poll(timeout)
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        changed = set()
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return changed
+        pos = 0
+        while pos < len(data):
+            _, mask, _, length = INOTIFY_EVENT.unpack_from(data, pos)
+            pos += INOTIFY_EVENT.size
+            name = data[pos:pos + length].rstrip(b'\0').decode('utf-8', 'replace')
+            pos += length
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("inotify queue overflowed, rescanning all log files")
+                return set(self.names)
+            if name in self.names:
+                changed.add(name)
+        return changed
+
+    def _stat_all(self):
+        stats = {}
+        for name in self.names:
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+                stats[name] = (st.st_ino, st.st_size, st.st_mtime_ns)
+            except FileNotFoundError:
+                stats[name] = None
+        return stats
+
+    def _poll(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            time.sleep(min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+            stats = self._stat_all()
+            changed = {name for name in self.names if stats[name] != self._stats.get(name)}
+            self._stats = stats
+            if changed or time.monotonic() >= deadline:
+                return changed
+
+
+def process_log_line(line, file_name):
+    """Ingest one line (bytes or memoryview) and return the parsed log, or None if it was unusable."""
+    try:
+        log = fastjson.loads(line)
+        pipeline.ingest(log, source=file_name, raw=line)
+        return log
+    except json.JSONDecodeError as e:
+        logger.warning(f"Invalid JSON in {file_name}: {str(e)}")
+        error_counter.labels(type='json_parse').inc()
+    except KeyError as e:
+        logger.warning(f"Missing key in log {file_name}: {str(e)}")
+        error_counter.labels(type='key_error').inc()
+
+
+def save_state():
+    pipeline.save_state()
+    checkpoints.save()
+
+
+def rebuild_aggregates(names):
+    """Recount the already checkpointed part of each file.
+
+    Only needed when checkpoints exist but the aggregates snapshot does not,
+    e.g. on the first start after upgrading; nothing is shipped again.
+    """
+    logger.info("No aggregates snapshot found, recounting checkpointed log lines")
+    for file_name in names:
+        log_file = os.path.join(LOG_DIR, file_name)
+        checkpoint = checkpoints.get(log_file)
+        if not checkpoint:
+            continue
+        try:
+            with open(log_file, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                if (stat.st_dev, stat.st_ino) != (checkpoint['dev'], checkpoint['ino']):
+                    continue
+                for offset, line in fastjson.iter_lines(f, 0):
+                    if offset >= checkpoint['offset']:
+                        break
+                    try:
+                        pipeline.aggregates.observe(fastjson.loads(line))
+                    except ValueError:
+                        continue
+        except IOError as e:
+            logger.error(f"Error recounting {file_name}: {str(e)}")
+            error_counter.labels(type='file_read').inc()
+    pipeline.save_state()
+
+
+def read_complete_lines(f, log_file, stat, offset):
+    """Process every complete line of ``f`` after ``offset`` and return the new offset.
+
+    Offsets are recorded against ``log_file`` and the (device, inode) in
+    ``stat``, which for a rotated file is the old inode of the live path.
+    """
+    file_name = os.path.basename(log_file)
+    lines = 0
+    for line_offset, line in fastjson.iter_lines(f, offset):
+        log = process_log_line(line, file_name)
+        if log is not None:
+            pipeline.time_index.record(stat, line_offset, log.get('started_at'))
+        offset = line_offset + len(line) + 1
+        lines += 1
+        if lines % CHECKPOINT_EVERY_LINES == 0:
+            checkpoints.set(log_file, stat.st_dev, stat.st_ino, offset, fingerprint(f, offset))
+            save_state()
+    checkpoints.set(log_file, stat.st_dev, stat.st_ino, offset, fingerprint(f, offset))
+    return offset
+
+
+def drain_rotated_file(log_file, checkpoint):
+    """Finish the file logrotate moved to ``<log_file>.1`` from its checkpoint."""
+    rotated_file = log_file + '.1'
+    try:
+        with open(rotated_file, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if (stat.st_dev, stat.st_ino) == (checkpoint['dev'], checkpoint['ino']):
+                logger.info(f"Finishing rotated file {rotated_file} from offset {checkpoint['offset']}")
+                read_complete_lines(f, log_file, stat, checkpoint['offset'])
+                return
+    except FileNotFoundError:
+        pass
+    logger.warning(f"{log_file} was rotated but its previous file was not found, "
+                   f"lines after offset {checkpoint['offset']} may be missing")
+    error_counter.labels(type='rotation_gap').inc()
+
+
+def tail_log_file(log_file):
+    """Ship the lines appended to ``log_file`` since its checkpoint."""
+    checkpoint = checkpoints.get(log_file)
+    with open(log_file, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        offset = 0
+        if checkpoint and (checkpoint['dev'], checkpoint['ino']) == (stat.st_dev, stat.st_ino):
+            offset = checkpoint['offset']
+            if stat.st_size < offset or fingerprint(f, offset) != checkpoint['crc']:
+                logger.warning(f"{log_file} was truncated, reading it from the start")
+                offset = 0
+        elif checkpoint:
+            drain_rotated_file(log_file, checkpoint)
+        read_complete_lines(f, log_file, stat, offset)
+
+
+def tail_files(names):
+    for file_name in names:
+        try:
+            tail_log_file(os.path.join(LOG_DIR, file_name))
+        except FileNotFoundError:
+            logger.debug(f"{file_name} does not exist yet")
+        except IOError as e:
+            logger.error(f"Error reading {file_name}: {str(e)}")
+            error_counter.labels(type='file_read').inc()
+
+
+def process_file_logs():
+    """Tail the JSON File Log plugin logs in /app/logs as Kong appends to them.
+
+    With several worker processes, each one tails its own share of the files.
+    """
+    names = workers.shard(JSON_LOG_FILES)
+    logger.info(f"Tailing {', '.join(names) or 'no files'}")
+    watcher = LogWatcher(LOG_DIR, names)
+    if not pipeline.aggregates.loaded:
+        rebuild_aggregates(names)
+    # Catch up on whatever was written while the service was down
+    changed = set(names)
+    last_rescan = last_save = time.monotonic()
+    while True:
+        try:
+            tail_files(changed)
+            if time.monotonic() - last_save >= CHECKPOINT_INTERVAL:
+                save_state()
+                last_save = time.monotonic()
+            changed = watcher.wait(timeout=CHECKPOINT_INTERVAL)
+            if time.monotonic() - last_rescan >= RESCAN_INTERVAL:
+                changed = set(names)
+                last_rescan = time.monotonic()
+        except Exception as e:
+            logger.error(f"Error processing file logs: {str(e)}")
+            error_counter.labels(type='file_processing').inc()
+            time.sleep(1)
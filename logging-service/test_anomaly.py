@@ -0,0 +1,44 @@
+import unittest
+
+from anomaly import AnomalyDetector
+
+
+def log(status=200, latency=20, uri='/api/manga/'):
+    return {'request': {'uri': uri}, 'response': {'status': status}, 'latencies': {'request': latency}}
+
+
+class AnomalyDetectorTests(unittest.TestCase):
+    def setUp(self):
+        self.detector = AnomalyDetector(warmup=5, min_requests=20, alert_log=None)
+
+    def tick(self, count, **kwargs):
+        for _ in range(count):
+            self.detector.observe(log(**kwargs))
+        return self.detector.evaluate(now=0)
+
+    def flag_errors(self):
+        for _ in range(10):
+            self.assertEqual(self.tick(50), [])
+        events = self.tick(50, status=500)
+        self.assertEqual([(e['signal'], e['state']) for e in events], [('error_ratio', 'firing')])
+
+    def test_recovery_resolves(self):
+        self.flag_errors()
+        events = self.tick(50)
+        self.assertEqual([(e['signal'], e['state']) for e in events], [('error_ratio', 'resolved')])
+
+    def test_traffic_stopping_resolves(self):
+        self.flag_errors()
+        events = self.tick(0)
+        self.assertEqual([(e['signal'], e['state'], e['reason']) for e in events],
+                         [('error_ratio', 'resolved', 'low_traffic')])
+        # Resolved once, not on every quiet interval
+        self.assertEqual(self.tick(3, status=500), [])
+
+    def test_quiet_routes_are_not_scored(self):
+        for _ in range(10):
+            self.assertEqual(self.tick(5, status=500), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import os
+import tempfile
+import unittest
+
+from archive import ArchiveWriter, bytes_counter, lines_counter
+
+
+class ArchiveWriterTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.path = os.path.join(self.dir.name, 'logs.json')
+
+    def test_counts_written_lines_and_bytes(self):
+        lines_before, bytes_before = lines_counter._value.get(), bytes_counter._value.get()
+        writer = ArchiveWriter(path=self.path, fsync_interval=0.05)
+        writer.start()
+        lines = [b'{"n": %d}\n' % i for i in range(3)]
+        for line in lines:
+            writer.append(line, 0)
+        writer.stop()
+
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b''.join(lines))
+        self.assertEqual(lines_counter._value.get() - lines_before, 3)
+        self.assertEqual(bytes_counter._value.get() - bytes_before, sum(map(len, lines)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+from dedup import RecentRequests
+
+
+def log(request_id):
+    return {'request': {'id': request_id}}
+
+
+def ingest_share(path, ids, results):
+    # One worker process: its own RecentRequests over the shared database
+    recent = RecentRequests(path=path)
+    results.put([i for i in ids if recent.first(log(i))])
+
+
+class RecentRequestsTests(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'dedup.db')
+
+    def clock(self):
+        return self.now
+
+    def test_window(self):
+        recent = RecentRequests(window=60, clock=self.clock)
+        self.assertTrue(recent.first(log('a')))
+        self.assertFalse(recent.first(log('a')))
+        self.assertTrue(recent.first({'request': {}}))
+        self.assertTrue(recent.first({'request': {}}))
+        self.now += 61
+        self.assertTrue(recent.first(log('a')))
+
+    def test_workers_share_the_seen_requests(self):
+        http_log = RecentRequests(window=60, path=self.path, clock=self.clock)
+        file_log = RecentRequests(window=60, path=self.path, clock=self.clock)
+        self.assertTrue(http_log.first(log('a')))
+        self.assertFalse(file_log.first(log('a')))
+        self.assertTrue(file_log.first(log('b')))
+        self.assertFalse(http_log.first(log('b')))
+        self.now += 61
+        self.assertTrue(file_log.first(log('a')))
+        self.assertFalse(http_log.first(log('a')))
+
+    def test_worker_processes_ingest_each_request_once(self):
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        ids = [f'request-{i}' for i in range(200)]
+        # Both copies of every request, one to each worker
+        processes = [context.Process(target=ingest_share, args=(self.path, ids, results)) for _ in range(2)]
+        for process in processes:
+            process.start()
+        ingested = results.get(timeout=30) + results.get(timeout=30)
+        for process in processes:
+            process.join()
+        self.assertEqual(sorted(ingested), sorted(ids))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+from bisect import bisect_left, bisect_right
+
+from metrics import error_counter
+import fastjson
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = os.getenv('TIME_INDEX_DIR', '/app/state/index')
+# A sparse entry is written every this many lines or this many milliseconds of log time
+INDEX_EVERY_LINES = int(os.getenv('TIME_INDEX_EVERY_LINES', '1000'))
+INDEX_EVERY_MS = int(os.getenv('TIME_INDEX_EVERY_MS', '60000'))
+# Kong writes a line when the request finishes, so started_at is only roughly
+# ordered in a file; requests can take up to the 60s upstream timeout
+MAX_DISORDER_MS = int(os.getenv('TIME_INDEX_MAX_DISORDER_MS', '60000'))
+
+ENTRY = struct.Struct('<QQ')
+
+
+class _FileIndex:
+    def __init__(self, path):
+        self.path = path
+        self.offsets = []
+        self.stamps = []
+        self.lines_since = INDEX_EVERY_LINES
+        self.max_seen = 0
+        self.file = None
+
+
+class TimeIndexStore:
+    """Sparse ``started_at`` -> byte offset indexes of Kong log files.
+
+    Every ``every_lines`` lines or ``every_ms`` of log time, the writer of a
+    file records the offset of the next line together with the highest
+    ``started_at`` seen so far in that file. Using the running maximum keeps
+    the timestamps sorted, so a time range maps to a byte range with two
+    binary searches, and every line before an entry is known to be no later
+    than the entry's timestamp. Indexes are keyed by (device, inode) so a
+    rotated file keeps its index, and live in ``directory`` as fixed-size
+    binary records.
+
+    Each file has a single writer, but with several worker processes the
+    reader may be another process: indexes this process records are kept
+    in memory, any other index is read from its file when queried.
+    """
+
+    def __init__(self, directory=INDEX_DIR, every_lines=INDEX_EVERY_LINES, every_ms=INDEX_EVERY_MS):
+        self.directory = directory
+        self.every_lines = every_lines
+        self.every_ms = every_ms
+        self._lock = threading.Lock()
+        # Indexes recorded by this process
+        self._indexes = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _index_path(self, key):
+        return os.path.join(self.directory, f'{key[0]}-{key[1]}.idx')
+
+    @staticmethod
+    def _read_entries(path):
+        """(offsets, stamps) stored in an index file, ignoring a torn last record."""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return [], []
+        entries = list(ENTRY.iter_unpack(data[:len(data) - len(data) % ENTRY.size]))
+        return [offset for offset, _ in entries], [stamp for _, stamp in entries]
+
+    def _load(self, key):
+        """Start recording ``key``, resuming the index a previous run left."""
+        index = _FileIndex(self._index_path(key))
+        index.offsets, index.stamps = self._read_entries(index.path)
+        if index.stamps:
+            index.max_seen = index.stamps[-1]
+            index.lines_since = 0
+        self._indexes[key] = index
+        return index
+
+    def record(self, stat, offset, started_at):
+        """Called for every line written or read at ``offset`` of the file ``stat`` describes."""
+        if not isinstance(started_at, int):
+            return
+        key = (stat.st_dev, stat.st_ino)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                index = self._load(key)
+            if index.offsets and offset <= index.offsets[-1]:
+                return
+            due = (index.lines_since >= self.every_lines or
+                   (index.stamps and started_at - index.stamps[-1] >= self.every_ms))
+            index.max_seen = max(index.max_seen, started_at)
+            index.lines_since += 1
+            if not due:
+                return
+            index.offsets.append(offset)
+            index.stamps.append(index.max_seen)
+            index.lines_since = 1
+            try:
+                if index.file is None:
+                    index.file = open(index.path, 'ab')
+                index.file.write(ENTRY.pack(offset, index.max_seen))
+                index.file.flush()
+            except IOError as e:
+                logger.error(f"Failed to write time index {index.path}: {str(e)}")
+                error_counter.labels(type='time_index').inc()
+
+    def byte_range(self, stat, from_ms, to_ms):
+        """The part of a file that can hold lines with from_ms <= started_at < to_ms."""
+        key = (stat.st_dev, stat.st_ino)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                offsets, stamps = list(index.offsets), list(index.stamps)
+        if index is None:
+            offsets, stamps = self._read_entries(self._index_path(key))
+        if not offsets:
+            return 0, stat.st_size
+        start = 0
+        if from_ms is not None:
+            i = bisect_left(stamps, from_ms)
+            start = offsets[i - 1] if i > 0 else 0
+        end = stat.st_size
+        if to_ms is not None:
+            j = bisect_right(stamps, to_ms + MAX_DISORDER_MS)
+            end = offsets[j] if j < len(offsets) else stat.st_size
+        return start, end
+
+    def prune(self, directory):
+        """Forget the indexes of files that are no longer in ``directory``,
+        e.g. rotated files logrotate has compressed or deleted."""
+        live_keys = set()
+        for name in os.listdir(directory):
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except FileNotFoundError:
+                continue
+            live_keys.add((stat.st_dev, stat.st_ino))
+        with self._lock:
+            for name in os.listdir(self.directory):
+                if not name.endswith('.idx'):
+                    continue
+                dev, ino = name[:-len('.idx')].split('-')
+                key = (int(dev), int(ino))
+                if key in live_keys:
+                    continue
+                index = self._indexes.pop(key, None)
+                if index is not None and index.file:
+                    index.file.close()
+                try:
+                    os.unlink(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def scan(self, paths, from_ms=None, to_ms=None):
+        """Yield ``(raw line, log)`` for every line of ``paths`` in the time range.
+
+        Only the indexed byte range of each file is read, through ``mmap``.
+        """
+        for path in paths:
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                continue
+            with f:
+                stat = os.fstat(f.fileno())
+                start, end = self.byte_range(stat, from_ms, to_ms)
+                if start >= end:
+                    continue
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    pos = start
+                    while pos < end:
+                        newline = mm.find(b'\n', pos, stat.st_size)
+                        if newline == -1:
+                            break
+                        line_start, pos = pos, newline + 1
+                        # Skip lines outside the range without copying or decoding them
+                        started_at = fastjson.peek_int(mm, b'started_at', line_start, newline)
+                        if started_at is not None and not _in_range(started_at, from_ms, to_ms):
+                            continue
+                        line = mm[line_start:newline]
+                        try:
+                            log = fastjson.loads(line)
+                        except ValueError:
+                            continue
+                        started_at = log.get('started_at')
+                        if isinstance(started_at, int) and _in_range(started_at, from_ms, to_ms):
+                            yield line, log
+
+
+def _in_range(started_at, from_ms, to_ms):
+    return (from_ms is None or started_at >= from_ms) and (to_ms is None or started_at < to_ms)
@@ -0,0 +1,230 @@
+import heapq
+import os
+import threading
+import time
+import zlib
+
+from prometheus_client.core import GaugeMetricFamily
+
+from persistence import load_json
+
+# Tracked keys per dimension and sub-window, and Count-Min dimensions
+TOPK_CAPACITY = int(os.getenv('TOPK_CAPACITY', '500'))
+CMS_WIDTH = int(os.getenv('TOPK_CMS_WIDTH', '2048'))
+CMS_DEPTH = int(os.getenv('TOPK_CMS_DEPTH', '4'))
+# Sliding window covered by the heavy hitters, as a ring of sub-windows
+TOPK_WINDOW_SECONDS = int(os.getenv('TOPK_WINDOW_SECONDS', '300'))
+TOPK_SUB_WINDOWS = int(os.getenv('TOPK_SUB_WINDOWS', '5'))
+# Heavy hitters per dimension exported to Prometheus
+TOPK_EXPORTED = int(os.getenv('TOPK_EXPORTED', '10'))
+
+DIMENSIONS = ('client_ip', 'consumer', 'uri')
+
+
+class SpaceSaving:
+    """Space-Saving top-K summary over at most ``capacity`` keys.
+
+    A key that is not tracked while the summary is full replaces the key
+    with the smallest count and inherits that count as its ``error``, so
+    every reported count overestimates the true one by at most ``error``
+    and any key with more than N / capacity occurrences is guaranteed to be
+    tracked. The smallest key is found through a heap with lazily updated
+    entries.
+    """
+
+    def __init__(self, capacity=TOPK_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        self._heap = []
+
+    def add(self, key, count=1):
+        entry = self.counts.get(key)
+        if entry is not None:
+            entry[0] += count
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[key] = [count, 0]
+            heapq.heappush(self._heap, (count, key))
+            return
+        while True:
+            smallest, victim = self._heap[0]
+            current = self.counts.get(victim)
+            if current is not None and current[0] == smallest:
+                break
+            # Stale heap entry: the key was incremented or evicted since
+            heapq.heappop(self._heap)
+            if current is not None:
+                heapq.heappush(self._heap, (current[0], victim))
+        heapq.heappop(self._heap)
+        del self.counts[victim]
+        self.counts[key] = [smallest + count, smallest]
+        heapq.heappush(self._heap, (smallest + count, key))
+
+    def merge(self, other):
+        for key, (count, error) in other.counts.items():
+            entry = self.counts.get(key)
+            if entry is None:
+                self.counts[key] = [count, error]
+            else:
+                entry[0] += count
+                entry[1] += error
+        if len(self.counts) > self.capacity:
+            kept = heapq.nlargest(self.capacity, self.counts.items(), key=lambda item: item[1][0])
+            self.counts = dict(kept)
+        self._rebuild_heap()
+        return self
+
+    def _rebuild_heap(self):
+        self._heap = [(count, key) for key, (count, _) in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def top(self, k):
+        """The ``k`` largest keys as (key, count, error), largest first."""
+        return [(key, count, error) for key, (count, error)
+                in heapq.nlargest(k, self.counts.items(), key=lambda item: item[1][0])]
+
+    def to_dict(self):
+        return {'capacity': self.capacity, 'counts': self.counts}
+
+    @classmethod
+    def from_dict(cls, data):
+        summary = cls(capacity=data['capacity'])
+        summary.counts = {key: list(entry) for key, entry in data['counts'].items()}
+        summary._rebuild_heap()
+        return summary
+
+
+class CountMin:
+    """Count-Min sketch: an upper bound on any key's count in fixed memory."""
+
+    def __init__(self, width=CMS_WIDTH, depth=CMS_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.rows = [[0] * width for _ in range(depth)]
+
+    def _cells(self, key):
+        data = key.encode('utf-8', 'replace')
+        return [zlib.crc32(data, seed) % self.width for seed in range(self.depth)]
+
+    def add(self, key, count=1):
+        for row, cell in zip(self.rows, self._cells(key)):
+            row[cell] += count
+
+    def estimate(self, key):
+        return min(row[cell] for row, cell in zip(self.rows, self._cells(key)))
+
+
+class _SubWindow:
+    def __init__(self, capacity, width, depth):
+        self.summaries = {d: SpaceSaving(capacity) for d in DIMENSIONS}
+        self.sketches = {d: CountMin(width, depth) for d in DIMENSIONS}
+
+
+class HeavyHitters:
+    """Top client IPs, consumers and URI paths over a sliding window.
+
+    The window is a ring of ``sub_windows`` sub-windows, each with a
+    :class:`SpaceSaving` summary and a :class:`CountMin` sketch per
+    dimension; the oldest sub-window is dropped as time moves on and
+    queries merge the ring. Memory is fixed by the capacity and sketch
+    size, whatever the number of distinct clients. Registered as a
+    Prometheus collector, it exports the current top keys of each
+    dimension.
+    """
+
+    def __init__(self, window_seconds=TOPK_WINDOW_SECONDS, sub_windows=TOPK_SUB_WINDOWS,
+                 capacity=TOPK_CAPACITY, width=CMS_WIDTH, depth=CMS_DEPTH, clock=time.time):
+        self.window_seconds = window_seconds
+        self.sub_seconds = window_seconds / sub_windows
+        self.capacity = capacity
+        self.width = width
+        self.depth = depth
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._ring = [self._new_sub_window() for _ in range(sub_windows)]
+        self._current = int(clock() // self.sub_seconds)
+
+    def _new_sub_window(self):
+        return _SubWindow(self.capacity, self.width, self.depth)
+
+    def _advance(self):
+        current = int(self._clock() // self.sub_seconds)
+        for _ in range(min(current - self._current, len(self._ring))):
+            self._ring.pop(0)
+            self._ring.append(self._new_sub_window())
+        self._current = max(current, self._current)
+
+    def observe(self, log):
+        keys = {
+            'client_ip': log.get('client_ip') or 'unknown',
+            'consumer': (log.get('consumer') or {}).get('username') or 'anonymous',
+            'uri': (log.get('request', {}).get('uri') or '').split('?', 1)[0] or 'unknown',
+        }
+        with self._lock:
+            self._advance()
+            sub_window = self._ring[-1]
+            for dimension, key in keys.items():
+                sub_window.summaries[dimension].add(key)
+                sub_window.sketches[dimension].add(key)
+
+    def top(self, dimension, k=10):
+        """The ``k`` heaviest keys of ``dimension`` in the window as dicts."""
+        with self._lock:
+            self._advance()
+            merged = SpaceSaving(self.capacity)
+            for sub_window in self._ring:
+                merged.merge(sub_window.summaries[dimension])
+        return [{'key': key, 'count': count, 'error': error} for key, count, error in merged.top(k)]
+
+    def estimate(self, dimension, key):
+        """Upper bound on the requests of ``key`` in the window."""
+        with self._lock:
+            self._advance()
+            return sum(sub_window.sketches[dimension].estimate(key) for sub_window in self._ring)
+
+    def to_dict(self):
+        """The window merged into one summary per dimension, for other processes to merge."""
+        with self._lock:
+            self._advance()
+            summaries = {}
+            for dimension in DIMENSIONS:
+                merged = SpaceSaving(self.capacity)
+                for sub_window in self._ring:
+                    merged.merge(sub_window.summaries[dimension])
+                summaries[dimension] = merged.to_dict()
+        return {'window_seconds': self.window_seconds, 'summaries': summaries}
+
+    def collect(self):
+        gauge = GaugeMetricFamily('logging_service_heavy_hitter_requests',
+                                  f'Requests of the top keys per dimension over the last {self.window_seconds}s',
+                                  labels=['dimension', 'key'])
+        for dimension in DIMENSIONS:
+            for entry in self.top(dimension, TOPK_EXPORTED):
+                gauge.add_metric([dimension, entry['key']], entry['count'])
+        yield gauge
+
+
+def merge_top(states, dimension, k):
+    """Top ``k`` keys of ``dimension`` over several :meth:`HeavyHitters.to_dict` states."""
+    merged = SpaceSaving(TOPK_CAPACITY)
+    for state in states:
+        merged.merge(SpaceSaving.from_dict(state['summaries'][dimension]))
+    return [{'key': key, 'count': count, 'error': error} for key, count, error in merged.top(k)]
+
+
+class HeavyHitterFiles:
+    """Prometheus collector exporting the heavy hitters of all worker
+    processes from the states they save to ``paths``."""
+
+    def __init__(self, paths):
+        self.paths = paths
+
+    def collect(self):
+        states = [state for state in (load_json(path) for path in self.paths) if state]
+        gauge = GaugeMetricFamily('logging_service_heavy_hitter_requests',
+                                  'Requests of the top keys per dimension over the sliding window',
+                                  labels=['dimension', 'key'])
+        for dimension in DIMENSIONS:
+            for entry in merge_top(states, dimension, TOPK_EXPORTED):
+                gauge.add_metric([dimension, entry['key']], entry['count'])
+        yield gauge
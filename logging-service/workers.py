@@ -0,0 +1,33 @@
+import os
+
+# Set by supervisor.py in the environment of each worker process
+WORKER_ID = int(os.getenv('LOGGING_SERVICE_WORKER_ID', '0'))
+WORKER_COUNT = int(os.getenv('LOGGING_SERVICE_WORKER_COUNT', '1'))
+
+STATE_ROOT = '/app/state'
+
+
+def multiprocess():
+    """Whether this process is one of several workers run by the supervisor."""
+    return WORKER_COUNT > 1
+
+
+def worker_state_dir(worker_id):
+    """Private state directory (aggregates, checkpoints, spool) of one worker."""
+    return os.path.join(STATE_ROOT, f'worker-{worker_id}')
+
+
+def peer_state_dirs():
+    """State directories of the other workers, whose snapshots are merged into this one's views."""
+    if not multiprocess():
+        return []
+    return [worker_state_dir(i) for i in range(WORKER_COUNT) if i != WORKER_ID]
+
+
+def shard(names):
+    """The names this worker is responsible for, e.g. which log files it tails.
+
+    Names are dealt round-robin in sorted order, which spreads the fixed
+    list of Kong log files more evenly over the workers than hashing would.
+    """
+    return [name for i, name in enumerate(sorted(names)) if i % WORKER_COUNT == WORKER_ID]